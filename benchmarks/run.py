@@ -0,0 +1,215 @@
+import os
+import sys
+import json
+import argparse
+import tempfile
+import subprocess
+from datetime import datetime, timezone
+
+from gtfs_pipeline.processor import process_single_gtfs_zip, stops_bymodes
+from gtfs_pipeline.network import compute_isochrones
+from gtfs_pipeline.analysis import (
+    stop_significance, compute_factor_e, bus_compute_factor_s, rail_compute_factor_s,
+    compute_factor_f, compute_factor_q, calendar_varies,
+)
+from gtfs_pipeline.amenities import clear_amenity_cache
+from gtfs_pipeline.interpolation import interpolate_roads
+from gtfs_pipeline.scoring import scoring_combined
+from gtfs_pipeline.netscore import node_significance, network_scoring_combined
+from gtfs_pipeline.results import transit_score
+from gtfs_pipeline.plot import plot
+from gtfs_pipeline.metrics import RunMetrics
+
+from benchmarks.synthetic import scaled, grid_walk_graph, street_layer, gtfs_zip, amenity_scores
+
+RAIL_TYPES = [0, 1, 2, 5, 12]
+TAG = "bench"
+
+# Timed stages, in pipeline order
+STAGES = (
+    'process_single_gtfs_zip', 'stops_bymodes', 'compute_isochrones',
+    'compute_factor_e', 'bus_compute_factor_s', 'rail_compute_factor_s', 'compute_factor_f', 'compute_factor_q',
+    'stop_significance', 'interpolate_roads', 'scoring', 'network_scoring', 'plot',
+)
+DEFAULT_SCALES = (1, 10, 100)
+DEFAULT_RESULTS = os.path.join(os.path.dirname(__file__), "results.jsonl")
+
+
+def run_scale(factor, data_dir, repeat=3, seed=0, stages=None):
+    # Generates the synthetic city for one scale factor and times every stage `repeat` times.
+    # Returns one record per (repetition, stage); stages limits which ones are recorded (all still run).
+    scale = scaled(factor)
+    folder = os.path.join(data_dir, f"scale_{factor:g}")
+    zip_path = gtfs_zip(os.path.join(folder, "gtfs.zip"), scale, seed=seed)
+    G = grid_walk_graph(scale, seed=seed)
+    streets = street_layer(G, scale.n_streets, seed=seed)
+    target_crs = streets.estimate_utm_crs()
+    streets_utm = streets.to_crs(target_crs)
+    print(f"Scale {factor:g}x: {scale.n_stops} stops, {scale.n_routes} routes, "
+          f"{G.number_of_nodes()} walk nodes, {len(streets)} streets")
+
+    records = []
+    for rep in range(repeat):
+        metrics = RunMetrics(verbose=False)
+        _run_once(metrics, zip_path, G, streets, streets_utm, target_crs, folder, seed)
+        for record in metrics.stages:
+            if stages is None or record['stage'] in stages:
+                records.append({**record, 'scale': factor, 'repeat': rep})
+        print(f"  #{rep + 1}: " + ", ".join(f"{r['stage']} {r['wall_s']:.2f}s" for r in metrics.stages))
+    return records
+
+def _run_once(metrics, zip_path, G, streets, streets_utm, target_crs, folder, seed):
+    with metrics.stage('process_single_gtfs_zip') as stage:
+        merged, stops, *_ = process_single_gtfs_zip(zip_path, TAG)
+        stage.count(schedule_rows=len(merged), stops=len(stops))
+    with metrics.stage('stops_bymodes') as stage:
+        stops_gdf = stops_bymodes(merged, stops)
+        stage.count(stops=len(stops_gdf))
+
+    with metrics.stage('compute_isochrones') as stage:
+        isos_700_rail, isos_700_bus, isos_100_rail = compute_isochrones(stops_gdf, G)
+        stage.count(isochrones_700_bus=len(isos_700_bus), isochrones_700_rail=len(isos_700_rail), isochrones_100_rail=len(isos_100_rail))
+
+    # Amenity file of the raw stop ids (without the feed tag), rewritten per run so Q parses it cold
+    json_path = amenity_scores(os.path.join(folder, "all_scores.json"),
+                               stops['stop_id'].astype(str).str.removeprefix(f"{TAG}_"), seed=seed)
+    inventory_path = os.path.join(folder, "Inventory.csv")
+    clear_amenity_cache()
+
+    bus = stops_gdf[stops_gdf['route_type'] == 3]
+    rail = stops_gdf[stops_gdf['route_type'].isin(RAIL_TYPES)]
+    sched_bus = merged[(merged['route_type'] == 3).to_numpy()]
+    with metrics.stage('compute_factor_e') as stage:
+        stage.count(stops=len(compute_factor_e(bus)) + len(compute_factor_e(rail)))
+    with metrics.stage('bus_compute_factor_s') as stage:
+        stage.count(stops=len(bus_compute_factor_s(bus, bus, rail, isos_100_rail, target_crs)))
+    with metrics.stage('rail_compute_factor_s') as stage:
+        stage.count(stops=len(rail_compute_factor_s(stops_gdf, isos_100_rail)))
+    with metrics.stage('compute_factor_f') as stage:
+        factor_f = compute_factor_f(sched_bus, all_stop_ids=bus['stop_id'], varying_days=calendar_varies(sched_bus))
+        stage.count(schedule_rows=len(sched_bus), stops=len(factor_f))
+    with metrics.stage('compute_factor_q') as stage:
+        stage.count(stops=len(compute_factor_q(bus, TAG, target_crs, json_path=json_path, inventory_path=inventory_path)))
+
+    with metrics.stage('stop_significance') as stage:
+        bus_iso, rail_iso = stop_significance(
+            stops_gdf, stops_gdf, isos_100_rail, isos_700_bus, isos_700_rail, merged, target_crs, TAG,
+            amenity_scores_path=json_path, amenity_inventory_path=inventory_path,
+        )
+        stage.count(bus_stops=len(bus_iso), rail_stops=len(rail_iso))
+
+    with metrics.stage('interpolate_roads') as stage:
+        points = interpolate_roads(streets_utm, target_crs=target_crs)
+        stage.count(sample_points=len(points))
+    with metrics.stage('scoring') as stage:
+        isos = [iso for iso in (bus_iso, rail_iso) if not iso.empty]
+        attributes = scoring_combined(points, isos, streets, warn=False)
+        stage.count(links=len(attributes), joined_rows=attributes.attrs.get('joined_rows'))
+    with metrics.stage('network_scoring') as stage:
+        network_attributes = network_scoring_combined(points, node_significance(isos, stops_gdf, G), streets, warn=False)
+        stage.count(links=len(network_attributes), joined_rows=network_attributes.attrs.get('joined_rows'))
+
+    score = transit_score(attributes)
+    with tempfile.TemporaryDirectory() as tmp, metrics.stage('plot') as stage:
+        place = stops_gdf[['geometry']].dissolve()
+        plot(score, place, score_column="Transit_score", filename=os.path.join(tmp, "map.html"))
+        stage.count(links=len(score))
+
+
+##--------------------------------------------------------------------------
+## Result History
+##--------------------------------------------------------------------------
+
+def git_revision():
+    # (commit, dirty) of the working tree, or (None, None) outside a git checkout
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=root, capture_output=True, text=True, check=True).stdout.strip()
+        status = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=root,
+                                capture_output=True, text=True, check=True).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+    return commit, bool(status.strip())
+
+def append_results(path, records, meta):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'a') as f:
+        for record in records:
+            f.write(json.dumps({**meta, **record}, default=str) + "\n")
+
+def load_results(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def best_times(results, commit):
+    # {(scale, stage): fastest wall time} over every run of commits starting with `commit`
+    best = {}
+    for r in results:
+        if r.get('commit') and r['commit'].startswith(commit) and r.get('status', 'ok') == 'ok':
+            key = (r['scale'], r['stage'])
+            best[key] = min(best.get(key, float('inf')), r['wall_s'])
+    return best
+
+def compare(path, base, head=None):
+    # Fastest wall time per scale and stage of base vs head (default: the most recently benchmarked commit)
+    results = load_results(path)
+    if head is None:
+        head = results[-1]['commit']
+    before, after = best_times(results, base), best_times(results, head)
+    if not before:
+        raise ValueError(f"No results for commit {base!r} in {path}")
+    if not after:
+        raise ValueError(f"No results for commit {head!r} in {path}")
+
+    print(f"{'scale':>6}  {'stage':<24}{base[:10]:>12}{head[:10]:>12}{'speedup':>10}")
+    for scale, stage in sorted(set(before) & set(after), key=lambda k: (k[0], STAGES.index(k[1]) if k[1] in STAGES else len(STAGES))):
+        b, a = before[scale, stage], after[scale, stage]
+        speedup = f"{b / a:.2f}x" if a > 0 else "-"
+        print(f"{scale:>5g}x  {stage:<24}{b:>11.3f}s{a:>11.3f}s{speedup:>10}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.run", description="Offline pipeline benchmarks on synthetic cities")
+    sub = parser.add_subparsers(dest="command")
+    run = sub.add_parser("run", help="time every stage and append the results (default)")
+    run.add_argument("--scales", default=",".join(str(s) for s in DEFAULT_SCALES), help="comma-separated scale factors (1x = %(default)s)")
+    run.add_argument("--repeat", type=int, default=3)
+    run.add_argument("--seed", type=int, default=0)
+    run.add_argument("--stages", default=None, help="comma-separated stages to record (default: all)")
+    run.add_argument("--data-dir", default=None, help="keep the generated feeds here (default: a temporary folder)")
+    run.add_argument("--results", default=DEFAULT_RESULTS)
+    cmp = sub.add_parser("compare", help="fastest times of two benchmarked commits")
+    cmp.add_argument("base")
+    cmp.add_argument("head", nargs="?")
+    cmp.add_argument("--results", default=DEFAULT_RESULTS)
+    args = parser.parse_args(argv if argv is not None else (sys.argv[1:] or ["run"]))
+
+    if args.command == "compare":
+        compare(args.results, args.base, args.head)
+        return
+
+    scales = [float(s) for s in args.scales.split(",")]
+    stages = None if args.stages is None else set(args.stages.split(","))
+    unknown = sorted((stages or set()) - set(STAGES))
+    if unknown:
+        parser.error(f"unknown stages {unknown} (expected some of {list(STAGES)})")
+
+    commit, dirty = git_revision()
+    if dirty:
+        print("⚠️ Working tree has uncommitted changes; results are recorded with dirty=true")
+    meta = {
+        'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'commit': commit,
+        'dirty': dirty,
+        **{k: v for k, v in RunMetrics(verbose=False).meta.items() if k != 'run_id'},
+    }
+
+    with tempfile.TemporaryDirectory() as tmp:
+        data_dir = args.data_dir or tmp
+        for factor in scales:
+            records = run_scale(factor, data_dir, repeat=args.repeat, seed=args.seed, stages=stages)
+            append_results(args.results, records, meta)
+    print(f"✅ Benchmark results appended to {args.results}")
+
+if __name__ == "__main__":
+    main()
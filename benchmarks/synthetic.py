@@ -0,0 +1,164 @@
+import os
+import json
+import zipfile
+import numpy as np
+import pandas as pd
+import networkx as nx
+import geopandas as gpd
+import shapely
+from typing import NamedTuple
+
+# Synthetic city around this origin (Atlanta, like the sample corridor); grids grow north-east from it
+ORIGIN_LON, ORIGIN_LAT = -84.40, 33.75
+METRES_PER_DEG_LAT = 111_320.0
+
+
+class Scale(NamedTuple):
+    grid_side: int          # walk graph is grid_side x grid_side intersections
+    spacing: float          # metres between intersections
+    n_stops: int
+    n_routes: int
+    trips_per_route: int
+    stops_per_trip: int
+    n_streets: int
+
+# 1x is a few-km corridor; larger scales grow the area, stops, routes and streets together
+BASE_SCALE = Scale(grid_side=40, spacing=80.0, n_stops=300, n_routes=20, trips_per_route=30, stops_per_trip=15, n_streets=400)
+
+def scaled(factor: float, base: Scale = BASE_SCALE) -> Scale:
+    return base._replace(
+        grid_side=int(round(base.grid_side * np.sqrt(factor))),
+        n_stops=int(base.n_stops * factor),
+        n_routes=int(base.n_routes * factor),
+        n_streets=int(base.n_streets * factor),
+    )
+
+def extent_deg(scale: Scale):
+    # (width in degrees of longitude, height in degrees of latitude) of the grid
+    side = (scale.grid_side - 1) * scale.spacing
+    return side / (METRES_PER_DEG_LAT * np.cos(np.deg2rad(ORIGIN_LAT))), side / METRES_PER_DEG_LAT
+
+
+##--------------------------------------------------------------------------
+## Walk Network and Streets
+##--------------------------------------------------------------------------
+
+def grid_walk_graph(scale: Scale, seed: int = 0, drop: float = 0.1) -> nx.MultiDiGraph:
+    # Jittered grid with ~drop of the blocks missing, in the layout OSMnx returns (x/y nodes, length edges)
+    rng = np.random.default_rng(seed)
+    n = scale.grid_side
+    width, height = extent_deg(scale)
+    dlon, dlat = width / max(n - 1, 1), height / max(n - 1, 1)
+    j, i = np.meshgrid(np.arange(n), np.arange(n))
+    x = ORIGIN_LON + j.ravel() * dlon + rng.normal(0, dlon * 0.1, n * n)
+    y = ORIGIN_LAT + i.ravel() * dlat + rng.normal(0, dlat * 0.1, n * n)
+
+    node = np.arange(n * n).reshape(n, n)
+    u = np.concatenate([node[:, :-1].ravel(), node[:-1, :].ravel()])
+    v = np.concatenate([node[:, 1:].ravel(), node[1:, :].ravel()])
+    keep = rng.random(len(u)) > drop
+    u, v = u[keep], v[keep]
+    metres_x = (x[u] - x[v]) * METRES_PER_DEG_LAT * np.cos(np.deg2rad(ORIGIN_LAT))
+    metres_y = (y[u] - y[v]) * METRES_PER_DEG_LAT
+    length = np.hypot(metres_x, metres_y) * rng.uniform(1.0, 1.2, len(u))
+
+    G = nx.MultiDiGraph(crs="EPSG:4326")
+    G.add_nodes_from((k, {'x': float(x[k]), 'y': float(y[k])}) for k in range(n * n))
+    G.add_edges_from((int(a), int(b), {'length': float(L)}) for a, b, L in zip(u, v, length))
+    G.add_edges_from((int(b), int(a), {'length': float(L)}) for a, b, L in zip(u, v, length))
+    return G
+
+def street_layer(G: nx.MultiDiGraph, n_streets: int, seed: int = 0) -> gpd.GeoDataFrame:
+    # Street links along random graph edges, with a slightly bent midpoint, like the centerline input
+    rng = np.random.default_rng(seed)
+    edges = np.array([(u, v) for u, v in G.edges() if u < v])
+    pick = rng.choice(len(edges), min(n_streets, len(edges)), replace=False)
+    u, v = edges[pick, 0], edges[pick, 1]
+    xy = np.array([(G.nodes[k]['x'], G.nodes[k]['y']) for k in range(G.number_of_nodes())])
+    a, b = xy[u], xy[v]
+    mid = (a + b) / 2 + np.column_stack([rng.normal(0, 1e-5, len(pick)), np.zeros(len(pick))])
+    coords = np.stack([a, mid, b], axis=1).reshape(-1, 2)
+    lines = shapely.linestrings(coords, indices=np.repeat(np.arange(len(pick)), 3))
+    return gpd.GeoDataFrame({
+        'link_id': np.arange(len(pick)) + 1000,
+        'name': [f"Street {k % 37}" for k in range(len(pick))],
+    }, geometry=lines, crs="EPSG:4326")
+
+
+##--------------------------------------------------------------------------
+## GTFS Feed and Amenities
+##--------------------------------------------------------------------------
+
+def gtfs_zip(path: str, scale: Scale, seed: int = 0, rail_share: float = 0.2) -> str:
+    # Feed with weekday / Saturday / Sunday services, trips from 04:00 to past midnight,
+    # and a few missing or unpadded times like real feeds
+    rng = np.random.default_rng(seed)
+    width, height = extent_deg(scale)
+    n_stops, n_routes = scale.n_stops, scale.n_routes
+    stops = pd.DataFrame({
+        'stop_id': (100000 + np.arange(n_stops)).astype(str),
+        'stop_name': [f"S{k}" for k in range(n_stops)],
+        'stop_lat': ORIGIN_LAT + rng.uniform(0, height, n_stops),
+        'stop_lon': ORIGIN_LON + rng.uniform(0, width, n_stops),
+    })
+    routes = pd.DataFrame({
+        'route_id': [f"R{k}" for k in range(n_routes)],
+        'agency_id': 'A',
+        'route_short_name': np.arange(n_routes).astype(str),
+        'route_type': np.where(rng.random(n_routes) < rail_share, rng.choice([1, 2], n_routes), 3),
+    })
+    calendar = pd.DataFrame({
+        'service_id': ['WK', 'SA', 'SU'],
+        **{day: [1, 0, 0] for day in ['monday', 'tuesday', 'wednesday', 'thursday', 'friday']},
+        'saturday': [0, 1, 0], 'sunday': [0, 0, 1],
+        'start_date': '20260101', 'end_date': '20261231',
+    })
+
+    n_trips = n_routes * scale.trips_per_route
+    trip_route = np.repeat(np.arange(n_routes), scale.trips_per_route)
+    trips = pd.DataFrame({
+        'route_id': routes['route_id'].to_numpy()[trip_route],
+        'service_id': rng.choice(['WK', 'WK', 'SA', 'SU'], n_trips),
+        'trip_id': [f"T{k}" for k in range(n_trips)],
+        'direction_id': rng.integers(0, 2, n_trips),
+    })
+
+    # Every trip of a route serves the same stop sequence
+    per_trip = scale.stops_per_trip
+    sequence = np.argsort(rng.random((n_routes, n_stops)), axis=1)[:, :per_trip]
+    seq = np.tile(np.arange(per_trip), n_trips)
+    trip = np.repeat(np.arange(n_trips), per_trip)
+    seconds = np.repeat(rng.integers(4 * 3600, 25 * 3600, n_trips), per_trip) + seq * 120
+    hours = pd.Series(seconds // 3600).astype(str)
+    hours = hours.where(rng.random(len(seconds)) < 0.2, hours.str.zfill(2))
+    times = (hours + ':' + pd.Series((seconds % 3600) // 60).astype(str).str.zfill(2)
+             + ':' + pd.Series(seconds % 60).astype(str).str.zfill(2))
+    stop_times = pd.DataFrame({
+        'trip_id': trips['trip_id'].to_numpy()[trip],
+        'arrival_time': times.where(rng.random(len(times)) > 0.05, ''),
+        'departure_time': times.where(rng.random(len(times)) > 0.05, ''),
+        'stop_id': stops['stop_id'].to_numpy()[sequence[trip_route[trip], seq]],
+        'stop_sequence': seq,
+    })
+
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as z:
+        for name, df in [('stops.txt', stops), ('routes.txt', routes), ('calendar.txt', calendar),
+                         ('trips.txt', trips), ('stop_times.txt', stop_times)]:
+            z.writestr(name, df.to_csv(index=False))
+    return path
+
+def amenity_scores(path: str, stop_ids, seed: int = 0, coverage: float = 0.7) -> str:
+    # all_scores.json for a share of the (raw, untagged) stop ids
+    rng = np.random.default_rng(seed)
+    stop_ids = np.asarray(stop_ids, dtype=str)
+    chosen = stop_ids[rng.random(len(stop_ids)) < coverage]
+    flags = rng.random((len(chosen), 4)) < 0.4
+    data = {
+        stop_id: {'amenity_scores': {'shelter': int(f[0]), 'seating': int(f[1]), 'trash can': int(f[2]), 'sign': int(f[3])}}
+        for stop_id, f in zip(chosen, flags)
+    }
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(data, f)
+    return path
@@ -0,0 +1,120 @@
+import os
+import json
+import numpy as np
+import pandas as pd
+from functools import lru_cache
+from typing import Optional
+
+AMENITY_COLUMNS = ['shelter', 'seating', 'trash can', 'sign']
+
+# Inventory stop types used when a stop has no positive amenity score
+_ZERO = dict.fromkeys(AMENITY_COLUMNS, 0)
+BUS_STOP_TYPE_AMENITIES = {
+    # signs
+    'Sign Strapped to Pole': dict(_ZERO, sign=1),
+    'Sign on Post':          dict(_ZERO, sign=1),
+
+    # shelters & seats
+    'Shelter':               dict(_ZERO, shelter=1, seating=1),
+    'Bench':                 dict(_ZERO, seating=1),
+    'Simme Seat':            dict(_ZERO, seating=1),
+
+    # movable signs
+    'Sign on Moveable on Street': dict(_ZERO, sign=1),
+    'Sign on Moveable Pedestal':  dict(_ZERO, sign=1),
+
+    # all 0
+    'Stop at Rail Station':  _ZERO,
+    'Park and Ride':         _ZERO,
+    'Text Painted on Street':_ZERO,
+    'Temporary Bus Stop':    _ZERO,
+}
+
+# amenities_index by number of non-shelter amenities (trash can + seating + sign)
+AMENITIES_INDEX = np.array([1.0, 1.0, 1.5, 2.0])
+# factor_q of a stop with no amenity record at all
+DEFAULT_FACTOR_Q = 0.5
+
+
+def load_amenity_store(
+    json_path: Optional[str],
+    inventory_path: Optional[str],
+    cache_path: Optional[str] = None,
+) -> Optional[pd.DataFrame]:
+    # Amenity flags and factor_q per raw stop_id, or None when the score file is unavailable (or json_path is None).
+    # Memoized per process and keyed by file mtimes, so batch runs parse the sources once.
+    if json_path is None or not os.path.exists(json_path):
+        return None
+    mtimes = tuple(os.path.getmtime(p) if p is not None and os.path.exists(p) else None for p in (json_path, inventory_path))
+    return _load_amenity_store(json_path, inventory_path, cache_path, mtimes)
+
+def clear_amenity_cache():
+    # Forget the stores memoized by load_amenity_store, so the next call parses (or reads its cache file) again
+    _load_amenity_store.cache_clear()
+
+@lru_cache(maxsize=8)
+def _load_amenity_store(json_path, inventory_path, cache_path, mtimes):
+    newest = max(m for m in mtimes if m is not None)
+    try:
+        if cache_path is not None and os.path.getmtime(cache_path) >= newest:
+            return pd.read_parquet(cache_path)
+    except FileNotFoundError:
+        # Not cached yet, or evicted from a shared cache meanwhile
+        pass
+
+    store = build_amenity_store(json_path, inventory_path)
+    if store is not None and cache_path is not None:
+        # Concurrent runs sharing the cache each write their own temporary file
+        os.makedirs(os.path.dirname(cache_path) or '.', exist_ok=True)
+        store.to_parquet(f"{cache_path}.{os.getpid()}.tmp")
+        os.replace(f"{cache_path}.{os.getpid()}.tmp", cache_path)
+    return store
+
+def build_amenity_store(json_path: str, inventory_path: Optional[str]) -> Optional[pd.DataFrame]:
+    try:
+        with open(json_path) as f:
+            data = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+    # 1) Detected amenity scores (all_scores.json), one column per amenity
+    scores = {}
+    for col in AMENITY_COLUMNS:
+        scores[col] = [
+            (rec.get('amenity_scores') or {}).get(col) if isinstance(rec, dict) else None
+            for rec in data.values()
+        ]
+    scores = pd.DataFrame(scores, index=pd.Index(list(data), dtype=str), dtype=object)
+
+    # 2) Inventory stop types (Inventory.csv)
+    if inventory_path is not None and os.path.exists(inventory_path):
+        inventory = pd.read_csv(inventory_path, usecols=['Stop ID', 'Bus Stop Type'], dtype={'Stop ID': str})
+        stop_type = inventory.drop_duplicates(subset='Stop ID').set_index('Stop ID')['Bus Stop Type']
+    else:
+        stop_type = pd.Series(dtype=object)
+
+    index = scores.index.union(stop_type.index)
+    flags = scores.reindex(index)
+    stop_type = stop_type.reindex(index)
+
+    # 3) Stops without any positive score fall back to their inventory stop type
+    empty = (flags.isna() | flags.eq(0)).all(axis=1)
+    typed = pd.DataFrame.from_dict(BUS_STOP_TYPE_AMENITIES, orient='index')[AMENITY_COLUMNS]
+    fallback = typed.reindex(stop_type.to_numpy()).set_axis(index)
+    use_type = empty & stop_type.isin(typed.index)
+    flags = flags.mask(use_type, fallback, axis=0)
+
+    store = flags.apply(pd.to_numeric, errors='coerce').fillna(0).gt(0).astype('int8')
+    store['factor_q'] = score_q(store)
+    store.index.name = 'stop_id'
+    return store
+
+def score_q(flags: pd.DataFrame) -> np.ndarray:
+    shelter_index = np.where(flags['shelter'].to_numpy() == 1, 2.0, 1.0)
+    amenities_count = (flags['trash can'] + flags['seating'] + flags['sign']).to_numpy()
+    return shelter_index * AMENITIES_INDEX[np.clip(amenities_count, 0, 3)] / 2.0
+
+def lookup_factor_q(store: pd.DataFrame, stop_ids: pd.Series, tag: str) -> np.ndarray:
+    # Stop ids in the GTFS tables are tagged with the feed name; the store is keyed by raw ids
+    pos = (tag + "_" + store.index).get_indexer(stop_ids.astype(str))
+    return np.where(pos >= 0, store['factor_q'].to_numpy()[pos], DEFAULT_FACTOR_Q)
@@ -1,8 +1,16 @@
+import numpy as np
 import pandas as pd
 import geopandas as gpd
-import json
-from shapely.geometry import Point
+import shapely
+from scipy import sparse
 import os
+from typing import NamedTuple, Optional
+
+from gtfs_pipeline.amenities import load_amenity_store, lookup_factor_q
+from gtfs_pipeline.context import StudyContext
+
+AMENITY_SCORES_PATH = 'data/amenities/all_scores.json'
+AMENITY_INVENTORY_PATH = 'data/amenities/Inventory.csv'
 
 
 def stop_significance(
@@ -13,8 +21,19 @@ def stop_significance(
     iso_700_rail: gpd.GeoDataFrame,
     sched_merged: pd.DataFrame,
     target_crs: str,
-    tag: str
+    tag: str,
+    amenity_scores_path: Optional[str] = AMENITY_SCORES_PATH,
+    amenity_inventory_path: Optional[str] = AMENITY_INVENTORY_PATH,
+    amenity_cache_path: Optional[str] = None,
+    stop_ids=None,
+    time_windows=(),
+    context: Optional[StudyContext] = None,
 ) -> tuple[gpd.GeoDataFrame, gpd.GeoDataFrame]:
+    # stop_ids: only return the rows of these stops (incremental runs); every factor still sees the full network
+    # time_windows: extra TimeWindows scored alongside the peak, as factor_f_<name> / significance_<name> columns
+    # context: the run's StudyContext; the S factor layers and their indexes are added to it
+    time_windows = check_time_windows(time_windows or [])
+    windows = [w.name for w in time_windows]
 
     # 0) Divide stops by mode
     busstops_gdf  = stops_within_iso[stops_within_iso['route_type'] == 3].copy()
@@ -23,22 +42,37 @@ def stop_significance(
     busstops_all  = stops_bymode[stops_bymode['route_type'] == 3].copy()
     railstops_all = stops_bymode[stops_bymode['route_type'].isin([0, 1, 2, 5, 12])].copy()
 
+    # Context the subset is scored against
+    busstops_context = busstops_gdf
+    railstops_context = railstops_gdf
+    isos_100_rail_context = isos_100_rail
+    if stop_ids is not None:
+        subset = pd.Index(pd.Series(stop_ids).astype(str).unique())
+        busstops_gdf  = busstops_gdf[busstops_gdf['stop_id'].astype(str).isin(subset)]
+        railstops_gdf = railstops_gdf[railstops_gdf['stop_id'].astype(str).isin(subset)]
+        isos_100_rail = isos_100_rail[isos_100_rail['stop_id'].astype(str).isin(subset)]
+        iso_700_bus   = iso_700_bus[iso_700_bus['stop_id'].astype(str).isin(subset)]
+        iso_700_rail  = iso_700_rail[iso_700_rail['stop_id'].astype(str).isin(subset)]
+
     # 1) Factor E
     factor_e_bus  = compute_factor_e(busstops_gdf)
     factor_e_rail = compute_factor_e(railstops_gdf)
 
-    # 2) Factor S
+    # 2) Factor S: both factors query the same projected layers and share the bus-in-catchment pairs
+    context = factor_s_context(busstops_gdf, busstops_all, railstops_context, isos_100_rail_context, target_crs, context=context)
     factor_s_bus = bus_compute_factor_s(
         busstops=busstops_gdf,
         busstops_all=busstops_all,
-        railstops=railstops_gdf,
-        isos_100_rail=isos_100_rail,
-        target_crs=target_crs
+        railstops=railstops_context,
+        isos_100_rail=isos_100_rail_context,
+        target_crs=target_crs,
+        context=context,
     )
 
     factor_s_rail = rail_compute_factor_s(
         stops_gdf=stops_bymode,
-        rail_100_iso=isos_100_rail
+        rail_100_iso=isos_100_rail,
+        context=context,
     )
 
     # 3) Factor F
@@ -46,26 +80,36 @@ def stop_significance(
 
     sched_bus = (
         sched_merged[sched_merged["route_type"] == 3]
-        .loc[lambda df: df["stop_id"].isin(busstops_gdf["stop_id"])]
-        .copy()
+        .loc[lambda df: df["stop_id"].isin(busstops_context["stop_id"])]
     )
     sched_rail = (
         sched_merged[sched_merged["route_type"].isin(rail_types)]
-        .loc[lambda df: df["stop_id"].isin(railstops_gdf["stop_id"])]
-        .copy()
+        .loc[lambda df: df["stop_id"].isin(railstops_context["stop_id"])]
     )
 
-    factor_f_bus  = compute_factor_f(sched_bus,  all_stop_ids=busstops_gdf['stop_id'])
-    factor_f_rail = compute_factor_f(sched_rail, all_stop_ids=railstops_gdf['stop_id'])
+    # Which days vary is a property of the whole schedule, not of the stops being scored
+    bus_days  = calendar_varies(sched_bus)
+    rail_days = calendar_varies(sched_rail)
+    bus_idle  = calendar_idle(sched_bus)
+    rail_idle = calendar_idle(sched_rail)
+    if stop_ids is not None:
+        sched_bus  = sched_bus[sched_bus["stop_id"].isin(busstops_gdf["stop_id"])]
+        sched_rail = sched_rail[sched_rail["stop_id"].isin(railstops_gdf["stop_id"])]
+
+    factor_f_bus  = compute_factor_f(sched_bus,  all_stop_ids=busstops_gdf['stop_id'], varying_days=bus_days, windows=time_windows, idle_days=bus_idle)
+    factor_f_rail = compute_factor_f(sched_rail, all_stop_ids=railstops_gdf['stop_id'], varying_days=rail_days, windows=time_windows, idle_days=rail_idle)
+    window_f = [f'factor_f_{w}' for w in windows]
 
     # 4) Factor Q
     bus_factor_q = compute_factor_q(
         busstops_gdf=busstops_gdf,
         tag=tag,
-        target_crs=target_crs
+        target_crs=target_crs,
+        json_path=amenity_scores_path,
+        inventory_path=amenity_inventory_path,
+        cache_path=amenity_cache_path,
     )
-    json_path = 'data/amenities/all_scores.json'
-    rail_factor_q_scalar = 2.5 if os.path.exists(json_path) else 0.5
+    rail_factor_q_scalar = 2.5 if amenity_scores_path is not None and os.path.exists(amenity_scores_path) else 0.5
 
     # 5) Bus Stop Significance
     bus_analysis = (
@@ -76,16 +120,22 @@ def stop_significance(
         .merge(bus_factor_q, on='stop_id', how='left')
     )
 
-    bus_analysis[['factor_e','factor_s','factor_f','factor_q']] = (
-        bus_analysis[['factor_e','factor_s','factor_f','factor_q']].fillna(0)
+    bus_analysis[['factor_e','factor_s','factor_f','factor_q'] + window_f] = (
+        bus_analysis[['factor_e','factor_s','factor_f','factor_q'] + window_f].fillna(0)
     )
 
     bus_analysis['significance'] = (
         bus_analysis['factor_e'] * bus_analysis['factor_s'] * bus_analysis['factor_f']
         + bus_analysis['factor_q']
     )
+    # Only frequency depends on the time of day
+    for w in windows:
+        bus_analysis[f'significance_{w}'] = (
+            bus_analysis['factor_e'] * bus_analysis['factor_s'] * bus_analysis[f'factor_f_{w}']
+            + bus_analysis['factor_q']
+        )
 
-    for c in ['routes', 'stop_rate_h']:
+    for c in ['routes', 'stop_rate_h'] + [f'stop_rate_h_{w}' for w in windows]:
         if c in bus_analysis.columns:
             bus_analysis = bus_analysis.drop(columns=[c])
 
@@ -99,16 +149,21 @@ def stop_significance(
         .merge(factor_f_rail, on='stop_id', how='left')
     )
 
-    rail_analysis[['factor_e','factor_s','factor_f']] = (
-        rail_analysis[['factor_e','factor_s','factor_f']].fillna(0)
+    rail_analysis[['factor_e','factor_s','factor_f'] + window_f] = (
+        rail_analysis[['factor_e','factor_s','factor_f'] + window_f].fillna(0)
     )
 
     rail_analysis['significance'] = (
         rail_analysis['factor_e'] * rail_analysis['factor_s'] * rail_analysis['factor_f']
         + rail_factor_q_scalar
     )
+    for w in windows:
+        rail_analysis[f'significance_{w}'] = (
+            rail_analysis['factor_e'] * rail_analysis['factor_s'] * rail_analysis[f'factor_f_{w}']
+            + rail_factor_q_scalar
+        )
 
-    for c in ['routes', 'stop_rate_h']:
+    for c in ['routes', 'stop_rate_h'] + [f'stop_rate_h_{w}' for w in windows]:
         if c in rail_analysis.columns:
             rail_analysis = rail_analysis.drop(columns=[c])
 
@@ -140,82 +195,110 @@ def bus_score_s(route_set, near_rail_df):
     matched = route_set & nearby_routes
     return 1 + 0.5 * min(len(matched), 2)
 
-def bus_compute_factor_s(busstops, busstops_all, railstops, isos_100_rail, target_crs):
-    # 0) Match CRS
-    B = busstops.to_crs(target_crs).copy()
-    B_all = busstops_all.to_crs(target_crs).copy()
-    R = railstops.to_crs(target_crs).copy()
-    ISO = isos_100_rail.to_crs(target_crs).copy()
-
-    # 1) Compute 3km buffer around each bus stop
-    Bbuf = B[['stop_id', 'geometry']].copy()
-    Bbuf['geometry'] = Bbuf.geometry.buffer(3000)
-
-    # 2) Match rail stops within 3km of bus stops
-    rail_in_3km = gpd.sjoin(
-        R[['stop_id', 'geometry']], Bbuf,
-        how='inner', predicate='within',
-        lsuffix='rail', rsuffix='bus'
-    ).drop(columns=['index_right'], errors='ignore')
-
-    # Dictionary: bus stop ID -> list of rail stop IDs within 3km
-    bus_to_rails = (
-        rail_in_3km.groupby('stop_id_bus')['stop_id_rail']
-        .apply(list).to_dict()
-        if len(rail_in_3km) > 0 else {}
-    )
+# Bus stop to rail station search radius, and the segments per quarter circle of the legacy buffer polygon
+BUS_RAIL_RADIUS = 3000
+BUFFER_QUAD_SEGS = 16
 
-    # Match rail stops within 100m isochrone
-    near_bus = gpd.sjoin(
-        B_all[['stop_id','routes','geometry']], ISO[['stop_id','geometry']],
-        how='inner', predicate='within', lsuffix='bus', rsuffix='rail'
-    ).drop(columns=['index_right'], errors='ignore')
-
-    def norm_set(x):
-        if isinstance(x, (list, set, tuple)): return set(x)
-        if pd.isna(x): return set()
-        return {x}
-
-    rail_routes_map = (
-        near_bus.groupby('stop_id_rail')['routes']
-        .apply(lambda s: set().union(*[norm_set(v) for v in s]))
-        .to_dict()
-        if len(near_bus) > 0 else {}
-    )
+def factor_s_context(busstops, busstops_all, railstops, isos_100_rail, target_crs, context=None) -> StudyContext:
+    # The layers both S factors query, projected into target_crs and indexed once (in context, if given)
+    if context is None:
+        context = StudyContext(target_crs)
+    for name, gdf in (('bus', busstops), ('bus_all', busstops_all), ('rail', railstops), ('rail_100', isos_100_rail)):
+        context.add(name, gdf, crs=target_crs)
+    return context
 
-    # Compute factor_s for each bus stop
-    def score_row(row):
-        my_routes = norm_set(row['routes'])
-        rails = bus_to_rails.get(row['stop_id'], [])
-        if not rails:
-            return 1.0
-        union_routes = set().union(*[rail_routes_map.get(r, set()) for r in rails])
-        matched = my_routes & union_routes
-        return 1.0 + 0.5 * min(len(matched), 2)
-
-    out = B[['stop_id','routes']].copy()
-    out['factor_s'] = out.apply(score_row, axis=1)
+def bus_compute_factor_s(busstops, busstops_all, railstops, isos_100_rail, target_crs, context=None):
+    # context: a factor_s_context of the same frames, shared with rail_compute_factor_s (built here if None)
+    # 0) Match CRS
+    if context is None:
+        context = factor_s_context(busstops, busstops_all, railstops, isos_100_rail, target_crs)
+    B, B_all = context.layer('bus'), context.layer('bus_all')
+    R, ISO = context.layer('rail'), context.layer('rail_100')
+
+    # 1) Rail stops within 3km of each bus stop
+    bus_idx, rail_idx = _pairs_within_buffer(B.geometry.values, R.geometry.values, BUS_RAIL_RADIUS,
+                                             candidates=context.within_distance('bus', 'rail', BUS_RAIL_RADIUS))
+
+    # 2) Bus stops (all) within each rail station's 100m isochrone
+    near_bus_idx, near_iso_idx = context.within('bus_all', 'rail_100')
+
+    # 3) Route sets as sparse incidence matrices over one route vocabulary
+    vocab = pd.Index(pd.concat([_explode_routes(B['routes']), _explode_routes(B_all['routes'])]).unique())
+    bus_routes = _route_incidence(B['routes'], vocab)
+    all_routes = _route_incidence(B_all['routes'], vocab)
+
+    # Routes serving each rail station (union over the bus stops in its 100m catchment)
+    rail_ids = pd.Index(ISO['stop_id'].astype(str).unique())
+    near = _incidence(rail_ids.get_indexer(ISO['stop_id'].astype(str).to_numpy()[near_iso_idx]),
+                      near_bus_idx, (len(rail_ids), len(B_all)))
+    rail_routes = _binarize(near @ all_routes)
+
+    # Routes reachable from each bus stop through any rail station within 3km
+    rail_pos = rail_ids.get_indexer(R['stop_id'].astype(str).to_numpy()[rail_idx])
+    keep = rail_pos >= 0
+    bus_rail = _incidence(bus_idx[keep], rail_pos[keep], (len(B), len(rail_ids)))
+    reachable = _binarize(bus_rail @ rail_routes)
+
+    # 4) Matched routes = |own routes ∩ reachable routes|, from one sparse product
+    matched = np.asarray(bus_routes.multiply(reachable).sum(axis=1)).ravel()
+
+    out = B[['stop_id']].copy()
+    out['factor_s'] = 1.0 + 0.5 * np.minimum(matched, 2)
     return out[['stop_id','factor_s']]
 
+def _pairs_within_buffer(centers, points, radius, candidates=None):
+    # Same pairs as `points within centers.buffer(radius)`, without building every buffer polygon:
+    # anything closer than the polygon's inner radius is inside, only the thin ring is tested exactly.
+    # candidates: the (centers, points) pairs within radius, if already known
+    if candidates is None:
+        candidates = shapely.STRtree(points).query(centers, predicate='dwithin', distance=radius)
+    centers_idx, points_idx = candidates
+    dist = shapely.distance(centers[centers_idx], points[points_idx])
+    inner = radius * np.cos(np.pi / (4 * BUFFER_QUAD_SEGS))
+    ring = dist >= inner
+    if ring.any():
+        polygons = shapely.buffer(centers[centers_idx[ring]], radius, quad_segs=BUFFER_QUAD_SEGS)
+        inside = dist < inner
+        inside[ring] = shapely.within(points[points_idx[ring]], polygons)
+        centers_idx, points_idx = centers_idx[inside], points_idx[inside]
+    return centers_idx, points_idx
+
+def _explode_routes(routes: pd.Series) -> pd.Series:
+    # Lists/sets/tuples become one row per route; scalars stay; empty/NaN entries drop out
+    routes = routes.reset_index(drop=True).map(lambda x: list(x) if isinstance(x, (set, tuple)) else x)
+    return routes.explode().dropna()
+
+def _route_incidence(routes: pd.Series, vocab: pd.Index) -> sparse.csr_matrix:
+    exploded = _explode_routes(routes)
+    return _binarize(_incidence(exploded.index.to_numpy(), vocab.get_indexer(exploded.to_numpy()),
+                                (len(routes), len(vocab))))
+
+def _incidence(rows, cols, shape) -> sparse.csr_matrix:
+    return sparse.csr_matrix((np.ones(len(rows), dtype=np.int32), (rows, cols)), shape=shape)
+
+def _binarize(matrix: sparse.csr_matrix) -> sparse.csr_matrix:
+    matrix = matrix.tocsr()
+    matrix.sum_duplicates()
+    matrix.eliminate_zeros()
+    matrix.data[:] = 1
+    return matrix
+
 ##--------------------------------------------------------------------------
 ## Railway_Factor_S: Number of Bus Stops nearby Rail Station
 ##--------------------------------------------------------------------------
 def rail_compute_factor_s(stops_gdf: gpd.GeoDataFrame,
-                          rail_100_iso: gpd.GeoDataFrame) -> pd.DataFrame:
-    
-    busstops_gdf = stops_gdf[stops_gdf['route_type']==3]
+                          rail_100_iso: gpd.GeoDataFrame,
+                          context: Optional[StudyContext] = None) -> pd.DataFrame:
+    # context: a factor_s_context whose 'bus_all' / 'rail_100' layers hold these bus stops and (at least) these
+    # catchments; the pairs are then the ones bus_compute_factor_s already found. Without one, the join runs in
+    # rail_100_iso's CRS.
+    if context is None:
+        busstops_gdf = stops_gdf[stops_gdf['route_type']==3]
+        context = StudyContext(rail_100_iso.crs, bus_all=busstops_gdf, rail_100=rail_100_iso)
+
     # Spatial join: find all bus stops within each station's 100 m isochrone
-    try:
-        joined = gpd.sjoin(
-            busstops_gdf[['stop_id', 'geometry']],
-            rail_100_iso[['stop_id', 'geometry']],
-            how='inner',
-            predicate='within',
-            lsuffix='bus',
-            rsuffix='rail'
-        )
-    except Exception as e:
-        raise RuntimeError(f"Spatial join failed: {e}")
+    _, iso_idx = context.within('bus_all', 'rail_100')
+    joined = pd.DataFrame({'stop_id_rail': context.layer('rail_100')['stop_id'].to_numpy()[iso_idx]})
 
     # Count bus stops per rail station
     counts = (
@@ -250,73 +333,157 @@ def score_f(w: float) -> float:
     if w <= 6.0:   return 1.75
     return 2.00
 
-def compute_factor_f(sched: pd.DataFrame, all_stop_ids=None) -> pd.DataFrame:
-    weekdays = ['monday','tuesday','wednesday','thursday','friday']
-    daily_rates = []
-    sched = sched.copy()
-    sched['arr_td'] = pd.to_timedelta(sched['arrival_time'])
-    sched['dep_td'] = pd.to_timedelta(sched['departure_time'])
-
-    # Peak hours: 7–9am, 4–7pm
-    morning_start, morning_end = 6 * 3600, 9 * 3600
-    evening_start, evening_end = 16 * 3600, 19 * 3600
-    fixed_duration_h = 6.0
-
-    for day in weekdays:
+class TimeWindow(NamedTuple):
+    name: str
+    spans: list     # (start, end) seconds since the start of the service day, end excluded
+    days: list      # calendar columns the window is counted on
+
+# Peak hours: 6–9am, 4–7pm
+WEEKDAYS = ['monday','tuesday','wednesday','thursday','friday']
+SERVICE_DAYS = WEEKDAYS + ['saturday', 'sunday']
+PEAK_WINDOWS = [(6 * 3600, 9 * 3600), (16 * 3600, 19 * 3600)]
+PEAK = TimeWindow('peak', PEAK_WINDOWS, WEEKDAYS)
+
+# Windows scored on top of the peak when time-of-day scores are requested
+TIME_WINDOWS = [
+    TimeWindow('am_peak', [(6 * 3600, 9 * 3600)],   WEEKDAYS),
+    TimeWindow('midday',  [(9 * 3600, 16 * 3600)],  WEEKDAYS),
+    TimeWindow('pm_peak', [(16 * 3600, 19 * 3600)], WEEKDAYS),
+    TimeWindow('evening', [(19 * 3600, 24 * 3600)], WEEKDAYS),
+    TimeWindow('weekend', [(6 * 3600, 22 * 3600)],  ['saturday', 'sunday']),
+]
+
+def gtfs_seconds(times: pd.Series) -> np.ndarray:
+    # Integer seconds from the arrow ingestion, or "HH:MM:SS" strings (hours may pass 24); NaN if missing
+    if not pd.api.types.is_numeric_dtype(times):
+        times = pd.to_timedelta(times).dt.total_seconds()
+    return times.to_numpy(dtype=float, na_value=np.nan)
+
+def window_hours(window: TimeWindow) -> float:
+    return sum(end - start for start, end in window.spans) / 3600
+
+def check_time_windows(windows) -> list:
+    windows = [TimeWindow(*w) for w in windows]
+    names = [w.name for w in windows]
+    if len(set(names)) != len(names):
+        raise ValueError(f"Time window names must be unique: {names}")
+    for w in windows:
+        unknown = set(w.days) - set(SERVICE_DAYS)
+        if unknown or not w.days:
+            raise ValueError(f"Time window {w.name!r} has invalid service days {w.days}")
+        if not w.spans or any(end <= start for start, end in w.spans):
+            raise ValueError(f"Time window {w.name!r} has empty time spans {w.spans}")
+    return windows
+
+def calendar_varies(sched: pd.DataFrame, days=SERVICE_DAYS) -> dict:
+    # A calendar column with a single value counts every trip on that day
+    varying = {}
+    for day in days:
         col = sched.get(day)
-        if col is None or col.dropna().nunique() <= 1:
-            df_day = sched.copy()
-        else:
-            df_day = sched[col == 1].copy()
-
-        df_day = df_day.drop_duplicates(subset=['stop_id','route_id','arr_td','dep_td'])
-        df_day = df_day.dropna(subset=['arr_td'])
-
-        secs = df_day['arr_td'].dt.total_seconds().astype(int)
-        is_peak = (
-            secs.between(morning_start, morning_end, inclusive='left') |
-            secs.between(evening_start, evening_end, inclusive='left')
-        )
-        df_peak = df_day[is_peak]
-
-        group_cols = ['stop_id', 'route_id', 'service_id']
-        if 'direction_id' in df_peak.columns:
-            group_cols.insert(2, 'direction_id')
-
-        span = (df_peak.groupby(group_cols)
-                      .size()
-                      .reset_index(name='count_peak'))
-
-        span['duration_h'] = fixed_duration_h
-        span['rate_h'] = span['count_peak'] / span['duration_h']
+        varying[day] = bool(col is not None and col.dropna().nunique() > 1)
+    return varying
 
-        rate = (span.groupby(['stop_id','route_id'])['rate_h']
-                    .mean().reset_index(name=f'rate_{day}'))
-        daily_rates.append(rate)
-
-    from functools import reduce
-    rates_merged = (reduce(lambda L, R: L.merge(R, on=['stop_id','route_id'], how='outer'),
-                           daily_rates)
-                    if daily_rates else pd.DataFrame(columns=['stop_id','route_id']))
-
-    rate_cols = [f'rate_{d}' for d in weekdays if f'rate_{d}' in rates_merged.columns]
-    if not rate_cols:
-        factor_f_df = rates_merged[['stop_id']].drop_duplicates()
-        factor_f_df['stop_rate_h'] = 0.0
-    else:
-        rates_merged['avg_weekday_rate'] = rates_merged[rate_cols].mean(axis=1).fillna(0)
-        factor_f_df = (rates_merged.groupby('stop_id')['avg_weekday_rate']
-                                  .mean().reset_index(name='stop_rate_h'))
+def calendar_idle(sched: pd.DataFrame, days=SERVICE_DAYS) -> list:
+    # Days whose calendar column is 0 for every service while some other day has service (e.g. the weekend
+    # of a weekday-only feed). A calendar without any day set (calendar_dates.txt feeds) has no idle days.
+    def _zero(day):
+        col = sched.get(day)
+        return col is not None and col.notna().any() and bool((col.dropna() == 0).all())
+    if all(_zero(day) or sched.get(day) is None for day in SERVICE_DAYS):
+        return []
+    return [day for day in days if _zero(day)]
+
+def compute_factor_f(sched: pd.DataFrame, all_stop_ids=None, varying_days=None, windows=(), idle_days=None) -> pd.DataFrame:
+    # factor_f / stop_rate_h of the weekday peak, plus factor_f_<name> / stop_rate_h_<name> for every extra window
+    windows = [PEAK] + list(windows)
+    if idle_days is None:
+        idle_days = calendar_idle(sched)
+    stop_rates = window_rates(sched, windows, varying_days, idle_days)
 
     if all_stop_ids is None:
         all_stop_ids = pd.Index(sched['stop_id'].unique())
 
-    universe = pd.DataFrame({'stop_id': all_stop_ids})
-    factor_f_df = universe.merge(factor_f_df, on='stop_id', how='left')
-
-    factor_f_df['stop_rate_h'] = factor_f_df['stop_rate_h'].fillna(0.0)
-    factor_f_df['factor_f'] = factor_f_df['stop_rate_h'].apply(score_f)
-    return factor_f_df
+    factor_f_df = pd.DataFrame({'stop_id': all_stop_ids})
+    for i, (window, stop_rate) in enumerate(zip(windows, stop_rates)):
+        suffix = f'_{window.name}' if i else ''
+        factor_f_df = factor_f_df.merge(stop_rate.reset_index(name='stop_rate_h' + suffix), on='stop_id', how='left')
+        factor_f_df['stop_rate_h' + suffix] = factor_f_df['stop_rate_h' + suffix].fillna(0.0)
+        factor_f_df['factor_f' + suffix] = factor_f_df['stop_rate_h' + suffix].apply(score_f)
+        # A window on days the feed has no service at all scores zero
+        if i and set(window.days) <= set(idle_days):
+            factor_f_df['factor_f' + suffix] = 0.0
+
+    columns = ['stop_id'] + [c for c in factor_f_df.columns if c.startswith('stop_rate_h')] \
+        + [c for c in factor_f_df.columns if c.startswith('factor_f')]
+    return factor_f_df[columns]
+
+def window_rates(sched: pd.DataFrame, windows, varying_days=None, idle_days=None) -> list:
+    # Average departures per hour of every stop in each window (Series indexed by stop_id, one per window).
+    # Every (window, service day) pair is counted in a single grouped pass over the schedule.
+    # idle_days (default calendar_idle) count no trips in any window but the legacy PEAK.
+    arr = gtfs_seconds(sched['arrival_time'])
+    dep = gtfs_seconds(sched['departure_time'])
+
+    in_window = np.zeros((len(sched), len(windows)), dtype=bool)
+    for w, window in enumerate(windows):
+        for start, end in window.spans:
+            in_window[:, w] |= (arr >= start) & (arr < end)
+    active = in_window.any(axis=1)
+    in_window = in_window[active]
+
+    group_cols = ['stop_id', 'route_id', 'service_id']
+    if 'direction_id' in sched.columns:
+        group_cols.insert(2, 'direction_id')
+    rows = sched.loc[active, group_cols]
+
+    # Day mask matrix; days whose calendar column does not vary count every trip
+    days = list(dict.fromkeys(day for window in windows for day in window.days))
+    if varying_days is None:
+        varying_days = calendar_varies(sched, days)
+    if idle_days is None:
+        idle_days = calendar_idle(sched, days)
+    day_mask = np.ones((len(rows), len(days)), dtype=bool)
+    for d, day in enumerate(days):
+        if varying_days.get(day, False):
+            day_mask[:, d] = (sched[day][active] == 1).fillna(False).to_numpy(dtype=bool)
+
+    # Same-day duplicates of (stop, route, arrival, departure) only count once (first row wins).
+    # Duplicates share their arrival time, so they always fall in the same windows.
+    trip_key = pd.DataFrame({
+        'stop_id': rows['stop_id'], 'route_id': rows['route_id'],
+        'arr': arr[active], 'dep': dep[active],
+    }).groupby(['stop_id', 'route_id', 'arr', 'dep'], sort=False, dropna=False, observed=True).ngroup().to_numpy()
+
+    counted = np.zeros_like(day_mask)
+    for d in range(len(days)):
+        day_rows = np.flatnonzero(day_mask[:, d])
+        _, first = np.unique(trip_key[day_rows], return_index=True)
+        counted[day_rows[first], d] = True
+
+    # One column per (window, day); one grouped reduction gives the departures of every group in all of them
+    pairs = [(w, days.index(day)) for w, window in enumerate(windows) for day in window.days]
+    # The peak keeps its original rule (a constant day column counts every trip)
+    idle = [windows[w] != PEAK and days[d] in idle_days for w, d in pairs]
+    counts = pd.DataFrame(
+        np.column_stack([counted[:, d] & in_window[:, w] & ~skip for (w, d), skip in zip(pairs, idle)]).astype(np.int32)
+        if pairs else np.zeros((len(rows), 0), dtype=np.int32),
+        index=rows.index,
+    )
+    columns = list(counts.columns)
+    counts[group_cols] = rows[group_cols]
+    span = counts.groupby(group_cols, observed=True)[columns].sum()
+
+    # Groups without departures on a day do not exist for that day
+    hours = np.array([window_hours(windows[w]) for w, _ in pairs])
+    rates = (span / hours).where(span > 0)
+    rates = rates.groupby(level=['stop_id', 'route_id'], observed=True).mean()
+
+    stop_rates = []
+    for w in range(len(windows)):
+        per_route = rates[[c for c, (pw, _) in zip(columns, pairs) if pw == w]].dropna(how='all')
+        avg_day_rate = per_route.mean(axis=1).fillna(0)
+        stop_rates.append(avg_day_rate.groupby(level='stop_id', observed=True).mean())
+    return stop_rates
 
 ##--------------------------------------------------------------------------
 ## 4. Bus Stops Facilities Score
@@ -325,107 +492,19 @@ def compute_factor_f(sched: pd.DataFrame, all_stop_ids=None) -> pd.DataFrame:
 def compute_factor_q(
     busstops_gdf: gpd.GeoDataFrame,
     tag: str,
-    target_crs: str) -> pd.DataFrame:
-    try:
-        with open('data/amenities/all_scores.json') as f:
-            data = json.load(f)
-    except (FileNotFoundError, json.JSONDecodeError):
+    target_crs: str,
+    json_path: Optional[str] = AMENITY_SCORES_PATH,
+    inventory_path: Optional[str] = AMENITY_INVENTORY_PATH,
+    cache_path: Optional[str] = None) -> pd.DataFrame:
+    # Amenities are parsed and scored once per raw stop_id; this is only a lookup
+    store = load_amenity_store(json_path, inventory_path, cache_path)
+    if store is None:
         return pd.DataFrame({
             'stop_id': pd.Index(busstops_gdf['stop_id'].astype(str)).unique(),
             'factor_q': 0.0
         })
-        
-    qualityScore = (
-        pd.DataFrame.from_dict(data, orient='index')
-        .assign(stop_id=lambda df: df.index.astype(str).map(lambda x: f"{tag}_{x}"))
-        .pipe(lambda df: pd.concat([df.drop(columns='amenity_scores'),
-                                    df['amenity_scores'].apply(pd.Series)], axis=1))
-        .reset_index(drop=True)
-    )
-
-    busstops_gdf_merged = busstops_gdf.merge(
-        qualityScore,
-        on="stop_id",
-        how="left"
-    )
-
-    fill_up = pd.read_csv('data/amenities/Inventory.csv')
-    fill_up = gpd.GeoDataFrame(
-        fill_up,
-        geometry=[Point(xy) for xy in zip(fill_up['Lon'], fill_up['Lat'])],
-        crs="EPSG:4326"
-    ).to_crs(target_crs)
-
-    fill_up = (
-        fill_up.rename(columns={"Stop ID": "stop_id"})
-                .drop(columns=['Lon', 'Lat', 'geometry', 'Jurisdiction', 'Stop Abbr', 'Stop Name', 'Route(S)'])
-                .assign(stop_id=lambda df: df["stop_id"].astype(str)
-                                        .map(lambda x: f"{tag}_{x}"))
-    )
-
-    busstops_gdf_merged = busstops_gdf_merged.merge(
-        fill_up,
-        on="stop_id",
-        how="left"
-    )
-
-    cols = ['shelter','seating','trash can','sign']
-    zero_dict = dict.fromkeys(cols, 0)
-    mapping = {
-        # signs
-        'Sign Strapped to Pole': dict(zero_dict, sign=1),
-        'Sign on Post':          dict(zero_dict, sign=1),
-
-        # shelters & seats
-        'Shelter':               dict(zero_dict, shelter=1, seating=1),
-        'Bench':                 dict(zero_dict, seating=1),
-        'Simme Seat':            dict(zero_dict, seating=1),
-
-        # movable signs
-        'Sign on Moveable on Street': dict(zero_dict, sign=1),
-        'Sign on Moveable Pedestal':  dict(zero_dict, sign=1),
-
-        # all 0
-        'Stop at Rail Station':  zero_dict,
-        'Park and Ride':         zero_dict,
-        'Text Painted on Street':zero_dict,
-        'Temporary Bus Stop':    zero_dict,
-    }
-
-    mask_empty = busstops_gdf_merged[cols].fillna(0).eq(0).all(axis=1)
-
-    for btype, rules in mapping.items():
-        sel = mask_empty & (busstops_gdf_merged['Bus Stop Type'] == btype)
-        if sel.any():
-            for c, v in rules.items():
-                busstops_gdf_merged.loc[sel, c] = v
-
-    busstops_gdf_merged[cols] = (
-    busstops_gdf_merged[cols]
-      .apply(pd.to_numeric, errors='coerce')
-      .fillna(0)
-      .gt(0)
-      .astype('int8')
-    )
-
-    def score_q(data):
-        shelter_index = 2.0 if data['shelter'] == 1 else 1.0
-
-        amenities_count = (
-            data['trash can'] +
-            data['seating'] +
-            data['sign']
-        )
-
-        if amenities_count <= 1:
-            amenities_index = 1.0
-        elif amenities_count == 2:
-            amenities_index = 1.5
-        else:
-            amenities_index = 2.0
-
-        return (shelter_index * amenities_index) / 2.0
 
-    busstops_gdf_merged['factor_q'] = busstops_gdf_merged.apply(score_q, axis=1)
-    factor_q = busstops_gdf_merged[['stop_id', 'factor_q']]
-    return factor_q
\ No newline at end of file
+    return pd.DataFrame({
+        'stop_id': busstops_gdf['stop_id'].to_numpy(),
+        'factor_q': lookup_factor_q(store, busstops_gdf['stop_id'], tag),
+    })
\ No newline at end of file
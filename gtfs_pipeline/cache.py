@@ -0,0 +1,174 @@
+import os
+import json
+import hashlib
+from contextlib import contextmanager
+from typing import Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows: entries are still written atomically, but not pinned
+    fcntl = None
+
+# Default size cap for the on-disk cache (5 GiB)
+DEFAULT_MAX_BYTES = 5 * 2**30
+# Under the cache root: the lock taken while pinning or evicting, and one pin file per process
+LOCK_FILE = ".lock"
+PIN_DIR = ".pins"
+
+# (pid, path) already written to this process's pin file
+_PINNED = set()
+
+
+def cache_key(**params) -> str:
+    payload = json.dumps(params, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()[:24]
+
+def file_hash(path: str, chunk_size: int = 2**20) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()[:24]
+
+
+class DiskCache:
+    # Content-addressed files under <root>/<kind>/<key>.<ext>, evicted least-recently-used first.
+    # Processes may share a root (e.g. the cities of a batch): entries are written to a temporary file and moved
+    # into place, and every entry a process reads or writes is pinned until it exits, so another process's
+    # evict or remove never deletes it.
+    def __init__(self, root: str, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+
+    def path(self, kind: str, key: str, ext: str) -> str:
+        folder = os.path.join(self.root, kind)
+        os.makedirs(folder, exist_ok=True)
+        return os.path.join(folder, f"{key}.{ext}")
+
+    def get(self, kind: str, key: str, ext: str) -> Optional[str]:
+        path = os.path.join(self.root, kind, f"{key}.{ext}")
+        with self._lock():
+            if not os.path.exists(path):
+                return None
+            self._pin(path)
+            # Mark as recently used
+            os.utime(path)
+        return path
+
+    @contextmanager
+    def writing(self, kind: str, key: str, ext: str):
+        # Yields a temporary path to write the entry to; once written, it replaces the entry in one step
+        path = self.path(kind, key, ext)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        try:
+            yield tmp
+            with self._lock():
+                self._pin(path)
+                os.replace(tmp, path)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+    def read_json(self, kind: str, key: str) -> Optional[dict]:
+        path = self.get(kind, key, 'json')
+        if path is None:
+            return None
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except json.JSONDecodeError:
+            return None
+
+    def write_json(self, kind: str, key: str, data: dict) -> str:
+        with self.writing(kind, key, 'json') as tmp:
+            with open(tmp, 'w') as f:
+                json.dump(data, f)
+        return self.path(kind, key, 'json')
+
+    def remove(self, kind: str, key: str, ext: str):
+        # Left in place while another process has it pinned
+        path = os.path.join(self.root, kind, f"{key}.{ext}")
+        with self._lock(exclusive=True):
+            if os.path.exists(path) and os.path.abspath(path) not in self._pinned():
+                os.remove(path)
+
+    def evict(self, keep: tuple = ()):
+        # Least recently used first, skipping keep and the entries other processes have pinned
+        with self._lock(exclusive=True):
+            entries = sorted(self._entries(), key=lambda e: e[1])
+            total = sum(os.path.getsize(p) for p, _ in entries)
+            keep = {os.path.abspath(p) for p in keep} | self._pinned()
+            for path, _ in entries:
+                if total <= self.max_bytes:
+                    break
+                if os.path.abspath(path) in keep:
+                    continue
+                total -= os.path.getsize(path)
+                os.remove(path)
+
+    def _entries(self):
+        # Cached files only: no lock or pin files, and no temporary files a live process is still writing
+        if not os.path.isdir(self.root):
+            return []
+        entries = []
+        for folder, dirs, files in os.walk(self.root):
+            dirs[:] = [d for d in dirs if d != PIN_DIR]
+            for name in files:
+                if name == LOCK_FILE or (name.endswith(".tmp") and _alive(_writer(name))):
+                    continue
+                path = os.path.join(folder, name)
+                entries.append((path, os.path.getmtime(path)))
+        return entries
+
+    @contextmanager
+    def _lock(self, exclusive: bool = False):
+        # Shared while pinning, exclusive while deleting, so no entry is deleted between its pin and its use
+        if fcntl is None:
+            yield
+            return
+        os.makedirs(self.root, exist_ok=True)
+        with open(os.path.join(self.root, LOCK_FILE), 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            yield
+
+    def _pin(self, path: str):
+        path = os.path.abspath(path)
+        if fcntl is None or (os.getpid(), path) in _PINNED:
+            return
+        folder = os.path.join(self.root, PIN_DIR)
+        os.makedirs(folder, exist_ok=True)
+        with open(os.path.join(folder, str(os.getpid())), 'a') as f:
+            f.write(path + "\n")
+        _PINNED.add((os.getpid(), path))
+
+    def _pinned(self) -> set:
+        # Entries pinned by other live processes; pin files of finished ones are dropped (call under the lock)
+        folder = os.path.join(self.root, PIN_DIR)
+        if not os.path.isdir(folder):
+            return set()
+        pinned = set()
+        for name in os.listdir(folder):
+            if not name.isdigit() or int(name) == os.getpid():
+                continue
+            if not _alive(int(name)):
+                os.remove(os.path.join(folder, name))
+                continue
+            with open(os.path.join(folder, name)) as f:
+                pinned.update(line.strip() for line in f if line.strip())
+        return pinned
+
+def _writer(tmp_name: str) -> int:
+    # pid in <key>.<ext>.<pid>.tmp (0 when the name carries none)
+    pid = tmp_name.split(".")[-2]
+    return int(pid) if pid.isdigit() else 0
+
+def _alive(pid: int) -> bool:
+    if pid <= 0:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
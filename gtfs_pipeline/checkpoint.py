@@ -0,0 +1,66 @@
+import os
+import json
+import pickle
+
+
+def finished_stages(folder: str, key: str) -> list:
+    # Stages a run with this key already finished, without touching the checkpoints
+    meta = _read_meta(folder)
+    return meta['stages'] if meta is not None and meta.get('key') == key else []
+
+
+class Checkpoints:
+    # Outputs of the finished stages of one run, pickled under <folder>/<stage>.pkl.
+    # key identifies the run's inputs and settings: checkpoints written under another key are discarded,
+    # so a rerun only resumes when nothing upstream changed.
+    def __init__(self, folder: str, key: str):
+        self.folder = folder
+        self.key = key
+        meta = _read_meta(folder)
+        if meta is None or meta.get('key') != key:
+            self.clear()
+
+    @property
+    def finished(self) -> list:
+        return _read_meta(self.folder)['stages']
+
+    def done(self, stage: str) -> bool:
+        return stage in self.finished and os.path.exists(self._path(stage))
+
+    def load(self, stage: str):
+        with open(self._path(stage), 'rb') as f:
+            return pickle.load(f)
+
+    def save(self, stage: str, outputs):
+        # Written to a temporary file first, so a crash mid-write never leaves a half checkpoint behind
+        path = self._path(stage)
+        with open(path + ".tmp", 'wb') as f:
+            pickle.dump(outputs, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(path + ".tmp", path)
+        meta = _read_meta(self.folder)
+        meta['stages'] = [s for s in meta['stages'] if s != stage] + [stage]
+        self._write_meta(meta)
+
+    def clear(self):
+        # Only the checkpoint files themselves are removed, whatever else shares the folder
+        os.makedirs(self.folder, exist_ok=True)
+        for name in os.listdir(self.folder):
+            if name.endswith(('.pkl', '.pkl.tmp')):
+                os.remove(os.path.join(self.folder, name))
+        self._write_meta({'key': self.key, 'stages': []})
+
+    def _path(self, stage: str) -> str:
+        return os.path.join(self.folder, f"{stage}.pkl")
+
+    def _write_meta(self, meta: dict):
+        path = os.path.join(self.folder, "checkpoints.json")
+        with open(path + ".tmp", 'w') as f:
+            json.dump(meta, f)
+        os.replace(path + ".tmp", path)
+
+def _read_meta(folder: str):
+    try:
+        with open(os.path.join(folder, "checkpoints.json")) as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
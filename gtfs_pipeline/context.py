@@ -0,0 +1,113 @@
+import numpy as np
+import geopandas as gpd
+import shapely
+from pyproj import CRS
+
+
+class StudyContext:
+    # Layers of one study area shared by every stage: each layer is stored in the context CRS (the study's UTM
+    # zone) unless added in another one, and projected into any other CRS at most once, on first request.
+    # Every (layer, CRS) gets one STRtree built on first use. Queries between two layers are cached, so stages
+    # asking the same question (e.g. bus stops inside the 100 m rail catchments, for both S factors) share the answer.
+    def __init__(self, crs, **layers):
+        self.crs = crs
+        self._layers = {}
+        self._projected = {}
+        self._trees = {}
+        self._queries = {}
+        for name, gdf in layers.items():
+            self.add(name, gdf)
+
+    def add(self, name: str, gdf: gpd.GeoDataFrame, crs=None) -> gpd.GeoDataFrame:
+        # Stores gdf in crs (default the context CRS) and replaces any layer of that name, with its indexes and queries
+        crs = self.crs if crs is None else crs
+        if crs is not None and gdf.crs is not None and gdf.crs != crs:
+            gdf = gdf.to_crs(crs)
+        self._layers[name] = gdf
+        self._projected = {key: layer for key, layer in self._projected.items() if key[0] != name}
+        self._trees = {key: tree for key, tree in self._trees.items() if key[0] != name}
+        self._queries = {key: pairs for key, pairs in self._queries.items() if name not in key[1:3]}
+        return gdf
+
+    def __contains__(self, name):
+        return name in self._layers
+
+    def crs_of(self, name: str):
+        return self._layers[name].crs
+
+    def layer(self, name: str, crs=None) -> gpd.GeoDataFrame:
+        # The layer, or its projection into crs (made once)
+        gdf = self._layers[name]
+        if crs is None or gdf.crs is None or gdf.crs == crs:
+            return gdf
+        key = (name, _crs_key(crs))
+        if key not in self._projected:
+            self._projected[key] = gdf.to_crs(crs)
+        return self._projected[key]
+
+    def geometries(self, name: str, crs=None) -> np.ndarray:
+        return self.layer(name, crs).geometry.to_numpy()
+
+    def tree(self, name: str, crs=None) -> shapely.STRtree:
+        key = (name, self._key(name, crs))
+        if key not in self._trees:
+            self._trees[key] = shapely.STRtree(self.geometries(name, crs))
+        return self._trees[key]
+
+    # Every query returns (rows of the query geometries, rows of the indexed layer) as positions.
+    # Queries between two layers run in crs, by default the CRS the indexed layer is stored in.
+    def query(self, name: str, geometries, predicate: str = 'intersects', distance=None, crs=None):
+        # Uncached query of arbitrary geometries (already in crs) against a layer's index
+        if not len(self._layers[name]):
+            return np.array([], dtype=np.intp), np.array([], dtype=np.intp)
+        return self.tree(name, crs).query(np.asarray(geometries), predicate=predicate, distance=distance)
+
+    def intersects(self, name: str, other: str, crs=None):
+        # Rows of `name` touching a geometry of `other` (e.g. stops inside the study area, boundary included)
+        crs = self._query_crs(other, crs)
+        return self._cached('intersects', name, other, crs,
+                            lambda: self.query(other, self.geometries(name, crs), 'intersects', crs=crs))
+
+    def within(self, name: str, other: str, crs=None):
+        # Rows of `name` lying inside a geometry of `other` (e.g. stops inside catchments)
+        crs = self._query_crs(other, crs)
+        return self._cached('within', name, other, crs,
+                            lambda: self.query(other, self.geometries(name, crs), 'within', crs=crs))
+
+    def within_distance(self, name: str, other: str, distance: float, crs=None):
+        # Rows of `name` within distance (units of crs) of a geometry of `other`
+        crs = self._query_crs(other, crs)
+        return self._cached(
+            'dwithin', name, other, crs,
+            lambda: self.query(other, self.geometries(name, crs), 'dwithin', distance, crs=crs), distance,
+        )
+
+    def nearest(self, name: str, other: str, max_distance=None, crs=None):
+        # Nearest geometry of `other` for every row of `name` (rows without one within max_distance are left out)
+        crs = self._query_crs(other, crs)
+        def _nearest():
+            if not len(self._layers[other]):
+                return np.array([], dtype=np.intp), np.array([], dtype=np.intp)
+            return self.tree(other, crs).query_nearest(
+                self.geometries(name, crs), max_distance=max_distance, all_matches=False,
+            )
+        return self._cached('nearest', name, other, crs, _nearest, max_distance)
+
+    def _query_crs(self, other, crs):
+        return self.crs_of(other) if crs is None else crs
+
+    def _key(self, name, crs):
+        # CRS key of a layer's geometries: its stored CRS unless projected elsewhere
+        stored = self._layers[name].crs
+        if crs is None or stored is None or stored == crs:
+            return _crs_key(stored)
+        return _crs_key(crs)
+
+    def _cached(self, kind, name, other, crs, compute, *args):
+        key = (kind, name, other, _crs_key(crs)) + args
+        if key not in self._queries:
+            self._queries[key] = compute()
+        return self._queries[key]
+
+def _crs_key(crs):
+    return None if crs is None else CRS.from_user_input(crs).to_wkt()
@@ -0,0 +1,323 @@
+import os
+import json
+import hashlib
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import shapely
+from typing import Optional
+
+from gtfs_pipeline.analysis import (
+    stop_significance, calendar_varies, calendar_idle, check_time_windows, BUS_RAIL_RADIUS,
+    AMENITY_SCORES_PATH, AMENITY_INVENTORY_PATH,
+)
+from gtfs_pipeline.cache import cache_key, file_hash
+from gtfs_pipeline.interpolation import interpolate_roads, DEFAULT_INTERVAL
+from gtfs_pipeline.network import RAIL_TYPES
+from gtfs_pipeline.results import transit_score
+from gtfs_pipeline.scoring import point_contributions, score_links_combined
+
+# Bump when the stored state layout or the scoring rules change; older states trigger a full run
+STATE_VERSION = 3
+MODES = ['bus', 'rail']
+
+
+def incremental_scores(
+    state_dir: str,
+    stops_within_iso: gpd.GeoDataFrame,
+    stops_bymode: gpd.GeoDataFrame,
+    isos_100_rail: gpd.GeoDataFrame,
+    iso_700_bus: gpd.GeoDataFrame,
+    iso_700_rail: gpd.GeoDataFrame,
+    sched_merged: pd.DataFrame,
+    target_crs,
+    tag: str,
+    streets: gpd.GeoDataFrame,
+    sample_interval: float = DEFAULT_INTERVAL,
+    amenity_scores_path: Optional[str] = AMENITY_SCORES_PATH,
+    amenity_inventory_path: Optional[str] = AMENITY_INVENTORY_PATH,
+    amenity_cache_path: Optional[str] = None,
+    time_windows=(),
+):
+    # Returns (bus_iso_scored, rail_iso_scored, bus_rail_attributes, bus_rail_score), identical to a full run.
+    # The previous run's significance and per-point contributions live in state_dir; only the stops whose
+    # inputs changed, their 100m / 3km neighbours and the street links inside their catchments are recomputed.
+    significance_args = dict(
+        stops_within_iso=stops_within_iso, stops_bymode=stops_bymode, isos_100_rail=isos_100_rail,
+        iso_700_bus=iso_700_bus, iso_700_rail=iso_700_rail, sched_merged=sched_merged,
+        target_crs=target_crs, tag=tag, amenity_scores_path=amenity_scores_path,
+        amenity_inventory_path=amenity_inventory_path, amenity_cache_path=amenity_cache_path,
+        time_windows=check_time_windows(time_windows or []),
+    )
+    run_key = _run_key(significance_args, streets, sample_interval)
+    fingerprints = stop_fingerprints(stops_bymode, stops_within_iso, sched_merged, isos_100_rail, iso_700_bus, iso_700_rail)
+
+    state = load_state(state_dir)
+    if state is None or state['meta']['run_key'] != run_key:
+        print("Incremental state missing or outdated, scoring every stop")
+        return _full_run(state_dir, run_key, fingerprints, significance_args, streets, sample_interval)
+
+    # 1) Stops whose own inputs changed (added, removed or modified)
+    old_fp, new_fp = state['fingerprints'], fingerprints
+    both = old_fp.index.intersection(new_fp.index)
+    differs = old_fp.loc[both].to_numpy() != new_fp.loc[both].to_numpy()
+    added_or_removed = old_fp.index.symmetric_difference(new_fp.index)
+    changed = added_or_removed.union(both[differs.any(axis=1)])
+    network_changed = added_or_removed.union(both[differs[:, 0]])
+    if changed.empty:
+        print("No stop changed since the last run")
+        return state['bus'], state['rail'], state['attributes'], transit_score(state['attributes'])
+
+    # 2) Stops whose significance depends on them
+    affected = affected_stops(changed, network_changed, state['stops'], stops_bymode, stops_within_iso, isos_100_rail, target_crs)
+    print(f"{len(changed)} stops changed, re-scoring {len(affected)} stops")
+
+    bus_new, rail_new = stop_significance(**significance_args, stop_ids=affected)
+    tables = {
+        'bus': _patch_table(state['bus'], bus_new, iso_700_bus, affected),
+        'rail': _patch_table(state['rail'], rail_new, iso_700_rail, affected),
+    }
+
+    # 3) Sample points inside an old or new catchment of a re-scored or removed stop
+    catchments = np.concatenate([
+        table.geometry.values[table['stop_id'].isin(affected.union(changed)).to_numpy()]
+        for table in (state['bus'], state['rail'], tables['bus'], tables['rail'])
+    ])
+    points = state['points']
+    hit = np.unique(points.sindex.query(catchments, predicate='intersects')[1])
+
+    modes = state['meta']['modes']
+    isos = [tables[m] for m in modes]
+    windows = [w.name for w in significance_args['time_windows']]
+    if len(hit):
+        sig_sum, stops_count, window_sums = point_contributions(points.iloc[hit], isos)
+        for i, m in enumerate(modes):
+            points.iloc[hit, points.columns.get_loc(f'{m}_sum')] = sig_sum[i]
+            points.iloc[hit, points.columns.get_loc(f'{m}_count')] = stops_count[i]
+            for w in windows:
+                points.iloc[hit, points.columns.get_loc(f'{m}_sum_{w}')] = window_sums[w][i]
+
+    # 4) Street links owning those points, re-aggregated from all of their points
+    links = pd.Index(points['link_id'].to_numpy()[hit]).unique()
+    on_links = points['link_id'].isin(links).to_numpy()
+    streets_gdf = streets[streets['link_id'].isin(links)].to_crs(isos[0].crs)
+    patched = score_links_combined(
+        points['link_id'].to_numpy()[on_links],
+        np.vstack([points[f'{m}_sum'].to_numpy()[on_links] for m in modes]),
+        np.vstack([points[f'{m}_count'].to_numpy()[on_links] for m in modes]),
+        streets_gdf,
+        warn=False,
+        window_sums={w: np.vstack([points[f'{m}_sum_{w}'].to_numpy()[on_links] for m in modes]) for w in windows},
+    )
+    attributes = state['attributes']
+    attributes = pd.concat([attributes[~attributes['link_id'].isin(links)], patched], ignore_index=True)
+    attributes = gpd.GeoDataFrame(attributes, geometry='geometry', crs=isos[0].crs)
+    attributes = attributes.sort_values('link_id', kind='stable').reset_index(drop=True)
+    print(f"Patched {len(links)} street links ({len(hit)} sample points)")
+
+    save_state(state_dir, run_key, new_fp, stops_bymode, tables, points, attributes, modes)
+    return tables['bus'], tables['rail'], attributes, transit_score(attributes)
+
+def _full_run(state_dir, run_key, fingerprints, significance_args, streets, sample_interval):
+    bus_iso_scored, rail_iso_scored = stop_significance(**significance_args)
+    tables = {'bus': bus_iso_scored.reset_index(drop=True), 'rail': rail_iso_scored.reset_index(drop=True)}
+    modes = [m for m in MODES if not tables[m].empty]
+    if not modes:
+        raise ValueError("No bus or rail isochrones to score")
+    isos = [tables[m] for m in modes]
+
+    # Same sampling and join as combine_scores, keeping the per-point contributions for later patches
+    points = interpolate_roads(streets, target_crs=streets.crs, interval=sample_interval)
+    sig_sum, stops_count, window_sums = point_contributions(points, isos)
+    for i, m in enumerate(modes):
+        points[f'{m}_sum'] = sig_sum[i]
+        points[f'{m}_count'] = stops_count[i]
+        for w, sums in window_sums.items():
+            points[f'{m}_sum_{w}'] = sums[i]
+
+    attributes = score_links_combined(
+        points['link_id'].to_numpy(), sig_sum, stops_count, streets.to_crs(isos[0].crs), window_sums=window_sums
+    )
+    save_state(state_dir, run_key, fingerprints, significance_args['stops_bymode'], tables, points, attributes, modes)
+    return tables['bus'], tables['rail'], attributes, transit_score(attributes)
+
+def _patch_table(old, new, iso_700, affected):
+    # Unaffected rows from the previous run plus the re-scored ones, in the order a full run would produce.
+    # A full run merges iso_700 with the per-stop rows, so every isochrone of a stop (one per mode) is followed
+    # by the same block of rows, and a stop listed under several modes has several rows per isochrone.
+    frames = [f for f in (old[~old['stop_id'].isin(affected)], new) if not f.empty]
+    table = pd.concat(frames, ignore_index=True) if frames else new
+    iso_ids = iso_700['stop_id'].astype(str).reset_index(drop=True)
+    table = table[table['stop_id'].astype(str).isin(iso_ids)].reset_index(drop=True)
+
+    # Position in iso_700 of the isochrone each row was merged onto
+    stop_ids = table['stop_id'].astype(str)
+    occurrence = stop_ids.groupby(stop_ids).cumcount().to_numpy()
+    block = (stop_ids.map(stop_ids.value_counts()) // stop_ids.map(iso_ids.value_counts())).to_numpy()
+    iso_pos = pd.Series(np.arange(len(iso_ids)), index=pd.MultiIndex.from_arrays([iso_ids, iso_ids.groupby(iso_ids).cumcount()]))
+    position = iso_pos.reindex(pd.MultiIndex.from_arrays([stop_ids, occurrence // block])).to_numpy()
+    table = table.iloc[np.lexsort((occurrence, position))].reset_index(drop=True)
+    return gpd.GeoDataFrame(table, geometry='geometry', crs=iso_700.crs)
+
+
+##--------------------------------------------------------------------------
+## Change Detection
+##--------------------------------------------------------------------------
+
+def stop_fingerprints(stops_bymode, stops_within_iso, sched_merged, isos_100_rail, iso_700_bus, iso_700_rail) -> pd.DataFrame:
+    # Two hashes per stop_id over everything its significance reads:
+    #   network: mode, routes, position, study-area membership and 100m isochrone, which neighbouring stops also read
+    #   local:   schedule rows (in order) and 700m isochrones, which only the stop itself reads
+    def _combine(parts):
+        index = parts[0].index
+        for part in parts[1:]:
+            index = index.union(part.index)
+        combined = pd.concat([part.reindex(index, fill_value=0) for part in parts], axis=1)
+        return pd.Series(pd.util.hash_pandas_object(combined, index=True).to_numpy(), index=index)
+
+    def _geometry_hash(iso):
+        return _ordered_hash(iso['stop_id'], pd.DataFrame({'geometry': shapely.to_wkb(iso.geometry.values)}))
+
+    network = _combine([
+        _ordered_hash(
+            stops_bymode['stop_id'],
+            pd.DataFrame({
+                'route_type': stops_bymode['route_type'].to_numpy(),
+                'routes': stops_bymode['routes'].map(_routes_key).to_numpy(),
+                'geometry': shapely.to_wkb(stops_bymode.geometry.values),
+            }),
+        ),
+        _ordered_hash(stops_within_iso['stop_id'], pd.DataFrame({'within': np.ones(len(stops_within_iso))})),
+        _geometry_hash(isos_100_rail),
+    ])
+    local = _combine([
+        _ordered_hash(sched_merged['stop_id'], sched_merged),
+        _geometry_hash(iso_700_bus),
+        _geometry_hash(iso_700_rail),
+    ])
+    index = network.index.union(local.index)
+    return pd.DataFrame({
+        'network': network.reindex(index, fill_value=0),
+        'local': local.reindex(index, fill_value=0),
+    }, index=pd.Index(index, name='stop_id'))
+
+def _ordered_hash(stop_ids: pd.Series, rows: pd.DataFrame) -> pd.Series:
+    # Order-sensitive sum of row hashes per stop (uint64 arithmetic wraps around)
+    codes, uniques = pd.factorize(np.asarray(stop_ids).astype(str))
+    row_hash = pd.util.hash_pandas_object(rows, index=False).to_numpy()
+    position = pd.Series(codes).groupby(codes).cumcount().to_numpy().astype(np.uint64)
+    weighted = row_hash * (np.uint64(2) * position + np.uint64(1))
+    out = np.zeros(len(uniques), dtype=np.uint64)
+    np.add.at(out, codes, weighted)
+    return pd.Series(out, index=pd.Index(uniques, name='stop_id'))
+
+def _routes_key(routes):
+    if isinstance(routes, (list, set, tuple)):
+        return '|'.join(sorted(map(str, routes)))
+    return '' if pd.isna(routes) else str(routes)
+
+def affected_stops(changed, network_changed, old_stops, stops_bymode, stops_within_iso, isos_100_rail, target_crs) -> pd.Index:
+    # Stops in the study area whose significance can differ because of the changed stops:
+    #   - the changed stops themselves
+    #   - rail stations whose 100m isochrone holds a network-changed bus stop (rail factor S, station route sets)
+    #   - bus stops within 3km of a network-changed rail station or of a station from the previous line (bus factor S)
+    within = pd.Index(stops_within_iso['stop_id'].astype(str))
+    rows = pd.concat([
+        old_stops[['stop_id', 'route_type', 'geometry']],
+        stops_bymode[['stop_id', 'route_type', 'geometry']].to_crs(old_stops.crs),
+    ], ignore_index=True)
+    rows = rows[rows['stop_id'].astype(str).isin(network_changed)]
+    is_rail = rows['route_type'].isin(RAIL_TYPES | {0}).to_numpy()
+    bus_geoms = rows.geometry.values[(rows['route_type'] == 3).to_numpy()]
+
+    near_iso = isos_100_rail.sindex.query(bus_geoms, predicate='within')[1] if len(isos_100_rail) else []
+    stations = pd.Index(isos_100_rail['stop_id'].astype(str).to_numpy()[near_iso]).unique()
+
+    station_geoms = gpd.GeoSeries(
+        np.concatenate([
+            rows.geometry.values[is_rail],
+            stops_within_iso.geometry.values[stops_within_iso['stop_id'].astype(str).isin(stations).to_numpy()],
+        ]),
+        crs=old_stops.crs,
+    ).to_crs(target_crs)
+    bus_within = stops_within_iso[stops_within_iso['route_type'] == 3]
+    bus_points = bus_within.to_crs(target_crs).geometry.values
+    near_bus = shapely.STRtree(bus_points).query(station_geoms.values, predicate='dwithin', distance=BUS_RAIL_RADIUS)[1]
+    buses = pd.Index(bus_within['stop_id'].astype(str).to_numpy()[near_bus]).unique()
+
+    return within.intersection(pd.Index(changed).union(stations).union(buses))
+
+def _run_key(significance_args, streets, sample_interval) -> str:
+    # Inputs shared by every stop; any change here means a full run
+    def _hash(path):
+        return file_hash(path) if path is not None and os.path.exists(path) else None
+
+    sched = significance_args['sched_merged']
+    within = significance_args['stops_within_iso']
+    bus_ids = within.loc[within['route_type'] == 3, 'stop_id']
+    rail_ids = within.loc[within['route_type'].isin(RAIL_TYPES | {0}), 'stop_id']
+    bus_sched = sched[(sched['route_type'] == 3) & sched['stop_id'].isin(bus_ids)]
+    rail_sched = sched[sched['route_type'].isin(RAIL_TYPES | {0}) & sched['stop_id'].isin(rail_ids)]
+    street_rows = pd.DataFrame({
+        'link_id': streets['link_id'].to_numpy(),
+        'name': streets['name'].astype(str).to_numpy(),
+        'geometry': shapely.to_wkb(streets.geometry.values),
+    })
+    return cache_key(
+        version=STATE_VERSION,
+        tag=significance_args['tag'],
+        target_crs=str(significance_args['target_crs']),
+        amenity_scores=_hash(significance_args['amenity_scores_path']),
+        amenity_inventory=_hash(significance_args['amenity_inventory_path']),
+        time_windows=significance_args['time_windows'],
+        bus_days=calendar_varies(bus_sched),
+        rail_days=calendar_varies(rail_sched),
+        bus_idle=calendar_idle(bus_sched),
+        rail_idle=calendar_idle(rail_sched),
+        modes=[not significance_args['iso_700_bus'].empty, not significance_args['iso_700_rail'].empty],
+        streets=hashlib.sha256(pd.util.hash_pandas_object(street_rows, index=False).to_numpy().tobytes()).hexdigest(),
+        streets_crs=str(streets.crs),
+        sample_interval=sample_interval,
+    )
+
+
+##--------------------------------------------------------------------------
+## State Directory
+##--------------------------------------------------------------------------
+
+def load_state(state_dir: str) -> Optional[dict]:
+    meta_path = os.path.join(state_dir, 'meta.json')
+    if not os.path.exists(meta_path):
+        return None
+    with open(meta_path) as f:
+        meta = json.load(f)
+    if meta.get('version') != STATE_VERSION:
+        return None
+
+    return {
+        'meta': meta,
+        'fingerprints': pd.read_parquet(os.path.join(state_dir, 'fingerprints.parquet')),
+        'stops': gpd.read_parquet(os.path.join(state_dir, 'stops.parquet')),
+        'bus': gpd.read_parquet(os.path.join(state_dir, 'bus.parquet')),
+        'rail': gpd.read_parquet(os.path.join(state_dir, 'rail.parquet')),
+        'points': gpd.read_parquet(os.path.join(state_dir, 'points.parquet')),
+        'attributes': gpd.read_parquet(os.path.join(state_dir, 'attributes.parquet')),
+    }
+
+def save_state(state_dir, run_key, fingerprints, stops_bymode, tables, points, attributes, modes):
+    os.makedirs(state_dir, exist_ok=True)
+    # meta.json is written last and marks the state as complete
+    meta_path = os.path.join(state_dir, 'meta.json')
+    if os.path.exists(meta_path):
+        os.remove(meta_path)
+
+    fingerprints.to_parquet(os.path.join(state_dir, 'fingerprints.parquet'))
+    stops_bymode[['stop_id', 'route_type', 'geometry']].assign(stop_id=lambda df: df['stop_id'].astype(str)) \
+        .to_parquet(os.path.join(state_dir, 'stops.parquet'), index=False)
+    tables['bus'].to_parquet(os.path.join(state_dir, 'bus.parquet'), index=False)
+    tables['rail'].to_parquet(os.path.join(state_dir, 'rail.parquet'), index=False)
+    points.to_parquet(os.path.join(state_dir, 'points.parquet'), index=False)
+    attributes.to_parquet(os.path.join(state_dir, 'attributes.parquet'), index=False)
+
+    with open(meta_path, 'w') as f:
+        json.dump({'version': STATE_VERSION, 'run_key': run_key, 'modes': modes}, f)
@@ -1,22 +1,45 @@
-from shapely.geometry import Point
 import numpy as np
 import geopandas as gpd
+import shapely
 
-def interpolate_roads(streets, target_crs):
-    interval = 10
+# Spacing (in CRS units) of the sample points along each street
+DEFAULT_INTERVAL = 10
 
-    streets['points'] = streets['geometry'].apply(lambda geom: interpolate_points(geom, interval))
+def interpolate_roads(streets, target_crs, interval=DEFAULT_INTERVAL, output_crs="EPSG:4326"):
+    line_idx, points = sample_lines(streets.geometry.to_numpy(), interval)
 
-    # Explode points into separate rows
-    points_gdf = streets.explode('points', ignore_index=True)
-    points_gdf = points_gdf.drop(columns=['geometry']).rename(columns={'points': 'geometry'})
-    points_gdf = gpd.GeoDataFrame(points_gdf, geometry='geometry', crs=target_crs)
-    points_gdf = points_gdf.to_crs("EPSG:4326")
+    # One row per sample point, carrying the attributes scoring groups by
+    columns = {
+        col: streets[col].to_numpy()[line_idx]
+        for col in ('link_id', 'name') if col in streets.columns
+    }
+    points_gdf = gpd.GeoDataFrame(columns, geometry=points, crs=target_crs)
+    if output_crs is not None:
+        points_gdf = points_gdf.to_crs(output_crs)
 
     return points_gdf
 
-def interpolate_points(line, interval):    
-    points = [line.interpolate(distance) for distance in np.arange(0, line.length, interval)]
-    if line.coords[-1] not in points:
-        points.append(Point(line.coords[-1]))
-    return points
\ No newline at end of file
+def sample_lines(lines, interval):
+    # Points every `interval` from the start of each line, plus its end point.
+    # Returns (index of the source line per point, points), ordered by line then distance.
+    lines = np.asarray(lines, dtype=object)
+    valid = ~(shapely.is_missing(lines) | shapely.is_empty(lines))
+    lengths = np.where(valid, shapely.length(lines), 0.0)
+
+    # Same sample count as np.arange(0, length, interval)
+    counts = np.ceil(lengths / interval).astype(np.int64)
+    ends = valid.astype(np.int64)
+    per_line = counts + ends
+
+    line_idx = np.repeat(np.arange(len(lines)), per_line)
+    offsets = np.cumsum(per_line) - per_line
+    step = np.arange(len(line_idx)) - np.repeat(offsets, per_line)
+    is_end = step == np.repeat(counts, per_line)
+
+    points = np.empty(len(line_idx), dtype=object)
+    points[~is_end] = shapely.line_interpolate_point(
+        lines[line_idx[~is_end]], step[~is_end] * float(interval)
+    )
+    # End point of the last part, so multipart streets get one too
+    points[is_end] = shapely.get_point(shapely.get_geometry(lines[line_idx[is_end]], -1), -1)
+    return line_idx, points
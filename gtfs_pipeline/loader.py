@@ -0,0 +1,86 @@
+import os
+import re
+import osmnx as ox
+
+# Tag rules of osmnx's 'walk' network filter (way must have a highway tag and match none of these)
+WALK_EXCLUDE = {
+    'area': 'yes',
+    'access': 'private',
+    'highway': 'abandoned|bus_guideway|construction|cycleway|motor|no|planned|platform|proposed|raceway|razed|rest_area|services',
+    'foot': 'no',
+    'service': 'private',
+    'sidewalk': 'separate',
+    'sidewalk:both': 'separate',
+    'sidewalk:left': 'separate',
+    'sidewalk:right': 'separate',
+}
+
+def load_walknetwork(buffer, path: str, network_type: str = 'walk'):
+    if network_type != 'walk':
+        raise ValueError(f"Offline loading only supports network_type='walk', got {network_type!r}")
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"Walk network file does not exist: {path}")
+
+    lower = path.lower()
+    if lower.endswith('.graphml'):
+        G = ox.load_graphml(path)
+    elif lower.endswith('.pbf'):
+        G = _graph_from_pbf(path, buffer)
+    elif lower.endswith(('.osm', '.xml')):
+        G = _graph_from_osm_xml(path)
+    else:
+        raise ValueError(f"Unsupported walk network file (expected .graphml, .osm/.xml or .pbf): {path}")
+
+    G = clip_graph(G, buffer)
+    return ox.truncate.largest_component(G)
+
+def clip_graph(G, buffer):
+    # Keep the nodes inside the streets buffer, found with one STRtree query
+    area = buffer.to_crs(G.graph['crs']).union_all()
+    nodes = ox.convert.graph_to_gdfs(G, edges=False)
+    inside = nodes.sindex.query(area, predicate='intersects')
+    return G.subgraph(nodes.index[inside]).copy()
+
+##--------------------------------------------------------------------------
+## OSM Extracts
+##--------------------------------------------------------------------------
+
+def _graph_from_osm_xml(path: str):
+    useful_tags = ox.settings.useful_tags_way
+    ox.settings.useful_tags_way = list(dict.fromkeys(useful_tags + list(WALK_EXCLUDE)))
+    try:
+        # Walk networks are bidirectional; filter raw ways before simplifying, like the Overpass query does
+        G = ox.graph_from_xml(path, bidirectional=True, simplify=False, retain_all=True)
+    finally:
+        ox.settings.useful_tags_way = useful_tags
+
+    drop = [
+        (u, v, k) for u, v, k, data in G.edges(keys=True, data=True)
+        if not _is_walkable(data)
+    ]
+    G.remove_edges_from(drop)
+    G.remove_nodes_from([n for n, deg in G.degree() if deg == 0])
+    return ox.simplify_graph(G)
+
+def _is_walkable(tags: dict) -> bool:
+    if 'highway' not in tags:
+        return False
+    for key, pattern in WALK_EXCLUDE.items():
+        value = tags.get(key)
+        if value is not None and re.search(pattern, str(value)):
+            return False
+    return True
+
+def _graph_from_pbf(path: str, buffer):
+    try:
+        from pyrosm import OSM
+    except ImportError as e:
+        raise ImportError("Reading .pbf extracts requires pyrosm (pip install pyrosm)") from e
+
+    # pyrosm skips everything outside the bounding box while decoding the extract
+    minx, miny, maxx, maxy = buffer.to_crs(epsg=4326).total_bounds
+    osm = OSM(path, bounding_box=[minx, miny, maxx, maxy])
+    nodes, edges = osm.get_network(network_type='walking', nodes=True)
+    if edges is None or edges.empty:
+        raise ValueError(f"No walkable ways found in {path} for the study area")
+    return osm.to_graph(nodes, edges, graph_type='networkx', osmnx_compatible=True)
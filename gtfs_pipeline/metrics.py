@@ -0,0 +1,220 @@
+import os
+import sys
+import csv
+import json
+import time
+import platform
+import cProfile
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+PROFILERS = ('cprofile', 'tracemalloc')
+
+# Allocation sites listed per stage in the tracemalloc report
+TRACEMALLOC_TOP = 25
+
+
+class Stage:
+    # Handle yielded by RunMetrics.stage; count() attaches row counts to the stage record
+    def __init__(self, record: dict):
+        self.record = record
+
+    def count(self, **rows):
+        for name, value in rows.items():
+            self.record['rows'][name] = None if value is None else int(value)
+
+
+class RunMetrics:
+    # Wall time, CPU time (this process and finished worker processes), peak RSS and row counts per stage.
+    # profile: None, 'cprofile' or 'tracemalloc', applied to profile_stages (None = every stage);
+    # profiles are written next to the report.
+    def __init__(self, report_dir=None, profile=None, profile_stages=None, verbose=True, **meta):
+        if profile is not None and profile not in PROFILERS:
+            raise ValueError(f"Unknown profiler {profile!r} (expected one of {PROFILERS})")
+        self.report_dir = report_dir
+        self.profile = profile
+        self.profile_stages = None if profile_stages is None else set(profile_stages)
+        self.verbose = verbose
+        self.started = time.perf_counter()
+        self.run_id = f"{datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%SZ')}_{os.getpid()}"
+        self.meta = {
+            'run_id': self.run_id,
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            **meta,
+        }
+        self.stages = []
+
+    @contextmanager
+    def stage(self, name: str):
+        record = {'stage': name, 'status': 'ok', 'rows': {}}
+        profiler = self._start_profiler(name)
+        peak_reset = reset_peak_rss()
+        wall, cpu, children = time.perf_counter(), time.process_time(), _children_cpu()
+        try:
+            yield Stage(record)
+        except BaseException:
+            record['status'] = 'failed'
+            raise
+        finally:
+            record['wall_s'] = round(time.perf_counter() - wall, 3)
+            record['cpu_s'] = round(time.process_time() - cpu, 3)
+            record['children_cpu_s'] = round(_children_cpu() - children, 3)
+            # Without a per-stage reset the peak is the process peak so far
+            record['peak_rss_mb'] = _mb(peak_rss())
+            record['peak_rss_scope'] = 'stage' if peak_reset else 'process'
+            record['rss_mb'] = _mb(current_rss())
+            record['children_peak_rss_mb'] = _mb(_children_peak_rss())
+            self._stop_profiler(name, profiler, record)
+            self.stages.append(record)
+            if self.verbose:
+                print(f"⏱️ {name}: {record['wall_s']:.1f}s wall, {record['cpu_s'] + record['children_cpu_s']:.1f}s CPU, "
+                      f"peak RSS {record['peak_rss_mb']:,.0f} MB")
+
+    def report(self) -> dict:
+        return {
+            **self.meta,
+            'total_wall_s': round(time.perf_counter() - self.started, 3),
+            'stages': self.stages,
+        }
+
+    def write(self, report_dir=None) -> list:
+        # run_<id>.json with everything, run_<id>.csv with one row per stage (row counts as rows_<name>)
+        report_dir = report_dir or self.report_dir
+        if report_dir is None:
+            return []
+        os.makedirs(report_dir, exist_ok=True)
+        json_path = os.path.join(report_dir, f"run_{self.run_id}.json")
+        csv_path = os.path.join(report_dir, f"run_{self.run_id}.csv")
+
+        with open(json_path, 'w') as f:
+            json.dump(self.report(), f, indent=2, default=str)
+
+        rows = [
+            {**{k: v for k, v in record.items() if k != 'rows'},
+             **{f'rows_{k}': v for k, v in record['rows'].items()}}
+            for record in self.stages
+        ]
+        columns = list(dict.fromkeys(c for row in rows for c in row))
+        with open(csv_path, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=columns)
+            writer.writeheader()
+            writer.writerows(rows)
+        return [json_path, csv_path]
+
+    def _profiled(self, name):
+        return self.profile is not None and (self.profile_stages is None or name in self.profile_stages)
+
+    def _start_profiler(self, name):
+        if not self._profiled(name):
+            return None
+        if self.profile == 'cprofile':
+            profiler = cProfile.Profile()
+            profiler.enable()
+            return profiler
+        # tracemalloc: nested or already running tracing keeps going; only its peak is reset
+        started = not tracemalloc.is_tracing()
+        if started:
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+        return started
+
+    def _stop_profiler(self, name, profiler, record):
+        if not self._profiled(name):
+            return
+        folder = self.report_dir or '.'
+        os.makedirs(folder, exist_ok=True)
+        if self.profile == 'cprofile':
+            profiler.disable()
+            path = os.path.join(folder, f"run_{self.run_id}_{name}.prof")
+            profiler.dump_stats(path)
+        else:
+            _, peak = tracemalloc.get_traced_memory()
+            record['traced_peak_mb'] = _mb(peak)
+            top = tracemalloc.take_snapshot().statistics('lineno')[:TRACEMALLOC_TOP]
+            path = os.path.join(folder, f"run_{self.run_id}_{name}.tracemalloc.txt")
+            with open(path, 'w') as f:
+                f.write("\n".join(str(stat) for stat in top) + "\n")
+            if profiler:
+                tracemalloc.stop()
+        record['profile'] = path
+
+
+##--------------------------------------------------------------------------
+## Process Memory
+##--------------------------------------------------------------------------
+
+def reset_peak_rss() -> bool:
+    # Linux resets the VmHWM high-water mark on "5" > /proc/self/clear_refs; False where unsupported
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+def peak_rss() -> int:
+    # Bytes; VmHWM on Linux, else the process-lifetime maximum from getrusage
+    value = _proc_status('VmHWM')
+    if value is not None or resource is None:
+        return value or 0
+    return _maxrss_bytes(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+
+def current_rss() -> int:
+    value = _proc_status('VmRSS')
+    return value if value is not None else peak_rss()
+
+def group_rss(pgid: int):
+    # Bytes resident in every process of a process group (a job and its worker pools); None without /proc
+    if not os.path.isdir('/proc'):
+        return None
+    total = 0
+    for pid in os.listdir('/proc'):
+        if not pid.isdigit():
+            continue
+        try:
+            # Fields after the parenthesised command name: state, ppid, pgrp, ...
+            with open(f'/proc/{pid}/stat') as f:
+                if int(f.read().rsplit(')', 1)[1].split()[2]) != pgid:
+                    continue
+            total += _proc_status('VmRSS', pid) or 0
+        except (OSError, ValueError, IndexError):
+            # The process exited while being read
+            continue
+    return total
+
+def _proc_status(field, pid='self'):
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+def _children_peak_rss():
+    # Largest finished worker process so far
+    if resource is None:
+        return 0
+    return _maxrss_bytes(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+
+def _children_cpu():
+    if resource is None:
+        return 0.0
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+def _maxrss_bytes(value):
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    return value if sys.platform == 'darwin' else value * 1024
+
+def _mb(value):
+    return round(value / 2**20, 1)
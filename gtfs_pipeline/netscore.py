@@ -0,0 +1,133 @@
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+from scipy import sparse
+from typing import NamedTuple, Optional
+
+from gtfs_pipeline.scoring import score_links_combined, window_names, decay_weights, Decay
+from gtfs_pipeline.walkgraph import WalkGraph, ReachPool, graph_to_csr, snap_to_nodes, bounded_distances
+
+# Walking distance (metres along the network) within which a stop serves a street sample point
+DEFAULT_RADIUS = 700
+# Stops traversed per Dijkstra call; each call's reach is reduced before the next one
+ORIGINS_PER_BATCH = 4096
+
+
+class NodeSignificance(NamedTuple):
+    sum: np.ndarray     # (modes x nodes) summed significance of the stops within walking distance of each node
+    count: np.ndarray   # (modes x nodes) number of those stops
+    wg: WalkGraph
+    window_sums: Optional[dict] = None  # {window: (modes x nodes)} summed significance_<window>
+
+
+##--------------------------------------------------------------------------
+## Stop -> Node Reachability
+##--------------------------------------------------------------------------
+
+def node_significance(isos, stops: gpd.GeoDataFrame, graph, radius: float = DEFAULT_RADIUS, n_workers: int = 1,
+                      decay: Optional[Decay] = None) -> NodeSignificance:
+    # isos: scored stop layers (e.g. [bus, rail]) with stop_id and significance columns; only those columns are read.
+    # stops: stop locations by stop_id; graph: walk network (networkx graph or WalkGraph).
+    # One bounded Dijkstra on the reversed graph from every distinct stop node gives the walk distance from each
+    # node to each stop; the sparse (stops x nodes) reach is reduced against the significance vectors.
+    # decay: significance is weighted by that walk distance (counts are not)
+    wg = graph if isinstance(graph, WalkGraph) else graph_to_csr(graph)
+    n_nodes = wg.adjacency.shape[0]
+    windows = window_names(isos)
+    columns = ['significance'] + [f'significance_{w}' for w in windows]
+
+    nodes, weights = [], []
+    for iso in isos:
+        node = stop_nodes(wg, iso['stop_id'], stops)
+        # Stops without a location or a significance are not counted by the point-in-polygon join either
+        keep = (node >= 0) & iso['significance'].notna().to_numpy()
+        nodes.append(node[keep])
+        weights.append(np.nan_to_num(iso[columns].to_numpy(dtype=float)[keep]))
+
+    origins, inverse = np.unique(np.concatenate(nodes), return_inverse=True)
+    mode_of = np.repeat(np.arange(len(isos)), [len(n) for n in nodes])
+    values = np.concatenate(weights) if weights else np.zeros((0, len(columns)))
+
+    # Per origin node and mode: stop count plus every significance column, as (origins x (modes * (1 + columns)))
+    n_values = 1 + len(columns)
+    per_origin = np.zeros((len(origins), len(isos) * n_values))
+    for m in range(len(isos)):
+        rows = mode_of == m
+        block = np.column_stack([np.ones(rows.sum()), values[rows]])
+        np.add.at(per_origin, (inverse[rows], slice(m * n_values, (m + 1) * n_values)), block)
+
+    totals = np.zeros((n_nodes, per_origin.shape[1]))
+    counts = np.arange(per_origin.shape[1]) % n_values == 0
+    reverse = reverse_graph(wg)
+    # One pool (and one copy of the graph arrays) serves every batch
+    with ReachPool(reverse, n_workers) as pool:
+        for start in range(0, len(origins), ORIGINS_PER_BATCH):
+            reach = bounded_distances(reverse, origins[start:start + ORIGINS_PER_BATCH], limit=radius, pool=pool)
+            batch = per_origin[start:start + ORIGINS_PER_BATCH]
+            within = served(reach, radius)
+            if decay is None:
+                totals += within.T @ batch
+            else:
+                weighted = within.multiply(_decay_matrix(reach, decay)).tocsr()
+                totals[:, counts] += within.T @ batch[:, counts]
+                totals[:, ~counts] += weighted.T @ batch[:, ~counts]
+
+    totals = totals.T.reshape(len(isos), n_values, n_nodes)
+    return NodeSignificance(
+        totals[:, 1], np.rint(totals[:, 0]).astype(np.int64), wg,
+        {w: totals[:, 2 + i] for i, w in enumerate(windows)},
+    )
+
+def reverse_graph(wg: WalkGraph) -> WalkGraph:
+    # Same nodes with every edge reversed, so a traversal from a stop measures the walk *to* it
+    return wg._replace(adjacency=wg.adjacency.T.tocsr())
+
+def served(reach: sparse.csr_matrix, radius: float) -> sparse.csr_matrix:
+    # 0/1 (origins x nodes) matrix of the entries within radius; the origin's own explicit zero distance counts
+    return sparse.csr_matrix(
+        ((reach.data <= radius).astype(float), reach.indices, reach.indptr), shape=reach.shape
+    )
+
+def _decay_matrix(reach: sparse.csr_matrix, decay: Decay) -> sparse.csr_matrix:
+    # Decay weight of every stored walk distance (the origin's explicit zero distance weighs 1)
+    return sparse.csr_matrix((decay_weights(reach.data, decay), reach.indices, reach.indptr), shape=reach.shape)
+
+def stop_nodes(wg: WalkGraph, stop_ids: pd.Series, stops: gpd.GeoDataFrame) -> np.ndarray:
+    # Graph position of the node each stop snaps to, -1 for stops without a location
+    located = stops[~(stops.geometry.isna() | stops.geometry.is_empty)].drop_duplicates(subset='stop_id')
+    if wg.crs is not None and located.crs is not None and located.crs != wg.crs:
+        located = located.to_crs(wg.crs)
+    node = np.full(len(located), -1, dtype=np.int64)
+    if len(wg.node_ids):
+        node = snap_to_nodes(wg, located.geometry.x, located.geometry.y)
+    row = pd.Index(located['stop_id'].astype(str)).get_indexer(pd.Series(stop_ids).astype(str))
+    return np.where(row >= 0, node[row] if len(node) else -1, -1)
+
+
+##--------------------------------------------------------------------------
+## Sampling
+##--------------------------------------------------------------------------
+
+def sample_nodes(node_sig: NodeSignificance, points: gpd.GeoDataFrame):
+    # (sum, count, window sums) as (modes x points) arrays at the node each sample point snaps to
+    wg = node_sig.wg
+    if wg.crs is not None and points.crs is not None and points.crs != wg.crs:
+        points = points.to_crs(wg.crs)
+    n_modes = node_sig.sum.shape[0]
+    if not len(wg.node_ids) or not len(points):
+        empty = np.zeros((n_modes, len(points)))
+        return empty, empty.astype(np.int64), {w: empty for w in node_sig.window_sums or {}}
+    node = snap_to_nodes(wg, points.geometry.x, points.geometry.y)
+    return (
+        node_sig.sum[:, node],
+        node_sig.count[:, node],
+        {w: sums[:, node] for w, sums in (node_sig.window_sums or {}).items()},
+    )
+
+def network_scoring_combined(points, node_sig: NodeSignificance, streets, warn=True):
+    # Same output as scoring.scoring_combined, with isochrone containment replaced by walking distance
+    # between the nodes the stop and the sample point snap to
+    sig_sum, stops_count, window_sums = sample_nodes(node_sig, points)
+    return score_links_combined(
+        points['link_id'].to_numpy(), sig_sum, stops_count, streets, warn=warn, window_sums=window_sums,
+    )
@@ -1,52 +1,70 @@
+import os
 import osmnx as ox
-import networkx as nx
+import numpy as np
+import pandas as pd
 import geopandas as gpd
-from shapely.geometry import Point
 from typing import Set
 from shapely.geometry import box
 
-def download_walknetwork(buffer):
-    minx, miny, maxx, maxy = buffer.total_bounds
-    bbox = (minx, miny, maxx, maxy)
-    G_Walk = ox.graph.graph_from_bbox(bbox, network_type='walk')
-    return G_Walk
-
-def compute_isochrones(stops,G):
-    RAIL_TYPES = {1, 2, 5, 12}
-    records_700 = []
-    records_100_rail = []
-    for sid, geom, rtype in zip(stops['stop_id'], stops.geometry, stops['route_type']):
-        try:
-            center = ox.distance.nearest_nodes(G, X=geom.x, Y=geom.y)
-
-            # 700m buffer for all modes
-            subg_700 = nx.ego_graph(G, center, radius=700, distance='length')
-            pts_700 = [Point(data['x'], data['y']) for _, data in subg_700.nodes(data=True)]
-            if pts_700:
-                hull_700 = gpd.GeoSeries(pts_700).union_all().convex_hull
-                records_700.append({'stop_id': sid, 'route_type': rtype, 'geometry': hull_700})
-
-            # 100m buffer for rail modes only
-            if rtype in RAIL_TYPES:
-                subg_100 = nx.ego_graph(G, center, radius=100, distance='length')
-                pts_100 = [Point(data['x'], data['y']) for _, data in subg_100.nodes(data=True)]
-                if pts_100:
-                    hull_100 = gpd.GeoSeries(pts_100).union_all().convex_hull
-                    records_100_rail.append({'stop_id': sid, 'route_type': rtype, 'geometry': hull_100})
-
-        except Exception:
-            continue
-
-    def _to_gdf(records):
-        if not records:
+from gtfs_pipeline.cache import DiskCache, cache_key, file_hash
+from gtfs_pipeline.loader import load_walknetwork
+from gtfs_pipeline.walkgraph import (
+    graph_to_csr, snap_to_nodes, nearest_positions, bounded_distances, reach_catchments,
+    CATCHMENTS, EDGE_BUFFER, CONCAVE_RATIO,
+)
+
+RAIL_TYPES = {1, 2, 5, 12}
+
+def get_walknetwork(buffer, source=None, network_type='walk'):
+    # source: None downloads from Overpass, otherwise a local .graphml/.osm/.xml/.pbf file
+    if source is None:
+        minx, miny, maxx, maxy = buffer.total_bounds
+        return ox.graph.graph_from_bbox((minx, miny, maxx, maxy), network_type=network_type)
+    return load_walknetwork(buffer, source, network_type=network_type)
+
+def compute_isochrones(stops,G, n_workers=1, catchment='convex'):
+    # catchment: 'convex' (hull of the reached nodes), 'edges' (buffered reached edges) or 'concave'; see reach_catchments
+    # Convert the walk graph once and snap every stop in a single KD-tree query
+    wg = graph_to_csr(G)
+    stops_valid = _valid_stops(stops, wg)
+    centers = snap_to_nodes(wg, stops_valid.geometry.x, stops_valid.geometry.y)
+
+    is_rail = stops_valid['route_type'].isin(RAIL_TYPES).to_numpy()
+    hulls_700, hulls_100 = _node_hulls(wg, centers, is_rail, n_workers=n_workers, catchment=catchment)
+    return _split_isochrones(stops, stops_valid, hulls_700, hulls_100, is_rail)
+
+def _valid_stops(stops, wg):
+    geoms = stops.geometry
+    valid = (~(geoms.isna() | geoms.is_empty)).to_numpy()
+    if len(wg.node_ids) == 0:
+        valid[:] = False
+    return stops[valid]
+
+def _node_hulls(wg, centers, is_rail, n_workers=1, catchment='convex'):
+    # One bounded traversal per distinct snapped node; the 100m hulls reuse the 700m distances
+    origins, inverse = np.unique(centers, return_inverse=True)
+    reach = bounded_distances(wg, origins, limit=700, n_workers=n_workers)
+
+    hulls_700 = reach_catchments(wg, reach, 700, method=catchment, n_workers=n_workers)[inverse]
+    rail_rows, rail_inverse = np.unique(inverse[is_rail], return_inverse=True)
+    hulls_100 = reach_catchments(wg, reach, 100, rows=rail_rows, method=catchment, n_workers=n_workers)[rail_inverse]
+    return hulls_700, hulls_100
+
+def _split_isochrones(stops, stops_valid, hulls_700, hulls_100, is_rail):
+    def _to_gdf(records, hulls):
+        if records.empty:
             return gpd.GeoDataFrame(columns=['stop_id', 'route_type', 'geometry'], crs=stops.crs)
-        gdf = gpd.GeoDataFrame(records, crs=stops.crs)
+        gdf = gpd.GeoDataFrame(
+            {'stop_id': records['stop_id'].to_numpy(), 'route_type': records['route_type'].to_numpy()},
+            geometry=hulls,
+            crs=stops.crs,
+        )
         gdf['stop_id'] = gdf['stop_id'].astype(str)
         gdf = gdf[gdf.geometry.geom_type == "Polygon"].copy()
         return gdf
 
-    isos_700_all  = _to_gdf(records_700)
-    isos_100_rail = _to_gdf(records_100_rail)
+    isos_700_all  = _to_gdf(stops_valid, hulls_700)
+    isos_100_rail = _to_gdf(stops_valid[is_rail], hulls_100)
 
     isos_700_rail = isos_700_all[isos_700_all['route_type'].isin(RAIL_TYPES)].copy()
     isos_700_bus  = isos_700_all[isos_700_all['route_type'] == 3].copy()
@@ -55,4 +73,119 @@ def compute_isochrones(stops,G):
         isos_700_rail,
         isos_700_bus,
         isos_100_rail,
-    )
\ No newline at end of file
+    )
+
+##--------------------------------------------------------------------------
+## Cached Walk Network & Isochrones
+##--------------------------------------------------------------------------
+
+def walknetwork_cached(buffer, cache: DiskCache, network_type: str = 'walk', source=None):
+    # Returns (graph_key, graph_hash); the graph itself is only parsed when a caller needs it
+    minx, miny, maxx, maxy = buffer.total_bounds
+    source_stat = os.stat(source) if source is not None else None
+    graph_key = cache_key(
+        bbox=[round(v, 6) for v in (minx, miny, maxx, maxy)],
+        network_type=network_type,
+        source=None if source is None else [os.path.abspath(source), source_stat.st_size, source_stat.st_mtime_ns],
+    )
+    meta = cache.read_json('graphs', graph_key)
+    if meta is not None and cache.get('graphs', graph_key, 'graphml') is not None:
+        return graph_key, meta['graph_hash']
+
+    G = get_walknetwork(buffer, source=source, network_type=network_type)
+    with cache.writing('graphs', graph_key, 'graphml') as tmp:
+        ox.save_graphml(G, tmp)
+        graph_hash = file_hash(tmp)
+    graph_path = cache.path('graphs', graph_key, 'graphml')
+    cache.write_json('graphs', graph_key, {'graph_hash': graph_hash, 'network_type': network_type})
+    cache.evict(keep=(graph_path,))
+    return graph_key, graph_hash
+
+def load_walknetwork_cached(cache: DiskCache, graph_key: str):
+    path = cache.get('graphs', graph_key, 'graphml')
+    if path is None:
+        raise FileNotFoundError(f"Walk network {graph_key} is no longer in the cache at {cache.root}")
+    return ox.load_graphml(path)
+
+def compute_isochrones_cached(stops, buffer, cache: DiskCache, network_type: str = 'walk', source=None, n_workers=1,
+                              catchment='convex'):
+    if catchment not in CATCHMENTS:
+        raise ValueError(f"Unknown catchment {catchment!r} (expected one of {CATCHMENTS})")
+    graph_key, graph_hash = walknetwork_cached(buffer, cache, network_type=network_type, source=source)
+
+    G = None
+    def _graph():
+        nonlocal G
+        if G is None:
+            G = load_walknetwork_cached(cache, graph_key)
+        return G
+
+    # Node coordinates are enough to snap stops, so a warm run never parses the GraphML
+    nodes_path = cache.get('nodes', graph_hash, 'parquet')
+    if nodes_path is not None:
+        nodes = pd.read_parquet(nodes_path)
+    else:
+        wg = graph_to_csr(_graph())
+        nodes = pd.DataFrame({'node': wg.node_ids, 'x': wg.x, 'y': wg.y})
+        with cache.writing('nodes', graph_hash, 'parquet') as tmp:
+            nodes.to_parquet(tmp, index=False)
+
+    stops_valid = stops[~(stops.geometry.isna() | stops.geometry.is_empty)]
+    if nodes.empty:
+        stops_valid = stops_valid.iloc[:0]
+    pos = nearest_positions(
+        nodes['x'].to_numpy(), nodes['y'].to_numpy(), stops.crs,
+        stops_valid.geometry.x, stops_valid.geometry.y,
+    )
+    is_rail = stops_valid['route_type'].isin(RAIL_TYPES).to_numpy()
+    needed = pd.concat([
+        pd.DataFrame({'stop_id': stops_valid['stop_id'].astype(str).to_numpy(),
+                      'node': nodes['node'].to_numpy()[pos], 'radius': 700}),
+        pd.DataFrame({'stop_id': stops_valid['stop_id'].astype(str).to_numpy()[is_rail],
+                      'node': nodes['node'].to_numpy()[pos][is_rail], 'radius': 100}),
+    ], ignore_index=True)
+
+    # Hulls are keyed by (stop_id, snapped node, radius) within one graph hash and catchment shape
+    table_key = graph_hash if catchment == 'convex' else cache_key(
+        graph_hash=graph_hash, catchment=catchment, buffer=EDGE_BUFFER, ratio=CONCAVE_RATIO,
+    )
+    table_path = cache.get('isochrones', table_key, 'parquet')
+    table = (gpd.read_parquet(table_path) if table_path is not None
+             else gpd.GeoDataFrame(columns=['stop_id', 'node', 'radius', 'geometry'],
+                                   geometry='geometry', crs=stops.crs))
+    table = table.astype({'stop_id': str, 'node': nodes['node'].dtype, 'radius': 'int64'})
+
+    keys = ['stop_id', 'node', 'radius']
+    missing = needed.merge(table[keys], on=keys, how='left', indicator=True)
+    missing = (
+        missing[missing['_merge'] == 'left_only']
+        .drop(columns='_merge')
+        .drop_duplicates(subset=keys)
+    )
+
+    if not missing.empty:
+        wg = graph_to_csr(_graph())
+        centers = pd.Index(wg.node_ids).get_indexer(missing['node'])
+        origins, inverse = np.unique(centers, return_inverse=True)
+        reach = bounded_distances(wg, origins, limit=700, n_workers=n_workers)
+        hulls = np.empty(len(missing), dtype=object)
+        for radius in (700, 100):
+            sel = (missing['radius'] == radius).to_numpy()
+            if sel.any():
+                rows, row_inverse = np.unique(inverse[sel], return_inverse=True)
+                hulls[sel] = reach_catchments(
+                    wg, reach, radius, rows=rows, method=catchment, n_workers=n_workers
+                )[row_inverse]
+
+        new_rows = gpd.GeoDataFrame(missing.reset_index(drop=True), geometry=hulls, crs=stops.crs)
+        table = pd.concat([table, new_rows], ignore_index=True)
+        with cache.writing('isochrones', table_key, 'parquet') as tmp:
+            table.to_parquet(tmp, index=False)
+        cache.evict(keep=(cache.path('isochrones', table_key, 'parquet'),))
+        print(f"Computed isochrones for {missing['stop_id'].nunique()} new stops")
+
+    lookup = needed.merge(table, on=keys, how='left')
+    n_valid = len(stops_valid)
+    hulls_700 = lookup['geometry'].to_numpy()[:n_valid]
+    hulls_100 = lookup['geometry'].to_numpy()[n_valid:]
+    return _split_isochrones(stops, stops_valid, hulls_700, hulls_100, is_rail)
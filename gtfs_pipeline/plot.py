@@ -2,33 +2,79 @@ import folium
 import branca.colormap as cm
 import webbrowser
 import os
+import json
+import shutil
+import subprocess
+import tempfile
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from string import Template
+from urllib.parse import quote
+import numpy as np
+import shapely
 import geopandas as gpd
 
-def plot(score_gdf, place, score_column="Transit_attribute", filename="Transit_Attributes_Map.html"):
+PLOT_MODES = ('geojson', 'polyline', 'tiles')
+
+# Distinct colours of the GeoJson layer
+COLOR_STEPS = 64
+# Decimal places kept in EPSG:4326 coordinates (5 ≈ 1 m)
+DEFAULT_PRECISION = 5
+# Source layer name inside the vector tiles
+TILE_LAYER = "streets"
+# Map page written by the pipeline, and the port serve_map listens on
+DEFAULT_VIEWER = "Transit_Accessibility_Map.html"
+DEFAULT_PORT = 8000
+
+
+def plot(score_gdf, place, score_column="Transit_attribute", filename="Transit_Attributes_Map.html",
+         mode="geojson", simplify_tolerance=None, precision=DEFAULT_PRECISION, tile_format="pmtiles"):
+    # mode: 'geojson'  one styled folium.GeoJson layer for all streets
+    #       'polyline' one folium.PolyLine per street (legacy, slow on large cities)
+    #       'tiles'    vector tiles next to filename plus a static MapLibre viewer at filename (see plot_tiles)
+    # simplify_tolerance: metres of Douglas-Peucker simplification (None = keep every vertex)
+    if mode == 'tiles':
+        return plot_tiles(score_gdf, place, score_column=score_column, filename=filename, tile_format=tile_format,
+                          simplify_tolerance=simplify_tolerance, precision=precision)
+    if mode not in PLOT_MODES:
+        raise ValueError(f"Unknown plot mode {mode!r} (expected one of {PLOT_MODES})")
     score_gdf = score_gdf.copy()
 
     # Compute center of the place geometry for map centering
-    geom = place.geometry.unary_union
-    center_point = geom.centroid
-    center = [center_point.y, center_point.x]
+    center = _center(place)
     m = folium.Map(location=center, zoom_start=12, tiles="CartoDB dark_matter")
 
     # Define colormap
     colormap = cm.linear.RdYlBu_05.scale(score_gdf[score_column].min(), score_gdf[score_column].max())
 
     # Add streets to the map
-    for _, row in score_gdf.iterrows():
-        if row['geometry'].geom_type == 'LineString':
-            coords = [(lat, lon) for lon, lat in row['geometry'].coords]
-            folium.PolyLine(
-                locations=coords,
-                color=colormap(row[score_column]),
-                weight=1.5,
-                opacity=0.7,
-                tooltip=folium.Tooltip(
-                    f"Score: {row[score_column]:.2f}<br>Street Name: {row['name']}"
-                    )
-            ).add_to(m)
+    if mode == 'polyline':
+        for _, row in score_gdf.iterrows():
+            if row['geometry'].geom_type == 'LineString':
+                coords = [(lat, lon) for lon, lat in row['geometry'].coords]
+                folium.PolyLine(
+                    locations=coords,
+                    color=colormap(row[score_column]),
+                    weight=1.5,
+                    opacity=0.7,
+                    tooltip=folium.Tooltip(
+                        f"Score: {row[score_column]:.2f}<br>Street Name: {row['name']}"
+                        )
+                ).add_to(m)
+    else:
+        # Each feature only carries its colour step; the styling runs in the browser
+        layer = web_layer(score_gdf, score_column, simplify_tolerance, precision)
+        palette, layer['c'] = _color_steps(layer[score_column].to_numpy(dtype=float), colormap)
+        layer[score_column] = layer[score_column].round(2)
+        folium.GeoJson(
+            layer.to_json(na='null', drop_id=True),
+            name=score_column,
+            style=folium.JsCode(
+                f"function(feature) {{ return {{color: {json.dumps(palette)}[feature.properties.c], "
+                "weight: 1.5, opacity: 0.7}; }"
+            ),
+            tooltip=folium.GeoJsonTooltip(fields=[score_column, 'name'], aliases=['Score:', 'Street Name:']),
+        ).add_to(m)
 
     colormap.caption = score_column
     colormap.add_to(m)
@@ -44,4 +90,204 @@ def plot(score_gdf, place, score_column="Transit_attribute", filename="Transit_A
 
     # Save
     os.makedirs(os.path.dirname(filename), exist_ok=True)
-    m.save(filename)
\ No newline at end of file
+    m.save(filename)
+    return filename
+
+def web_layer(score_gdf, score_column, simplify_tolerance=None, precision=DEFAULT_PRECISION) -> gpd.GeoDataFrame:
+    # Street lines in EPSG:4326 with only the columns the map shows, optionally simplified and rounded
+    layer = score_gdf[['name', score_column, 'geometry']].reset_index(drop=True)
+    layer = layer[~(layer.geometry.isna() | layer.geometry.is_empty)]
+    if simplify_tolerance:
+        projected = layer.to_crs(layer.estimate_utm_crs())
+        layer = layer.set_geometry(projected.simplify(simplify_tolerance).to_crs("EPSG:4326").values)
+    elif layer.crs is not None and layer.crs != "EPSG:4326":
+        layer = layer.to_crs("EPSG:4326")
+    if precision is not None:
+        layer = layer.set_geometry(shapely.transform(layer.geometry.values, lambda xy: np.round(xy, precision)))
+    return layer
+
+def _color_steps(values, colormap):
+    # (palette of COLOR_STEPS evenly spaced colormap colours, palette index of every value)
+    lo, hi = colormap.vmin, colormap.vmax
+    if not hi > lo:
+        return [colormap(lo)], np.zeros(len(values), dtype=int)
+    palette = [colormap(lo + (hi - lo) * i / (COLOR_STEPS - 1)) for i in range(COLOR_STEPS)]
+    steps = np.clip(np.round((values - lo) / (hi - lo) * (COLOR_STEPS - 1)), 0, COLOR_STEPS - 1)
+    return palette, np.nan_to_num(steps, nan=0).astype(int)
+
+def _center(place):
+    geom = place.geometry.unary_union
+    center_point = geom.centroid
+    return [center_point.y, center_point.x]
+
+
+##--------------------------------------------------------------------------
+## Vector Tiles
+##--------------------------------------------------------------------------
+
+def plot_tiles(score_gdf, place, score_column="Transit_score", filename="Transit_Accessibility_Map.html",
+               tile_format="pmtiles", simplify_tolerance=None, precision=DEFAULT_PRECISION) -> str:
+    # Tiles the streets with tippecanoe into <filename stem>.<tile_format> ('pmtiles' or 'mbtiles').
+    # For PMTiles, filename becomes a MapLibre viewer reading the tiles over HTTP range requests (see serve_map).
+    if tile_format not in ('pmtiles', 'mbtiles'):
+        raise ValueError(f"Unknown tile format {tile_format!r} (expected 'pmtiles' or 'mbtiles')")
+    tippecanoe = shutil.which("tippecanoe")
+    if tippecanoe is None:
+        raise RuntimeError("Vector tiles require tippecanoe on the PATH (https://github.com/felt/tippecanoe)")
+
+    tiles_path = os.path.splitext(filename)[0] + "." + tile_format
+    os.makedirs(os.path.dirname(tiles_path) or '.', exist_ok=True)
+    layer = web_layer(score_gdf, score_column, simplify_tolerance, precision)
+    with tempfile.TemporaryDirectory() as tmp:
+        features = os.path.join(tmp, "streets.geojsonl")
+        layer.to_file(features, driver="GeoJSONSeq")
+        # Low zooms drop the densest streets instead of growing, so tile sizes stay bounded
+        subprocess.run([
+            tippecanoe, "-o", tiles_path, "--force", "--quiet", "-l", TILE_LAYER,
+            "-zg", "--drop-densest-as-needed", "--extend-zooms-if-still-dropping", features,
+        ], check=True)
+
+    if tile_format == "mbtiles":
+        print(f"✅ Vector tiles written to {tiles_path}")
+        return tiles_path
+
+    lo, hi = float(layer[score_column].min()), float(layer[score_column].max())
+    with open(filename, "w") as f:
+        f.write(VIEWER_TEMPLATE.substitute(
+            title=score_column,
+            center=json.dumps(_center(place)[::-1]),
+            tiles=json.dumps("pmtiles://" + os.path.basename(tiles_path)),
+            layer=json.dumps(TILE_LAYER),
+            score=json.dumps(score_column),
+            color=json.dumps(_color_expression(score_column, lo, hi)),
+        ))
+    directory, viewer = os.path.split(filename)
+    print(f"✅ Vector tiles written to {tiles_path}; view with serve_map({directory or '.'!r}, viewer={viewer!r}) "
+          f"at {viewer_url(viewer)}")
+    return filename
+
+def _color_expression(score_column, lo, hi):
+    # MapLibre colour ramp matching the folium colormap
+    colors = ['#%02x%02x%02x' % tuple(int(round(255 * c)) for c in rgba[:3]) for rgba in cm.linear.RdYlBu_05.colors]
+    if not hi > lo:
+        return colors[0]
+    expression = ["interpolate", ["linear"], ["get", score_column]]
+    for i, color in enumerate(colors):
+        expression += [lo + (hi - lo) * i / (len(colors) - 1), color]
+    return expression
+
+VIEWER_TEMPLATE = Template("""<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>$title</title>
+<script src="https://unpkg.com/maplibre-gl@4.7.1/dist/maplibre-gl.js"></script>
+<link href="https://unpkg.com/maplibre-gl@4.7.1/dist/maplibre-gl.css" rel="stylesheet">
+<script src="https://unpkg.com/pmtiles@3.2.1/dist/pmtiles.js"></script>
+<style>body { margin: 0; } #map { position: absolute; top: 0; bottom: 0; width: 100%; }</style>
+</head>
+<body>
+<div id="map"></div>
+<script>
+const protocol = new pmtiles.Protocol();
+maplibregl.addProtocol("pmtiles", protocol.tile);
+const map = new maplibregl.Map({
+  container: "map",
+  center: $center,
+  zoom: 12,
+  style: {
+    version: 8,
+    sources: {
+      basemap: {
+        type: "raster",
+        tiles: ["https://basemaps.cartocdn.com/dark_all/{z}/{x}/{y}.png"],
+        tileSize: 256,
+        attribution: "&copy; OpenStreetMap contributors &copy; CARTO"
+      },
+      streets: { type: "vector", url: $tiles }
+    },
+    layers: [
+      { id: "basemap", type: "raster", source: "basemap" },
+      {
+        id: "streets", type: "line", source: "streets", "source-layer": $layer,
+        paint: { "line-color": $color, "line-width": 1.5, "line-opacity": 0.7 }
+      }
+    ]
+  }
+});
+map.on("click", "streets", (e) => {
+  const props = e.features[0].properties;
+  new maplibregl.Popup()
+    .setLngLat(e.lngLat)
+    .setHTML("Score: " + Number(props[$score]).toFixed(2) + "<br>Street Name: " + props.name)
+    .addTo(map);
+});
+map.on("mouseenter", "streets", () => { map.getCanvas().style.cursor = "pointer"; });
+map.on("mouseleave", "streets", () => { map.getCanvas().style.cursor = ""; });
+</script>
+</body>
+</html>
+""")
+
+
+##--------------------------------------------------------------------------
+## Local Viewer
+##--------------------------------------------------------------------------
+
+class RangeRequestHandler(SimpleHTTPRequestHandler):
+    # Static files with single-range "Range: bytes=a-b" support, which PMTiles reads rely on
+    def send_head(self):
+        range_header = self.headers.get("Range")
+        path = self.translate_path(self.path)
+        if not range_header or not range_header.startswith("bytes=") or not os.path.isfile(path):
+            return super().send_head()
+
+        size = os.path.getsize(path)
+        start, _, end = range_header[len("bytes="):].split(",")[0].partition("-")
+        if start:
+            start, end = int(start), min(int(end) if end else size - 1, size - 1)
+        else:
+            start, end = max(size - int(end), 0), size - 1
+        if start > end or start >= size:
+            self.send_error(416, "Requested Range Not Satisfiable")
+            return None
+
+        f = open(path, "rb")
+        f.seek(start)
+        self.send_response(206)
+        self.send_header("Content-Type", self.guess_type(path))
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+        self.send_header("Content-Length", str(end - start + 1))
+        self.end_headers()
+        self._remaining = end - start + 1
+        return f
+
+    def copyfile(self, source, outputfile):
+        remaining = getattr(self, "_remaining", None)
+        if remaining is None:
+            return super().copyfile(source, outputfile)
+        while remaining > 0:
+            chunk = source.read(min(remaining, 2**16))
+            if not chunk:
+                break
+            outputfile.write(chunk)
+            remaining -= len(chunk)
+        self._remaining = None
+
+def viewer_url(viewer=DEFAULT_VIEWER, port=DEFAULT_PORT) -> str:
+    return f"http://localhost:{port}/{quote(viewer)}"
+
+def serve_map(directory="data/output", port=DEFAULT_PORT, open_browser=True, viewer=DEFAULT_VIEWER):
+    # Serves the output folder (viewer + PMTiles) on localhost until interrupted and opens the viewer page
+    server = ThreadingHTTPServer(("127.0.0.1", port), partial(RangeRequestHandler, directory=directory))
+    url = viewer_url(viewer, port)
+    print(f"Serving {directory} at {url} (Ctrl+C to stop)")
+    if open_browser:
+        webbrowser.open(url)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
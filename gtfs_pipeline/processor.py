@@ -1,87 +1,168 @@
 import os
+import time
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pv
+import pyarrow.compute as pc
 import geopandas as gpd
 from shapely.geometry import Point
 from zipfile import ZipFile, is_zipfile, BadZipFile
-from pandas.errors import EmptyDataError
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
-def load_gtfs_from_zip(zip_path: str, filename: str) -> pd.DataFrame | None:
+from gtfs_pipeline.cache import DiskCache, DEFAULT_MAX_BYTES, cache_key, file_hash
+
+# Columns read from each GTFS file; everything else in the feed is skipped.
+# IDs are dictionary-encoded (pandas categoricals) and times become integer seconds.
+GTFS_ID = pa.dictionary(pa.int32(), pa.string())
+GTFS_DAYS = ["monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday"]
+GTFS_COLUMNS = {
+    "stops.txt":      {"stop_id": GTFS_ID, "stop_name": pa.string(), "stop_lat": pa.float64(), "stop_lon": pa.float64()},
+    "routes.txt":     {"route_id": GTFS_ID, "route_type": pa.int16()},
+    "trips.txt":      {"trip_id": GTFS_ID, "route_id": GTFS_ID, "service_id": GTFS_ID},
+    "stop_times.txt": {"trip_id": GTFS_ID, "arrival_time": pa.string(), "departure_time": pa.string(), "stop_id": GTFS_ID},
+    "calendar.txt":   {"service_id": GTFS_ID, **{day: pa.int8() for day in GTFS_DAYS},
+                       "start_date": pa.string(), "end_date": pa.string()},
+}
+GTFS_REQUIRED = {
+    "stops.txt":      ["stop_id"],
+    "routes.txt":     ["route_id", "route_type"],
+    "trips.txt":      ["trip_id", "route_id", "service_id"],
+    "stop_times.txt": ["trip_id", "arrival_time", "departure_time", "stop_id"],
+    "calendar.txt":   ["service_id"],
+}
+GTFS_TIME_COLUMNS = ("arrival_time", "departure_time")
+NULLABLE_TYPES = {pa.int8(): pd.Int8Dtype(), pa.int16(): pd.Int16Dtype(), pa.int32(): pd.Int32Dtype()}
+
+def gtfs_time_to_seconds(arr: pa.Array) -> pa.Array:
+    # "HH:MM:SS" (hours may exceed 24 or have one digit) -> int32 seconds; anything else -> null
+    parts = pc.split_pattern(pc.utf8_trim_whitespace(arr), ":")
+    has_three = np.asarray(pc.fill_null(pc.equal(pc.list_value_length(parts), 3), False))
+    flat = pc.list_flatten(pc.filter(parts, pa.array(has_three)))
+    digits = np.asarray(pc.fill_null(pc.utf8_is_digit(flat), False))
+    hms = pc.if_else(pa.array(digits), flat, "0").cast(pa.int32()).to_numpy().reshape(-1, 3)
+
+    seconds = np.zeros(len(arr), dtype=np.int32)
+    seconds[has_three] = hms[:, 0] * 3600 + hms[:, 1] * 60 + hms[:, 2]
+    valid = has_three.copy()
+    valid[has_three] = digits.reshape(-1, 3).all(axis=1)
+    return pa.array(seconds, mask=~valid)
+
+def _read_header(z: ZipFile, filename: str) -> list[str]:
+    with z.open(filename) as f:
+        line = f.readline().decode("utf-8-sig")
+    return [col.strip().strip('"') for col in line.strip().split(",")]
+
+def read_gtfs_table(z: ZipFile, filename: str) -> pd.DataFrame | None:
+    if filename not in z.namelist():
+        return None
+    header = _read_header(z, filename)
+    wanted = {col: typ for col, typ in GTFS_COLUMNS[filename].items() if col in header}
+    if not wanted:
+        return None
+
+    # Stream record batches so raw time strings are converted block by block
+    with z.open(filename) as f:
+        reader = pv.open_csv(
+            f,
+            read_options=pv.ReadOptions(block_size=1 << 24),
+            convert_options=pv.ConvertOptions(
+                include_columns=list(wanted),
+                column_types=wanted,
+                strings_can_be_null=True,
+            ),
+        )
+        batches = []
+        for batch in reader:
+            columns = {
+                name: (gtfs_time_to_seconds(col) if name in GTFS_TIME_COLUMNS else col)
+                for name, col in zip(batch.schema.names, batch.columns)
+            }
+            batches.append(pa.RecordBatch.from_pydict(columns))
+
+    if not batches:
+        return pd.DataFrame({col: pd.Series(dtype=object) for col in wanted})
+    table = pa.Table.from_batches(batches).unify_dictionaries()
+    return table.to_pandas(types_mapper=NULLABLE_TYPES.get)
+
+def _tag_ids(df: pd.DataFrame, tag: str, columns):
+    # Prefix the dictionary, not the rows: O(unique ids) instead of O(rows).
+    # Sorted categories keep groupby output in the same order as plain string ids.
+    for col in columns:
+        cats = df[col].cat.categories
+        df[col] = df[col].cat.rename_categories(tag + "_" + cats.astype(str))
+        df[col] = df[col].cat.reorder_categories(df[col].cat.categories.sort_values())
+
+def _lookup(keys: pd.Series, table_keys: pd.Series) -> np.ndarray:
+    # Row position in table_keys for every key (-1 if absent), resolved once per category
+    index = pd.Index(np.asarray(table_keys, dtype=object))
+    cat_pos = index.get_indexer(keys.cat.categories)
+    codes = keys.cat.codes.to_numpy()
+    return np.where(codes >= 0, cat_pos[codes], -1)
+
+def _source_column(tag: str, n: int) -> pd.Categorical:
+    return pd.Categorical.from_codes(np.zeros(n, dtype=np.int8), categories=[tag])
+
+def process_single_gtfs_zip(zip_path: str, tag: str):
     if not is_zipfile(zip_path):
+        print(f"⚠️[SKIP] Not a zip file: {zip_path}")
         return None
+
     try:
         with ZipFile(zip_path) as z:
+            # CRC-check the archive once
             if z.testzip():
+                print(f"⚠️[SKIP] Corrupted archive: {zip_path}")
                 return None
-            if filename not in z.namelist():
-                return None
-            with z.open(filename) as f:
-                try:
-                    return pd.read_csv(f, low_memory=False)
-                except EmptyDataError:
-                    return None
+            tables = {name: read_gtfs_table(z, name) for name in GTFS_COLUMNS}
     except BadZipFile:
+        print(f"⚠️[SKIP] Corrupted archive: {zip_path}")
         return None
 
-def process_single_gtfs_zip(zip_path: str, tag: str):
-    stops      = load_gtfs_from_zip(zip_path, "stops.txt")
-    routes     = load_gtfs_from_zip(zip_path, "routes.txt")
-    trips      = load_gtfs_from_zip(zip_path, "trips.txt")
-    stop_times = load_gtfs_from_zip(zip_path, "stop_times.txt")
-    calendar   = load_gtfs_from_zip(zip_path, "calendar.txt")
-
-    if any(df is None for df in (stops, routes, trips, stop_times, calendar)):
+    if any(df is None for df in tables.values()):
         print(f"⚠️[SKIP] Required File does not exist in GTFS: {zip_path}")
         return None
 
-    required_columns_map = [
-        (trips, ["trip_id", "route_id", "service_id"]),
-        (routes, ["route_id"]),
-        (stop_times, ["trip_id", "stop_id"]),
-        (stops, ["stop_id"])
-    ]
-
-    for df, cols in required_columns_map:
-        missing = [col for col in cols if col not in df.columns]
+    for filename, cols in GTFS_REQUIRED.items():
+        missing = [col for col in cols if col not in tables[filename].columns]
         if missing:
-            print(f"⚠️ [SKIP] Missing columns {missing} in GTFS: {zip_path}")
+            print(f"⚠️ [SKIP] Missing columns {missing} in {filename}: {zip_path}")
             return None
-        for col in cols:
-            df[col] = df[col].astype(str)
 
-    # Processing Calendar (Skip if service_id does not exist)
-    if calendar is not None:
-        if "service_id" not in calendar.columns:
-            print(f"⚠️ [SKIP] 'service_id' column missing in calendar.txt: {zip_path}")
-            return None
-        calendar["service_id"] = calendar["service_id"].astype(str)
-        calendar["service_id"] = tag + "_" + calendar["service_id"]
-
-    # Tagging IDs
-    for df, mapping in [
-        (trips,    {"trip_id":tag+"_","route_id":tag+"_","service_id":tag+"_"}),
-        (routes,   {"route_id":tag+"_"}),
-        (stop_times,{"trip_id":tag+"_", "stop_id":tag+"_"}),
-        (stops, {"stop_id": tag+"_"})
-    ]:
-        for col, prefix in mapping.items():
-            df[col] = prefix + df[col]
-        
-    # Merging DataFrames
-    merged = (
-        stop_times[["trip_id", "arrival_time", "departure_time", "stop_id"]]
-        .merge(trips[["trip_id","route_id","service_id"]], on="trip_id", how="left")
-        .merge(routes[["route_id","route_type"]], on="route_id", how="left")
-    )
+    stops      = tables["stops.txt"]
+    routes     = tables["routes.txt"].drop_duplicates(subset="route_id")
+    trips      = tables["trips.txt"].drop_duplicates(subset="trip_id")
+    stop_times = tables["stop_times.txt"]
+    calendar   = tables["calendar.txt"].drop_duplicates(subset="service_id")
+
+    # Tagging IDs (feed-unique ids stay unique after merging feeds)
+    _tag_ids(stops, tag, ["stop_id"])
+    _tag_ids(routes, tag, ["route_id"])
+    _tag_ids(trips, tag, ["trip_id", "route_id", "service_id"])
+    _tag_ids(stop_times, tag, ["trip_id", "stop_id"])
+    _tag_ids(calendar, tag, ["service_id"])
+
+    # Merging DataFrames: stop_times -> trips -> routes -> calendar as positional takes
+    merged = stop_times[["trip_id", "arrival_time", "departure_time", "stop_id"]].copy()
+    trip_pos = _lookup(merged["trip_id"], trips["trip_id"])
+    for col in ["route_id", "service_id"]:
+        merged[col] = trips[col].array.take(trip_pos, allow_fill=True)
+    route_pos = _lookup(merged["route_id"], routes["route_id"])
+    merged["route_type"] = routes["route_type"].array.take(route_pos, allow_fill=True)
+
+    # Rows without a route_type never reach the bus/rail analysis
+    merged = merged[merged["route_type"].notna().to_numpy()].reset_index(drop=True)
+    merged["route_type"] = merged["route_type"].astype("int16")
 
-    if calendar is not None:
-        merged = merged.merge(calendar, on="service_id", how="left")
+    service_pos = _lookup(merged["service_id"], calendar["service_id"])
+    for col in calendar.columns.drop("service_id"):
+        merged[col] = calendar[col].array.take(service_pos, allow_fill=True)
 
-    merged["source"] = tag
-    stops["source"] = tag
-    trips["source"] = tag
-    routes["source"] = tag
-    if calendar is not None:
-        calendar["source"] = tag
+    merged["source"] = _source_column(tag, len(merged))
+    stops["source"] = _source_column(tag, len(stops))
+    trips["source"] = _source_column(tag, len(trips))
+    routes["source"] = _source_column(tag, len(routes))
+    calendar["source"] = _source_column(tag, len(calendar))
 
     return merged, stops, trips, routes, calendar
 
@@ -99,15 +180,18 @@ def stops_bymodes(sched_merged, stops_merged):
         12: 'Monorail'
     }
 
-    sched_merged['station_type'] = sched_merged['route_type'].map(TYPE_MAPPING).fillna('Others')
+    # Label modes on the distinct (stop, route) pairs rather than on every schedule row
+    stop_routes = sched_merged[['stop_id', 'route_type', 'route_id']].drop_duplicates()
+    stop_routes['station_type'] = stop_routes['route_type'].map(TYPE_MAPPING).fillna('Others')
 
     station_modes = (
-        sched_merged[['stop_id', 'station_type', 'route_type', 'route_id']]
-        .drop_duplicates()
-        .groupby(['stop_id', 'station_type', 'route_type'])
+        stop_routes[['stop_id', 'station_type', 'route_type', 'route_id']]
+        .groupby(['stop_id', 'station_type', 'route_type'], observed=True)
         .agg(routes=('route_id', lambda seq: list(set(seq))))
         .reset_index()
     )
+    station_modes['stop_id'] = station_modes['stop_id'].astype(str)
+    station_modes['route_type'] = station_modes['route_type'].astype('int64')
 
     # Create a unique identifier for each stop-mode combination
     station_modes['stop_id_mode'] = station_modes['stop_id'].astype(str) + "_" + station_modes['station_type']
@@ -119,6 +203,7 @@ def stops_bymodes(sched_merged, stops_merged):
     )
 
     # Merge to get full stop information
+    stops_sel = stops_sel.astype({'stop_id': str})
     station_modes_full = station_modes.merge(stops_sel, on='stop_id', how='left')
 
     # Create GeoDataFrame
@@ -130,31 +215,160 @@ def stops_bymodes(sched_merged, stops_merged):
 
     return station_modes_gdf
 
-def concat_dataframes(dl_dir: str):
-    merged_list = []
-    stops_list = []
+def concat_presized(frames: list[pd.DataFrame]) -> pd.DataFrame:
+    # Fill one pre-sized array per column and release each source column once copied,
+    # so peak memory stays near one copy of the data instead of inputs + pd.concat output
+    columns = list(dict.fromkeys(col for df in frames for col in df.columns))
+    sizes = [len(df) for df in frames]
+    offsets = np.concatenate([[0], np.cumsum(sizes)])
+    total = int(offsets[-1])
 
-    for fname in os.listdir(dl_dir):
-        if not fname.endswith(".zip"):
-            continue
+    out = {}
+    for col in columns:
+        parts = [df[col] if col in df.columns else None for df in frames]
+        present = [p for p in parts if p is not None]
 
-        tag = fname.replace(".zip", "")
-        result = process_single_gtfs_zip(os.path.join(dl_dir, fname), tag)
+        if all(isinstance(p.dtype, pd.CategoricalDtype) for p in present):
+            # Union of categories stays sorted, matching the per-feed ordering
+            categories = pd.Index(np.concatenate([p.cat.categories.to_numpy(dtype=object) for p in present])).unique().sort_values()
+            codes = np.full(total, -1, dtype=np.int32)
+            for i, p in enumerate(parts):
+                if p is not None:
+                    remap = np.append(categories.get_indexer(p.cat.categories), -1)
+                    codes[offsets[i]:offsets[i + 1]] = remap[p.cat.codes.to_numpy()]
+            out[col] = pd.Categorical.from_codes(codes, categories=categories)
 
-        if result is None:
-            continue
+        elif all(isinstance(p.array, pd.arrays.IntegerArray) for p in present):
+            values = np.zeros(total, dtype=np.result_type(*[p.dtype.numpy_dtype for p in present]))
+            mask = np.ones(total, dtype=bool)
+            for i, p in enumerate(parts):
+                if p is not None:
+                    values[offsets[i]:offsets[i + 1]] = p.to_numpy(dtype=values.dtype, na_value=0)
+                    mask[offsets[i]:offsets[i + 1]] = p.isna().to_numpy()
+            out[col] = pd.arrays.IntegerArray(values, mask)
+
+        elif all(p.dtype.kind in "biuf" for p in present) and len(present) == len(parts):
+            values = np.empty(total, dtype=np.result_type(*[p.dtype for p in present]))
+            for i, p in enumerate(parts):
+                values[offsets[i]:offsets[i + 1]] = p.to_numpy()
+            out[col] = values
+
+        else:
+            values = np.empty(total, dtype=object)
+            for i, p in enumerate(parts):
+                values[offsets[i]:offsets[i + 1]] = p.to_numpy(dtype=object) if p is not None else None
+            out[col] = pd.Series(values).infer_objects().to_numpy() if present else values
+
+        for df in frames:
+            if col in df.columns:
+                del df[col]
+
+    return pd.DataFrame(out, index=pd.RangeIndex(total))
+
+##--------------------------------------------------------------------------
+## Parquet Feed Cache
+##--------------------------------------------------------------------------
+
+# Bump whenever the layout of the cached schedule/stops frames changes
+GTFS_CACHE_VERSION = 1
+
+def load_feed_cached(zip_path: str, tag: str, cache: DiskCache):
+    # Keyed by archive content + tag, so a re-downloaded but unchanged feed is still a hit
+    key = cache_key(zip=file_hash(zip_path), tag=tag, version=GTFS_CACHE_VERSION)
+    sched_path = cache.get('gtfs', f"{key}-sched", 'parquet')
+    stops_path = cache.get('gtfs', f"{key}-stops", 'parquet')
+    if sched_path is not None and stops_path is not None:
+        return (
+            pd.read_parquet(sched_path, memory_map=True),
+            pd.read_parquet(stops_path, memory_map=True),
+        )
+
+    result = process_single_gtfs_zip(zip_path, tag)
+    if result is None:
+        return None, None
+    merged, stops, *_ = result
 
-        merged, stops, *_ = result
+    for name, df in (("sched", merged), ("stops", stops)):
+        with cache.writing('gtfs', f"{key}-{name}", 'parquet') as tmp:
+            df.to_parquet(tmp, index=False)
+
+    # Drop the entries of this archive's previous feed version
+    pointer = cache_key(path=os.path.abspath(zip_path), tag=tag)
+    previous = cache.read_json('gtfs', pointer)
+    if previous is not None and previous.get('key') != key:
+        for name in ("sched", "stops"):
+            cache.remove('gtfs', f"{previous['key']}-{name}", 'parquet')
+    cache.write_json('gtfs', pointer, {'tag': tag, 'key': key})
+    return merged, stops
+
+def _load_feed(zip_path: str, tag: str, cache_dir: str | None = None):
+    start = time.perf_counter()
+    if cache_dir is not None:
+        merged, stops = load_feed_cached(zip_path, tag, DiskCache(cache_dir))
+    else:
+        result = process_single_gtfs_zip(zip_path, tag)
+        merged, stops = (None, None) if result is None else result[:2]
+    return merged, stops, time.perf_counter() - start
+
+def concat_dataframes(
+    dl_dir: str,
+    n_workers: int = 1,
+    cache_dir: str | None = None,
+    cache_max_bytes: int = DEFAULT_MAX_BYTES,
+):
+    fnames = [fname for fname in os.listdir(dl_dir) if fname.endswith(".zip")]
+    tags = [fname.replace(".zip", "") for fname in fnames]
+    paths = [os.path.join(dl_dir, fname) for fname in fnames]
+    tag = tags[-1] if tags else None
+
+    # Feeds are parsed independently; a slow or broken feed does not hold up the others
+    results = {}
+    def _collect(feed_tag, load):
+        try:
+            merged, stops, elapsed = load()
+        except Exception as e:
+            print(f"❌ [{len(results) + 1}/{len(tags)}] {feed_tag} failed: {e}")
+            results[feed_tag] = None
+            return
+        results[feed_tag] = (merged, stops)
+        if merged is not None:
+            print(f"✅ [{len(results)}/{len(tags)}] {feed_tag}: {len(merged):,} schedule rows in {elapsed:.1f}s")
+
+    if n_workers > 1 and len(paths) > 1:
+        with ProcessPoolExecutor(max_workers=min(n_workers, len(paths))) as pool:
+            futures = {
+                pool.submit(_load_feed, path, feed_tag, cache_dir): feed_tag
+                for path, feed_tag in zip(paths, tags)
+            }
+            for future in as_completed(futures):
+                _collect(futures[future], future.result)
+    else:
+        for path, feed_tag in zip(paths, tags):
+            _collect(feed_tag, lambda: _load_feed(path, feed_tag, cache_dir))
+
+    # Evict once all feeds are in, so no worker loses a file it is about to read
+    if cache_dir is not None:
+        DiskCache(cache_dir, max_bytes=cache_max_bytes).evict()
+
+    merged_list = []
+    stops_list = []
+    for feed_tag in tags:
+        if results.get(feed_tag) is None or results[feed_tag][0] is None:
+            continue
+        merged, stops = results.pop(feed_tag)
 
         if merged is None or merged.empty or merged.isna().all().all():
-            print(f"⚠️ Skipped {tag}: empty or NA-only DataFrame")
+            print(f"⚠️ Skipped {feed_tag}: empty or NA-only DataFrame")
             continue
 
         merged_list.append(merged)
         stops_list.append(stops)
 
-    sched_merged = pd.concat(merged_list, ignore_index=True)
-    stops_merged = pd.concat(stops_list, ignore_index=True)
+    if not merged_list:
+        raise ValueError(f"No usable GTFS feeds found in {dl_dir}")
+
+    sched_merged = concat_presized(merged_list)
+    stops_merged = concat_presized(stops_list)
     stops_bymode = stops_bymodes(sched_merged, stops_merged)
     
-    return sched_merged, stops_bymode, tag
\ No newline at end of file
+    return sched_merged, stops_bymode, tag
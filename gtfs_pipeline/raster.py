@@ -0,0 +1,156 @@
+import numpy as np
+import geopandas as gpd
+import shapely
+from typing import NamedTuple, Optional
+
+from gtfs_pipeline.scoring import score_links_combined, window_names
+
+# Default cell size (in metres of the projected CRS) of the significance grid
+DEFAULT_RESOLUTION = 20
+
+
+class SignificanceGrid(NamedTuple):
+    sum: np.ndarray     # (rows x cols) summed significance of the isochrones covering each cell
+    count: np.ndarray   # (rows x cols) number of isochrones covering each cell
+    x0: float           # grid origin (lower-left corner), a multiple of the resolution
+    y0: float
+    resolution: float
+    crs: object
+    window_sums: Optional[dict] = None  # {window: (rows x cols)} summed significance_<window>, if requested
+
+
+##--------------------------------------------------------------------------
+## Rasterization
+##--------------------------------------------------------------------------
+
+def rasterize_significance(iso: gpd.GeoDataFrame, resolution: float = DEFAULT_RESOLUTION, crs=None, windows=()) -> SignificanceGrid:
+    # A cell belongs to an isochrone when its centre lies inside the polygon (even-odd rule).
+    # crs must be projected; defaults to the UTM zone of the isochrones.
+    # windows: time windows whose significance_<window> is summed over the same cells
+    if crs is None:
+        crs = iso.crs if iso.crs is not None and iso.crs.is_projected else iso.estimate_utm_crs()
+    iso = iso.to_crs(crs)
+
+    # Stops without a significance are not counted by the point-in-polygon scoring either
+    iso = iso[iso['significance'].notna() & ~(iso.geometry.isna() | iso.geometry.is_empty)]
+    if iso.empty:
+        return SignificanceGrid(
+            np.zeros((0, 0)), np.zeros((0, 0), dtype=np.int32), 0.0, 0.0, resolution, crs,
+            {w: np.zeros((0, 0)) for w in windows} if windows else None,
+        )
+
+    # Snap the origin to the resolution so grids of different runs line up
+    minx, miny, maxx, maxy = iso.total_bounds
+    x0 = np.floor(minx / resolution) * resolution
+    y0 = np.floor(miny / resolution) * resolution
+    n_cols = max(1, int(np.ceil((maxx - x0) / resolution)))
+    n_rows = max(1, int(np.ceil((maxy - y0) / resolution)))
+
+    rows, c_start, c_end, poly = _scanline_spans(iso.geometry.to_numpy(), x0, y0, resolution, n_cols)
+
+    # Difference arrays along each row: +value at the first covered cell, -value after the last
+    width = n_cols + 1
+    start, end = rows * width + c_start, rows * width + c_end
+    size = n_rows * width
+    count_diff = np.bincount(start, minlength=size) - np.bincount(end, minlength=size)
+    count = np.cumsum(count_diff.reshape(n_rows, width), axis=1)[:, :-1].astype(np.int32)
+
+    def _accumulate(column):
+        sig = np.nan_to_num(iso[column].to_numpy(dtype=float))[poly]
+        sum_diff = (
+            np.bincount(start, weights=sig, minlength=size)
+            - np.bincount(end, weights=sig, minlength=size)
+        )
+        total = np.cumsum(sum_diff.reshape(n_rows, width), axis=1)[:, :-1]
+        total[count == 0] = 0.0
+        return total
+
+    # The spans are shared by every time window; only the weights change
+    window_sums = {w: _accumulate(f'significance_{w}') for w in windows} if windows else None
+    return SignificanceGrid(_accumulate('significance'), count, x0, y0, resolution, crs, window_sums)
+
+def _scanline_spans(polygons, x0, y0, resolution, n_cols):
+    # Returns (row, first col, end col, polygon index) of every run of covered cells
+    parts, poly = shapely.get_parts(polygons, return_index=True)
+    rings, ring_part = shapely.get_rings(parts, return_index=True)
+    coords, ring = shapely.get_coordinates(rings, return_index=True)
+
+    # Ring edges; rings are closed, so consecutive vertices of the same ring form every edge
+    same = ring[1:] == ring[:-1]
+    ax, ay = coords[:-1][same, 0], coords[:-1][same, 1]
+    bx, by = coords[1:][same, 0], coords[1:][same, 1]
+    edge_poly = poly[ring_part[ring[:-1][same]]]
+
+    # Rows whose centre line crosses the edge, half-open in y so shared vertices count once
+    lo, hi = np.minimum(ay, by), np.maximum(ay, by)
+    r_start = np.ceil((lo - y0) / resolution - 0.5).astype(np.int64)
+    r_end = np.ceil((hi - y0) / resolution - 0.5).astype(np.int64)
+    n = np.maximum(r_end - r_start, 0)
+
+    edge = np.repeat(np.arange(len(n)), n)
+    rows = r_start[edge] + np.arange(len(edge)) - np.repeat(np.cumsum(n) - n, n)
+    yc = y0 + (rows + 0.5) * resolution
+    xc = ax[edge] + (yc - ay[edge]) * (bx[edge] - ax[edge]) / (by[edge] - ay[edge])
+    crossing_poly = edge_poly[edge]
+
+    # Every (polygon, row) has an even number of crossings; consecutive pairs bound the inside
+    order = np.lexsort((xc, rows, crossing_poly))
+    xc, rows, crossing_poly = xc[order], rows[order], crossing_poly[order]
+    x_in, x_out = xc[0::2], xc[1::2]
+    rows, crossing_poly = rows[0::2], crossing_poly[0::2]
+
+    c_start = np.clip(np.ceil((x_in - x0) / resolution - 0.5).astype(np.int64), 0, n_cols)
+    c_end = np.clip(np.ceil((x_out - x0) / resolution - 0.5).astype(np.int64), 0, n_cols)
+    keep = c_end > c_start
+    return rows[keep], c_start[keep], c_end[keep], crossing_poly[keep]
+
+
+##--------------------------------------------------------------------------
+## Sampling
+##--------------------------------------------------------------------------
+
+def sample_grid(grid: SignificanceGrid, x, y):
+    # (sum, count) of the cell under each point; points outside the grid get (0, 0)
+    row, col, inside = _cells(grid, x, y)
+    sig_sum = np.zeros(len(row))
+    count = np.zeros(len(row), dtype=np.int64)
+    sig_sum[inside] = grid.sum[row[inside], col[inside]]
+    count[inside] = grid.count[row[inside], col[inside]]
+    return sig_sum, count
+
+def sample_window_sums(grid: SignificanceGrid, x, y) -> dict:
+    # {window: summed significance_<window> of the cell under each point}
+    row, col, inside = _cells(grid, x, y)
+    sums = {}
+    for w, window_grid in (grid.window_sums or {}).items():
+        sums[w] = np.zeros(len(row))
+        sums[w][inside] = window_grid[row[inside], col[inside]]
+    return sums
+
+def _cells(grid, x, y):
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    n_rows, n_cols = grid.count.shape
+    col = np.floor((x - grid.x0) / grid.resolution).astype(np.int64)
+    row = np.floor((y - grid.y0) / grid.resolution).astype(np.int64)
+    inside = (col >= 0) & (col < n_cols) & (row >= 0) & (row < n_rows)
+    return row, col, inside
+
+def raster_scoring_combined(points, isos, streets, resolution=DEFAULT_RESOLUTION, warn=True):
+    # One grid per mode, sampled at the same points; scores reduced like scoring.scoring_combined
+    crs = points.crs if points.crs is not None and points.crs.is_projected else points.estimate_utm_crs()
+    points = points.to_crs(crs)
+    x, y = points.geometry.x, points.geometry.y
+
+    windows = window_names(isos)
+    grids = [rasterize_significance(iso, resolution=resolution, crs=crs, windows=windows) for iso in isos]
+    samples = [sample_grid(grid, x, y) for grid in grids]
+    window_samples = [sample_window_sums(grid, x, y) for grid in grids]
+    return score_links_combined(
+        points['link_id'].to_numpy(),
+        np.vstack([sig_sum for sig_sum, _ in samples]),
+        np.vstack([count for _, count in samples]),
+        streets,
+        warn=warn,
+        window_sums={w: np.vstack([sums[w] for sums in window_samples]) for w in windows},
+    )
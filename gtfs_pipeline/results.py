@@ -1,57 +1,276 @@
 import os
+import numpy as np
 import pandas as pd
 import geopandas as gpd
 from typing import Optional, Tuple
-from gtfs_pipeline.plot import plot
-from gtfs_pipeline.interpolation import interpolate_roads
-from gtfs_pipeline.scoring import scoring
+from gtfs_pipeline.plot import plot, DEFAULT_PRECISION, DEFAULT_VIEWER
+from gtfs_pipeline.interpolation import interpolate_roads, DEFAULT_INTERVAL
+from gtfs_pipeline.scoring import scoring_combined, make_decay, with_stop_locations, isochrone_context
+from gtfs_pipeline.raster import raster_scoring_combined, DEFAULT_RESOLUTION
+from gtfs_pipeline.netscore import node_significance, network_scoring_combined
+from gtfs_pipeline.tiling import street_tiles, iter_tiles, isochrones_near, DEFAULT_TILE_SIZE
+from gtfs_pipeline.writers import write_scores, DEFAULT_FORMATS
+from gtfs_pipeline.context import StudyContext
 
 
 def combine_scores(
     bus_result_iso: Optional[gpd.GeoDataFrame],
     rail_result_iso: Optional[gpd.GeoDataFrame],
     streets: gpd.GeoDataFrame,
+    sample_interval: float = DEFAULT_INTERVAL,
+    engine: str = 'vector',
+    raster_resolution: float = DEFAULT_RESOLUTION,
+    tile_size: Optional[float] = None,
+    walk_graph=None,
+    stops: Optional[gpd.GeoDataFrame] = None,
+    n_workers: int = 1,
+    decay: Optional[str] = None,
+    decay_scale: Optional[float] = None,
+    context: Optional[StudyContext] = None,
 ) -> Tuple[gpd.GeoDataFrame, gpd.GeoDataFrame]:
-    
-    # Interpolate points along streets using the provided geometry
-    points = interpolate_roads(streets, target_crs=streets.crs)
-    streets_gdf = streets.to_crs(bus_result_iso.crs)
-
-    bus_score  = scoring(points, bus_result_iso, streets_gdf) \
-        if (bus_result_iso is not None and not bus_result_iso.empty) else None
-    rail_score = scoring(points, rail_result_iso, streets_gdf) \
-        if (rail_result_iso is not None and not rail_result_iso.empty) else None
-
-    # Aggregate bus and rail scores
-    bus_rail_attributes = bus_score.copy()
-    bus_rail_attributes['Transit_attribute'] = (
-        (bus_score['Score'] if bus_score is not None else 0)
-        + (rail_score['Score'] if rail_score is not None else 0)
-    )
+    # engine: 'vector' joins every sample point with the isochrones (exact),
+    #         'raster' samples a significance grid of raster_resolution metres (approximate, bounded memory)
+    #         'network' walks walk_graph from the stops (locations in stops) and scores each sample point
+    #                   by the stops within 700 m walk of its nearest node; the isochrone polygons are not used
+    # tile_size: score the streets tile by tile (metres), so peak memory follows the tile instead of the city
+    # decay: None, 'linear' or 'gaussian'; each stop's significance is weighted by its distance to the sample point
+    #        (straight line for 'vector', walk distance for 'network'; scale in metres, see scoring.DEFAULT_DECAY_SCALE)
+    # context: the run's StudyContext; the streets are projected through it and the isochrone index is added to it
+    decay = make_decay(decay, decay_scale)
+    if decay is not None:
+        if engine == 'raster':
+            raise ValueError("Distance decay needs the 'vector' or 'network' engine")
+        if stops is None:
+            raise ValueError("Distance decay needs the stop locations")
+        if engine == 'vector':
+            bus_result_iso = with_stop_locations(bus_result_iso, stops)
+            rail_result_iso = with_stop_locations(rail_result_iso, stops)
+
+    node_sig = None
+    if engine == 'network':
+        if walk_graph is None or stops is None:
+            raise ValueError("The network engine needs the walk graph and the stop locations")
+        isos = [iso for iso in (bus_result_iso, rail_result_iso) if iso is not None and not iso.empty]
+        if not isos:
+            raise ValueError("No bus or rail isochrones to score")
+        # The stop -> node walk is shared by every tile
+        node_sig = node_significance(isos, stops, walk_graph, n_workers=n_workers, decay=decay)
+
+    if tile_size is None:
+        isos = [iso for iso in (bus_result_iso, rail_result_iso) if iso is not None and not iso.empty]
+        streets_gdf = iso_context = None
+        if context is not None and isos:
+            streets_gdf = streets_in(streets, isos[0].crs, context)
+            if engine == 'vector':
+                iso_context = isochrone_context(isos, decay=decay, crs=_points_crs(streets, engine), context=context)
+        bus_rail_attributes = score_streets(
+            bus_result_iso, rail_result_iso, streets, streets_gdf,
+            sample_interval=sample_interval, engine=engine, raster_resolution=raster_resolution,
+            node_sig=node_sig, decay=decay, context=iso_context,
+        )
+    else:
+        bus_rail_attributes = combine_tiles(iter_tile_scores(
+            bus_result_iso, rail_result_iso, streets, tile_size,
+            sample_interval=sample_interval, engine=engine, raster_resolution=raster_resolution,
+            node_sig=node_sig, decay=decay, context=context,
+        ))
+        if bus_rail_attributes is None:
+            # No streets, so no tiles: the untiled pass returns the empty frame with every column
+            bus_rail_attributes = score_streets(
+                bus_result_iso, rail_result_iso, streets,
+                sample_interval=sample_interval, engine=engine, raster_resolution=raster_resolution,
+                node_sig=node_sig, decay=decay,
+            )
+        elif bus_rail_attributes['stops_computecount'].eq(0).all():
+            print("⚠️ There are no stops contributing to any points. All 'stops_count' are zero.")
 
+    return bus_rail_attributes, transit_score(bus_rail_attributes)
+
+def transit_score(bus_rail_attributes: gpd.GeoDataFrame) -> gpd.GeoDataFrame:
+    # Time windows scored alongside (Transit_attribute_<name>) get their own Transit_score_<name>
     bus_rail_score = bus_rail_attributes.copy()
-    bus_rail_score['Transit_score'] = (
-        bus_rail_score['Transit_attribute']
-        .clip(upper=22)
-        / 22 * 12.6
-    ).round(3)
-    bus_rail_score.drop(columns=['Transit_attribute', 'points_count', 'stops_computecount', 'sig_mean_mean', 'Transit_attribute', 'Score'], errors='ignore', inplace=True)
+    attributes = [c for c in bus_rail_score.columns if c.startswith('Transit_attribute')]
+    for attribute in attributes:
+        bus_rail_score[attribute.replace('Transit_attribute', 'Transit_score')] = (
+            bus_rail_score[attribute]
+            .clip(upper=22)
+            / 22 * 12.6
+        ).round(3)
+    windows = [c[len('Transit_attribute'):] for c in attributes]
+    bus_rail_score.drop(
+        columns=[c + w for w in windows for c in ('Transit_attribute', 'sig_mean_mean', 'Score')] + ['points_count', 'stops_computecount'],
+        errors='ignore', inplace=True,
+    )
+    return bus_rail_score
+
+def score_streets(
+    bus_result_iso: Optional[gpd.GeoDataFrame],
+    rail_result_iso: Optional[gpd.GeoDataFrame],
+    streets: gpd.GeoDataFrame,
+    streets_gdf: Optional[gpd.GeoDataFrame] = None,
+    sample_interval: float = DEFAULT_INTERVAL,
+    engine: str = 'vector',
+    raster_resolution: float = DEFAULT_RESOLUTION,
+    nearby_only: bool = False,
+    node_sig=None,
+    decay=None,
+    context=None,
+) -> gpd.GeoDataFrame:
+    # Per-link scores of the first available mode (bus, else rail) plus 'Transit_attribute', the sum of both modes.
+    # All modes are joined and reduced in one pass. nearby_only: first narrow the isochrones to the sample points (tiles)
+    # context: a StudyContext whose 'isochrones' layer holds these isochrones (vector engine, see isochrone_context)
+    isos = [iso for iso in (bus_result_iso, rail_result_iso) if iso is not None and not iso.empty]
+    if not isos:
+        raise ValueError("No bus or rail isochrones to score")
+    if streets_gdf is None:
+        streets_gdf = streets.to_crs(isos[0].crs)
+    points_crs = _points_crs(streets, engine)
 
-    return bus_rail_attributes, bus_rail_score
+    # Interpolate points along streets using the provided geometry
+    points = interpolate_roads(streets, target_crs=streets.crs, interval=sample_interval, output_crs=points_crs)
+
+    if nearby_only and engine != 'network' and context is None:
+        margin = raster_resolution if engine == 'raster' else 0.0
+        isos = [isochrones_near(iso, points.total_bounds, margin=margin) for iso in isos]
+
+    # Tiles report empty coverage once for the whole run instead of per tile
+    warn = not nearby_only
+    if engine == 'vector':
+        return scoring_combined(points, isos, streets_gdf, warn=warn, decay=decay, context=context)
+    if engine == 'raster':
+        return raster_scoring_combined(points, isos, streets_gdf, resolution=raster_resolution, warn=warn)
+    if engine == 'network':
+        if node_sig is None:
+            raise ValueError("The network engine needs node significance (see combine_scores)")
+        return network_scoring_combined(points, node_sig, streets_gdf, warn=warn)
+    raise ValueError(f"Unknown scoring engine {engine!r} (expected 'vector', 'raster' or 'network')")
+
+def iter_tile_scores(
+    bus_result_iso: Optional[gpd.GeoDataFrame],
+    rail_result_iso: Optional[gpd.GeoDataFrame],
+    streets: gpd.GeoDataFrame,
+    tile_size: float = DEFAULT_TILE_SIZE,
+    sample_interval: float = DEFAULT_INTERVAL,
+    engine: str = 'vector',
+    raster_resolution: float = DEFAULT_RESOLUTION,
+    node_sig=None,
+    decay=None,
+    context: Optional[StudyContext] = None,
+):
+    # Yields (tile number, per-link scores) one tile at a time; only one tile's points are ever in memory
+    # context: the run's StudyContext (see combine_scores)
+    first = bus_result_iso if bus_result_iso is not None and not bus_result_iso.empty else rail_result_iso
+    if first is None or first.empty:
+        raise ValueError("No bus or rail isochrones to score")
+    streets_gdf = streets_in(streets, first.crs, context)
+
+    # Isochrones are looked up in the CRS of the sample points
+    points_crs = _points_crs(streets, engine) or streets.crs
+    bus_iso  = bus_result_iso.to_crs(points_crs)  if bus_result_iso  is not None else None
+    rail_iso = rail_result_iso.to_crs(points_crs) if rail_result_iso is not None else None
+
+    # The vector join indexes the isochrones once for every tile
+    iso_context = None
+    if engine == 'vector':
+        isos = [iso for iso in (bus_iso, rail_iso) if iso is not None and not iso.empty]
+        iso_context = isochrone_context(isos, decay=decay, crs=points_crs, context=context)
+
+    for tile, rows in iter_tiles(street_tiles(streets, tile_size)):
+        scores = score_streets(
+            bus_iso, rail_iso, streets.iloc[rows], streets_gdf.iloc[rows],
+            sample_interval=sample_interval, engine=engine, raster_resolution=raster_resolution,
+            nearby_only=True, node_sig=node_sig, decay=decay, context=iso_context,
+        )
+        yield tile, scores
+
+def combine_tiles(tiles) -> Optional[gpd.GeoDataFrame]:
+    # Per-link scores of every (tile, scores) pair, gathered column by column as each tile is produced, so only
+    # one tile's sample points and join are ever alive; None when there are no tiles
+    columns, crs, sizes = None, None, {'sample_points': 0, 'joined_rows': 0}
+    for _, scores in tiles:
+        if columns is None:
+            columns, crs = {c: [] for c in scores.columns}, scores.crs
+        for c, parts in columns.items():
+            parts.append(scores[c].to_numpy())
+        for size in sizes:
+            sizes[size] += scores.attrs.get(size, 0)
+    if columns is None:
+        return None
+
+    # Same row order as the untiled groupby on link_id
+    combined = gpd.GeoDataFrame(
+        {c: np.concatenate(parts) for c, parts in columns.items()},
+        geometry='geometry',
+        crs=crs,
+    ).sort_values('link_id', kind='stable').reset_index(drop=True)
+    combined.attrs.update(sizes)
+    return combined
+
+def streets_in(streets: gpd.GeoDataFrame, crs, context: Optional[StudyContext] = None) -> gpd.GeoDataFrame:
+    # The streets in crs, projected once by the run's context when streets is its 'streets' layer
+    if context is not None and 'streets' in context and context.layer('streets') is streets:
+        return context.layer('streets', crs)
+    return streets.to_crs(crs)
+
+def _points_crs(streets, engine):
+    # The vector join runs in WGS84 like the isochrones (and the network engine like the walk graph);
+    # the raster grid needs a projected CRS
+    if engine in ('vector', 'network'):
+        return "EPSG:4326"
+    if streets.crs is not None and streets.crs.is_projected:
+        return None
+    return streets.estimate_utm_crs()
 
 def persist_and_plot(
     place_geometry,
     bus_rail_attributes: gpd.GeoDataFrame,
-    bus_rail_score: gpd.GeoDataFrame
+    bus_rail_score: gpd.GeoDataFrame,
+    output_dir: str = "data/output",
+    formats=DEFAULT_FORMATS,
+    partition_by=None,
+    tag: Optional[str] = None,
+    tile_size: float = DEFAULT_TILE_SIZE,
+    plot_mode: str = "geojson",
+    simplify_tolerance: Optional[float] = None,
+    precision: Optional[int] = DEFAULT_PRECISION,
+    stops: Optional[gpd.GeoDataFrame] = None,
+    context: Optional[StudyContext] = None,
 ):
-    output_dir = "data/output"
+    # formats: any of 'parquet' (GeoParquet), 'fgb' (FlatGeobuf), 'geojson', 'csv'; see writers.write_scores
+    # plot_mode: 'geojson', 'polyline' or 'tiles'; see plot.plot
+    # stops: the scored stops; partitioning by 'tag' files each link under the feed (source) of its nearest stop
+    # context: the run's StudyContext, whose 'streets' / 'stops_within' layers answer that nearest-stop query
     os.makedirs(output_dir, exist_ok=True)
 
-    html_path = os.path.join(output_dir, "Transit_Accessibility_Map.html")
-    plot(bus_rail_score, place_geometry, score_column="Transit_score", filename=html_path)
+    html_path = os.path.join(output_dir, DEFAULT_VIEWER)
+    plot(bus_rail_score, place_geometry, score_column="Transit_score", filename=html_path,
+         mode=plot_mode, simplify_tolerance=simplify_tolerance, precision=precision)
+
+    keys = [partition_by] if isinstance(partition_by, str) else list(partition_by or [])
+    if 'tag' in keys and stops is not None and 'source' in stops.columns:
+        tag = link_sources(bus_rail_score, stops, default=tag, context=context)
+    return write_scores(
+        bus_rail_score, output_dir, "Transit_Accessibility_SCORE",
+        formats=formats, partition_by=partition_by, tag=tag, tile_size=tile_size,
+    )
 
-    file_path = os.path.join(output_dir, "Transit_Accessibility_SCORE.geojson")
-    bus_rail_score.to_file(file_path, driver="GeoJSON")
+def link_sources(links: gpd.GeoDataFrame, stops: gpd.GeoDataFrame, default: Optional[str] = None,
+                 context: Optional[StudyContext] = None) -> np.ndarray:
+    # Feed tag ('source') of the stop nearest to every link, in metres; default where there is none.
+    # With the run's context (stops being its 'stops_within' layer), the query runs on its projected streets.
+    if context is not None and 'streets' in context and 'stops_within' in context and context.layer('stops_within') is stops:
+        street_rows, stop_rows = context.nearest('streets', 'stops_within', crs=context.crs)
+        nearest = pd.Series(stops['source'].astype(str).to_numpy()[stop_rows],
+                            index=context.layer('streets')['link_id'].to_numpy()[street_rows])
+        nearest = nearest[~nearest.index.duplicated()]
+        row = nearest.index.get_indexer(links['link_id'].to_numpy())
+        tags = np.full(len(links), default, dtype=object)
+        tags[row >= 0] = nearest.to_numpy(dtype=object)[row[row >= 0]]
+        return tags
 
-    file_path = os.path.join(output_dir, "Transit_Accessibility_SCORE.csv")
-    bus_rail_score.to_csv(file_path)
\ No newline at end of file
+    crs = links.estimate_utm_crs() if not links.empty else None
+    context = StudyContext(crs, links=links[['geometry']], stops=stops[['source', 'geometry']])
+    link_rows, stop_rows = context.nearest('links', 'stops')
+    tags = np.full(len(links), default, dtype=object)
+    tags[link_rows] = stops['source'].astype(str).to_numpy()[stop_rows]
+    return tags
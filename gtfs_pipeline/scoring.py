@@ -1,47 +1,156 @@
 import geopandas as gpd
 import pandas as pd
 import numpy as np
+from typing import NamedTuple, Optional
 
-def scoring(points, iso, streets):
-    #print("Debug: Check CRS: ", "iso:", iso.crs, "point:",points.crs, streets.crs)
-    joined_gdf = gpd.sjoin(points, iso, how="left", predicate="intersects")
+from gtfs_pipeline.context import StudyContext
 
-    # Convert index to column for grouping
-    joined_gdf = joined_gdf.reset_index()
+DECAYS = ('linear', 'gaussian')
+# Metres at which linear decay reaches zero, and the standard deviation of the Gaussian decay
+DEFAULT_DECAY_SCALE = {'linear': 700.0, 'gaussian': 350.0}
+# Stop location (EPSG:4326) carried on the isochrone layers for distance decay
+STOP_LON, STOP_LAT = 'stop_lon', 'stop_lat'
+EARTH_RADIUS_M = 6_371_008.8
 
-    # Summarize significance per point
-    collapsed_gdf = joined_gdf.groupby("index", as_index=False).agg({
-    "name": "first",
-    "link_id": "first",
-    "geometry": "first",
-    "significance": "sum"
+
+class Decay(NamedTuple):
+    kind: str       # 'linear' or 'gaussian'
+    scale: float    # metres; see DEFAULT_DECAY_SCALE
+
+def scoring_combined(points, isos, streets, warn=True, decay: Optional[Decay] = None, context: Optional[StudyContext] = None):
+    # All modes in one join: isos is a list of isochrone layers (e.g. [bus, rail]) stacked with a 'mode' column.
+    # Returns the per-link scores of the first mode plus 'Transit_attribute', the sum of every mode's Score.
+    # Time windows (significance_<name> columns) ride along the same join as Transit_attribute_<name>.
+    # decay: weight each stop's significance by its distance to the point (isos need stop_lon / stop_lat)
+    # context: an isochrone_context of the same isos, shared by repeated joins (tiles)
+    sig_sum, stops_count, window_sums = point_contributions(points, isos, decay=decay, context=context)
+    return score_links_combined(points['link_id'].to_numpy(), sig_sum, stops_count, streets, warn=warn, window_sums=window_sums)
+
+def window_names(isos):
+    # Time windows scored in every layer, from the significance_<name> columns of stop_significance
+    names = [c[len('significance_'):] for c in isos[0].columns if c.startswith('significance_')]
+    return [n for n in names if all(f'significance_{n}' in iso.columns for iso in isos)]
+
+def isochrone_context(isos, decay: Optional[Decay] = None, crs=None, context: Optional[StudyContext] = None) -> StudyContext:
+    # Every mode's isochrones stacked (with a 'mode' column) into the indexed 'isochrones' layer of context
+    # (the run's StudyContext, or a new one), in crs (the sample points' CRS; default the isochrones' own),
+    # so repeated joins share one STRtree
+    windows = window_names(isos)
+    columns = ['significance'] + [f'significance_{w}' for w in windows]
+    if decay is not None:
+        if not all(STOP_LON in iso.columns and STOP_LAT in iso.columns for iso in isos):
+            raise ValueError("Distance decay needs stop locations on the isochrones (see with_stop_locations)")
+        columns += [STOP_LON, STOP_LAT]
+    stacked = gpd.GeoDataFrame(
+        pd.concat(
+            [iso[columns + ['geometry']].assign(mode=m) for m, iso in enumerate(isos)],
+            ignore_index=True,
+        ),
+        geometry='geometry',
+        crs=isos[0].crs,
+    )
+    crs = stacked.crs if crs is None else crs
+    if context is None:
+        context = StudyContext(crs)
+    context.add('isochrones', stacked, crs=crs)
+    return context
+
+def point_contributions(points, isos, decay: Optional[Decay] = None, context: Optional[StudyContext] = None):
+    # (modes x points) arrays of summed significance and contributing stop count per sample point,
+    # plus {window: (modes x points) summed significance_<window>}.
+    # With decay, the sums are of weight x significance; the counts stay unweighted.
+    windows = window_names(isos)
+    columns = ['significance'] + [f'significance_{w}' for w in windows]
+    if context is None:
+        context = isochrone_context(isos, decay=decay)
+    stacked = context.layer('isochrones')
+    # Same (point, isochrone) pairs and order as a left sjoin on 'intersects'
+    point_pos, iso_pos = context.query('isochrones', points.geometry.values, predicate='intersects')
+
+    # Summarize significance per (mode, point); matches keep the per-mode order of separate joins
+    hit = stacked['significance'].notna().to_numpy()[iso_pos]
+    point_pos, iso_pos = point_pos[hit], iso_pos[hit]
+    n_points = len(points)
+    key = stacked['mode'].to_numpy(dtype=np.int64)[iso_pos] * n_points + point_pos
+    values = pd.DataFrame(stacked[columns].to_numpy(dtype=float)[iso_pos], columns=columns)
+    if decay is not None:
+        # Distances of the joined (point, stop) pairs only, as flat arrays
+        lon, lat = _lon_lat(points)
+        stop_lon = stacked[STOP_LON].to_numpy(dtype=float)[iso_pos]
+        stop_lat = stacked[STOP_LAT].to_numpy(dtype=float)[iso_pos]
+        values = values.mul(decay_weights(haversine(lon[point_pos], lat[point_pos], stop_lon, stop_lat), decay), axis=0)
+    grouped = values.groupby(key)
+    per_point = grouped.sum()
+    count = grouped['significance'].count()
+
+    def _spread(values, dtype=float):
+        out = np.zeros(len(isos) * n_points, dtype=dtype)
+        out[per_point.index] = values
+        return out.reshape(len(isos), n_points)
+
+    sig_sum = _spread(per_point['significance'].to_numpy())
+    stops_count = _spread(count.to_numpy(), dtype=np.int64)
+    window_sums = {w: _spread(per_point[f'significance_{w}'].to_numpy()) for w in windows}
+    return sig_sum, stops_count, window_sums
+
+def score_links_combined(link_id, sig_sum, stops_count, streets, warn=True, window_sums=None):
+    # sig_sum / stops_count: (modes x points) arrays; every mode is reduced in a single groupby.
+    # window_sums: optional {window: (modes x points)} sums, scored into Transit_attribute_<window>
+    window_sums = window_sums or {}
+    n_modes, n_points = sig_sum.shape
+    collapsed = pd.DataFrame({
+        'mode': np.repeat(np.arange(n_modes), n_points),
+        'link_id': np.tile(link_id, n_modes),
+        'sig_sum_per_point': sig_sum.ravel(),
+        'stops_count': stops_count.ravel(),
+        **{f'sig_sum_per_point_{w}': sums.ravel() for w, sums in window_sums.items()},
     })
-    collapsed_gdf = collapsed_gdf.rename(columns={"significance": "sig_sum_per_point"})
+    if warn:
+        for m in range(n_modes):
+            if (stops_count[m] == 0).all():
+                print("⚠️ There are no stops contributing to any points. All 'stops_count' are zero.")
 
-    # Add count of stops contributing to each point
-    collapsed_gdf["stops_count"] = joined_gdf.groupby("index")["significance"].count().values
+    per_mode = _link_scores(collapsed, ['mode', 'link_id'], windows=list(window_sums))
+    scoredStreet = per_mode[per_mode['mode'] == 0].drop(columns='mode').reset_index(drop=True)
+    attributes = ['Transit_attribute'] + [f'Transit_attribute_{w}' for w in window_sums]
+    for attribute in attributes:
+        score = attribute.replace('Transit_attribute', 'Score')
+        scoredStreet[attribute] = scoredStreet[score]
+        for m in range(1, n_modes):
+            scoredStreet[attribute] += per_mode.loc[per_mode['mode'] == m, score].to_numpy()
 
-    # Compute mean significance per point
-    if collapsed_gdf["stops_count"].eq(0).all():
-        print("⚠️ There are no stops contributing to any points. All 'stops_count' are zero.")
+    # Merge geometry once for all modes
+    scoredStreet = _with_geometry(scoredStreet, streets)
+    scoredStreet = scoredStreet[[c for c in scoredStreet.columns if c not in attributes] + attributes]
+    # Sizes of the join for run metrics
+    scoredStreet.attrs.update(sample_points=int(n_points), joined_rows=int(stops_count.sum()))
+    return scoredStreet
+
+def _link_scores(collapsed_gdf, keys, windows=()):
+    # windows: suffixes of extra sig_sum_per_point_<w> columns, scored like the main one into Score_<w>
+    suffixes = [''] + [f'_{w}' for w in windows]
 
-    collapsed_gdf['sig_mean_per_point'] = (
-        collapsed_gdf['sig_sum_per_point'] / collapsed_gdf['stops_count']
-    ).where(collapsed_gdf['stops_count'] != 0, 0)
+    # Compute mean significance per point
+    for sfx in suffixes:
+        collapsed_gdf['sig_mean_per_point' + sfx] = (
+            collapsed_gdf['sig_sum_per_point' + sfx] / collapsed_gdf['stops_count']
+        ).where(collapsed_gdf['stops_count'] != 0, 0)
 
     # Group by link_id to compute street-level scores
-    scoredStreet = collapsed_gdf.groupby(["link_id"], as_index=False).agg(
+    scoredStreet = collapsed_gdf.groupby(keys, as_index=False).agg(
         points_count=("sig_sum_per_point", "count"),
         stops_computecount=("stops_count", "sum"),
-        sig_mean_mean=("sig_mean_per_point", "mean"),
+        **{'sig_mean_mean' + sfx: ('sig_mean_per_point' + sfx, "mean") for sfx in suffixes},
     )
 
-    # Fill NaN values with 0
-    scoredStreet['sig_mean_mean'] = scoredStreet['sig_mean_mean'].fillna(0)
+    # Fill NaN values with 0, then final Score Calculation
+    coverage = np.log((scoredStreet['stops_computecount']/scoredStreet['points_count'])+1)
+    for sfx in suffixes:
+        scoredStreet['sig_mean_mean' + sfx] = scoredStreet['sig_mean_mean' + sfx].fillna(0)
+        scoredStreet['Score' + sfx] = scoredStreet['sig_mean_mean' + sfx]*coverage
+    return scoredStreet
 
-    # Final Score Calculation
-    scoredStreet['Score'] = scoredStreet['sig_mean_mean']*(np.log((scoredStreet['stops_computecount']/scoredStreet['points_count'])+1))
-    
+def _with_geometry(scoredStreet, streets):
     # Convert to GeoDataFrame and merge geometry
     streets = streets.drop(columns=['midpoint', 'points'], errors='ignore')
     scoredStreet = scoredStreet.merge(
@@ -54,4 +163,52 @@ def scoring(points, iso, streets):
         geometry='geometry',
         crs=streets.crs
     )
-    return scoredStreet
\ No newline at end of file
+    return scoredStreet
+
+
+##--------------------------------------------------------------------------
+## Distance Decay
+##--------------------------------------------------------------------------
+
+def make_decay(kind: Optional[str], scale: Optional[float] = None) -> Optional[Decay]:
+    # None (no decay), or a Decay of kind 'linear' / 'gaussian' with scale metres (default per kind)
+    if kind is None:
+        return None
+    if kind not in DECAYS:
+        raise ValueError(f"Unknown decay {kind!r} (expected one of {DECAYS})")
+    scale = DEFAULT_DECAY_SCALE[kind] if scale is None else float(scale)
+    if not scale > 0:
+        raise ValueError(f"Decay scale must be positive, got {scale}")
+    return Decay(kind, scale)
+
+def decay_weights(distance, decay: Decay) -> np.ndarray:
+    # linear: 1 at the stop, 0 from scale metres on; gaussian: exp(-d^2 / (2 scale^2)). Unknown distances weigh 0.
+    distance = np.asarray(distance, dtype=float)
+    if decay.kind == 'linear':
+        weights = np.clip(1.0 - distance / decay.scale, 0.0, 1.0)
+    else:
+        weights = np.exp(-0.5 * (distance / decay.scale) ** 2)
+    return np.nan_to_num(weights, nan=0.0)
+
+def haversine(lon1, lat1, lon2, lat2) -> np.ndarray:
+    # Great-circle distance in metres between arrays of points
+    lon1, lat1, lon2, lat2 = (np.deg2rad(np.asarray(a, dtype=float)) for a in (lon1, lat1, lon2, lat2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(a))
+
+def with_stop_locations(iso: Optional[gpd.GeoDataFrame], stops: gpd.GeoDataFrame) -> Optional[gpd.GeoDataFrame]:
+    # iso with the stop_lon / stop_lat of its stop_id (NaN where the stop has no location)
+    if iso is None:
+        return None
+    located = stops[~(stops.geometry.isna() | stops.geometry.is_empty)].drop_duplicates(subset='stop_id')
+    lon, lat = _lon_lat(located)
+    row = pd.Index(located['stop_id'].astype(str)).get_indexer(iso['stop_id'].astype(str))
+    iso = iso.copy()
+    iso[STOP_LON] = np.where(row >= 0, lon[row] if len(lon) else np.nan, np.nan)
+    iso[STOP_LAT] = np.where(row >= 0, lat[row] if len(lat) else np.nan, np.nan)
+    return iso
+
+def _lon_lat(gdf):
+    if gdf.crs is not None and gdf.crs != "EPSG:4326":
+        gdf = gdf.to_crs("EPSG:4326")
+    return gdf.geometry.x.to_numpy(), gdf.geometry.y.to_numpy()
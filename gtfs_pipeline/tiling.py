@@ -0,0 +1,44 @@
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import shapely
+from shapely.geometry import box
+
+# Default edge length (in metres) of the square tiles streets are scored in
+DEFAULT_TILE_SIZE = 5000
+
+
+def street_tiles(streets: gpd.GeoDataFrame, tile_size: float = DEFAULT_TILE_SIZE) -> np.ndarray:
+    # Tile number of every street row, from the midpoint of the link on a grid of tile_size metres.
+    # Rows sharing a link_id always land in the same tile, so per-link scores never span tiles.
+    if streets.crs is not None and not streets.crs.is_projected:
+        streets = streets.to_crs(streets.estimate_utm_crs())
+    midpoints = shapely.line_interpolate_point(streets.geometry.to_numpy(), 0.5, normalized=True)
+
+    cells = pd.DataFrame({
+        'link_id': streets['link_id'].to_numpy(),
+        'tx': np.floor(shapely.get_x(midpoints) / tile_size),
+        'ty': np.floor(shapely.get_y(midpoints) / tile_size),
+    })
+    cells[['tx', 'ty']] = cells.groupby('link_id', sort=False)[['tx', 'ty']].transform('first')
+    cells = cells.fillna({'tx': 0, 'ty': 0})
+
+    _, tiles = np.unique(cells[['tx', 'ty']].to_numpy(), axis=0, return_inverse=True)
+    return tiles.ravel()
+
+def iter_tiles(tiles: np.ndarray):
+    # (tile number, row positions) in tile order; positions keep the original row order
+    order = np.argsort(tiles, kind='stable')
+    bounds = np.flatnonzero(np.diff(tiles[order])) + 1
+    for rows in np.split(order, bounds):
+        if len(rows):
+            yield tiles[rows[0]], rows
+
+def isochrones_near(iso: gpd.GeoDataFrame, bounds, margin: float = 0.0) -> gpd.GeoDataFrame:
+    # Isochrones touching the (optionally enlarged) bounds, via the spatial index, in original order
+    if iso.empty:
+        return iso
+    minx, miny, maxx, maxy = bounds
+    area = box(minx - margin, miny - margin, maxx + margin, maxy + margin)
+    hits = iso.sindex.query(area, predicate='intersects')
+    return iso.iloc[np.sort(hits)]
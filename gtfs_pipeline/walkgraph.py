@@ -0,0 +1,355 @@
+import os
+import tempfile
+import numpy as np
+import pandas as pd
+import shapely
+from pyproj import CRS, Transformer
+from scipy import sparse
+from scipy.sparse.csgraph import dijkstra
+from scipy.spatial import cKDTree
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import NamedTuple, Optional
+
+# Upper bound on the dense (sources x nodes) distance block held per Dijkstra batch
+MAX_BATCH_CELLS = 2**25
+
+# Catchment shapes: convex hull of the reached nodes, buffered reached edges, or concave hull of the reached edges
+CATCHMENTS = ('convex', 'edges', 'concave')
+# Metres either side of the reached edges covered by an 'edges' catchment
+EDGE_BUFFER = 25.0
+# shapely.concave_hull ratio of a 'concave' catchment (1 = convex hull, smaller = tighter)
+CONCAVE_RATIO = 0.3
+# Upper bound on the reach entries (stop x reached node) turned into edge geometries per batch
+MAX_BATCH_EDGES = 2**20
+
+
+class WalkGraph(NamedTuple):
+    adjacency: sparse.csr_matrix   # node x node, shortest parallel edge length
+    node_ids: np.ndarray           # original graph node id for every CSR row
+    x: np.ndarray
+    y: np.ndarray
+    crs: object
+
+
+##--------------------------------------------------------------------------
+## Graph Conversion
+##--------------------------------------------------------------------------
+
+def graph_to_csr(G) -> WalkGraph:
+    nodes = pd.Index(list(G.nodes))
+    x = np.array([x for _, x in G.nodes(data='x')], dtype=float)
+    y = np.array([y for _, y in G.nodes(data='y')], dtype=float)
+    n = len(nodes)
+
+    edges = list(G.edges(data='length'))
+    if edges:
+        u, v, length = zip(*edges)
+        u = nodes.get_indexer(u)
+        v = nodes.get_indexer(v)
+        length = np.asarray(length, dtype=float)
+    else:
+        u = v = np.empty(0, dtype=np.int64)
+        length = np.empty(0, dtype=float)
+
+    # Keep only the shortest of any parallel edges (same rule as networkx on multigraphs)
+    order = np.lexsort((length, v, u))
+    u, v, length = u[order], v[order], length[order]
+    first = np.ones(len(u), dtype=bool)
+    first[1:] = (u[1:] != u[:-1]) | (v[1:] != v[:-1])
+
+    # Zero-length edges stay as explicit zeros, which csgraph treats as edges
+    adjacency = sparse.csr_matrix(
+        (length[first], (u[first], v[first])), shape=(n, n)
+    )
+    return WalkGraph(adjacency, nodes.to_numpy(), x, y, G.graph.get('crs'))
+
+
+##--------------------------------------------------------------------------
+## Snapping
+##--------------------------------------------------------------------------
+
+def _to_unit_sphere(lon, lat):
+    lon, lat = np.deg2rad(lon), np.deg2rad(lat)
+    return np.column_stack([
+        np.cos(lat) * np.cos(lon),
+        np.cos(lat) * np.sin(lon),
+        np.sin(lat),
+    ])
+
+def snap_to_nodes(wg: WalkGraph, x, y) -> np.ndarray:
+    return nearest_positions(wg.x, wg.y, wg.crs, x, y)
+
+def nearest_positions(node_x, node_y, crs, x, y) -> np.ndarray:
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+
+    # Chord distance on the unit sphere orders neighbours exactly like haversine
+    if crs is None or CRS.from_user_input(crs).is_geographic:
+        tree = cKDTree(_to_unit_sphere(node_x, node_y))
+        _, pos = tree.query(_to_unit_sphere(x, y), k=1)
+    else:
+        tree = cKDTree(np.column_stack([node_x, node_y]))
+        _, pos = tree.query(np.column_stack([x, y]), k=1)
+    return np.asarray(pos, dtype=np.int64)
+
+
+##--------------------------------------------------------------------------
+## Bounded Shortest Paths
+##--------------------------------------------------------------------------
+
+def bounded_distances(
+    wg: WalkGraph,
+    sources: np.ndarray,
+    limit: float,
+    batch_size: Optional[int] = None,
+    n_workers: int = 1,
+    pool: Optional["ReachPool"] = None,
+) -> sparse.csr_matrix:
+    # Returns a (sources x nodes) matrix of walk distances <= limit.
+    # The origin itself is stored as an explicit zero, so iterate via indptr rather than nonzero().
+    # pool: a ReachPool of wg kept open across calls; otherwise n_workers > 1 starts a pool for this call only
+    sources = np.asarray(sources, dtype=np.int64)
+    n_nodes = wg.adjacency.shape[0]
+    if batch_size is None:
+        batch_size = max(1, MAX_BATCH_CELLS // max(n_nodes, 1))
+
+    if pool is not None:
+        if pool.adjacency is not wg.adjacency:
+            raise ValueError("The ReachPool was opened on another graph")
+        results = pool.reach(sources, limit, batch_size)
+    elif n_workers > 1 and len(sources) > 1:
+        with ReachPool(wg, n_workers) as pool:
+            results = pool.reach(sources, limit, batch_size)
+    else:
+        results = [
+            _reach_batch(wg.adjacency, sources[start:start + batch_size], limit)
+            for start in range(0, len(sources), batch_size)
+        ]
+
+    if not results:
+        return sparse.csr_matrix((0, n_nodes))
+
+    counts, indices, data = zip(*results)
+    indptr = np.concatenate([[0], np.cumsum(np.concatenate(counts))])
+    return sparse.csr_matrix(
+        (np.concatenate(data), np.concatenate(indices), indptr),
+        shape=(len(sources), n_nodes),
+    )
+
+def _reach_batch(adjacency, batch, limit):
+    dist = dijkstra(adjacency, directed=True, indices=batch, limit=limit)
+    reached = np.isfinite(dist)
+    return reached.sum(axis=1), np.nonzero(reached)[1], dist[reached]
+
+##--------------------------------------------------------------------------
+## Process Pool (graph arrays shared through memory-mapped files)
+##--------------------------------------------------------------------------
+
+_WORKER_ADJACENCY = None
+
+class ReachPool:
+    # Worker processes reading the graph arrays from memory-mapped files, written and started once and reused by
+    # every bounded_distances(..., pool=pool) call until the block exits. Starts lazily; serial with n_workers <= 1.
+    def __init__(self, wg: WalkGraph, n_workers: int):
+        self.adjacency = wg.adjacency
+        self.n_workers = n_workers
+        self._dir = None
+        self._pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+        if self._dir is not None:
+            self._dir.cleanup()
+            self._dir = None
+
+    def reach(self, sources, limit, batch_size) -> list:
+        # (counts, indices, distances) per batch, in source order
+        if self.n_workers <= 1 or len(sources) <= 1:
+            return [
+                _reach_batch(self.adjacency, sources[start:start + batch_size], limit)
+                for start in range(0, len(sources), batch_size)
+            ]
+        # Enough chunks to keep every worker busy; executor.map keeps chunk order, so results are deterministic
+        chunk = max(1, min(batch_size, -(-len(sources) // (self.n_workers * 4))))
+        chunks = [sources[start:start + chunk] for start in range(0, len(sources), chunk)]
+        return list(self._executor().map(_reach_worker, chunks, [limit] * len(chunks)))
+
+    def _executor(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            self._dir = tempfile.TemporaryDirectory(prefix='walkgraph-')
+            for name in ('indptr', 'indices', 'data'):
+                np.save(os.path.join(self._dir.name, f'{name}.npy'), getattr(self.adjacency, name))
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.n_workers,
+                initializer=_init_worker,
+                initargs=(self._dir.name, self.adjacency.shape),
+            )
+        return self._pool
+
+def _init_worker(graph_dir, shape):
+    global _WORKER_ADJACENCY
+    arrays = {
+        name: np.load(os.path.join(graph_dir, f'{name}.npy'), mmap_mode='r')
+        for name in ('indptr', 'indices', 'data')
+    }
+    _WORKER_ADJACENCY = sparse.csr_matrix(
+        (arrays['data'], arrays['indices'], arrays['indptr']), shape=shape, copy=False
+    )
+
+def _reach_worker(batch, limit):
+    return _reach_batch(_WORKER_ADJACENCY, batch, limit)
+
+
+##--------------------------------------------------------------------------
+## Catchment Geometry
+##--------------------------------------------------------------------------
+
+def reach_hulls(
+    wg: WalkGraph,
+    reach: sparse.csr_matrix,
+    radius: float,
+    rows: Optional[np.ndarray] = None,
+) -> np.ndarray:
+    # Convex hull of the nodes within `radius` for each requested row of `reach`
+    if rows is not None:
+        reach = reach[rows]
+    n_rows = reach.shape[0]
+
+    row_ids = np.repeat(np.arange(n_rows), np.diff(reach.indptr))
+    within = reach.data <= radius
+    cols = reach.indices[within]
+    coords = np.column_stack([wg.x[cols], wg.y[cols]])
+
+    points = shapely.multipoints(
+        coords, indices=row_ids[within], out=np.empty(n_rows, dtype=object)
+    )
+    return shapely.convex_hull(points)
+
+def reach_catchments(
+    wg: WalkGraph,
+    reach: sparse.csr_matrix,
+    radius: float,
+    rows: Optional[np.ndarray] = None,
+    method: str = 'convex',
+    buffer: float = EDGE_BUFFER,
+    ratio: float = CONCAVE_RATIO,
+    n_workers: int = 1,
+) -> np.ndarray:
+    # Catchment polygon within `radius` for each requested row of `reach`:
+    #   'convex'  convex hull of the reached nodes (reach_hulls)
+    #   'edges'   reached edges, including the part of an edge walked before the distance runs out, buffered by `buffer` metres
+    #   'concave' concave hull of the same edge end points
+    if method == 'convex':
+        return reach_hulls(wg, reach, radius, rows=rows)
+    if method not in CATCHMENTS:
+        raise ValueError(f"Unknown catchment {method!r} (expected one of {CATCHMENTS})")
+    if rows is not None:
+        reach = reach[rows]
+
+    # Buffers are built in metres and transformed back to the graph CRS; the concave hull ratio is scale-free
+    to_metres, from_metres = _metric_transformers(wg) if method == 'edges' else (None, None)
+    x, y = (wg.x, wg.y) if to_metres is None else to_metres.transform(wg.x, wg.y)
+
+    out = np.empty(reach.shape[0], dtype=object)
+    for start, stop in _row_batches(reach.indptr, MAX_BATCH_EDGES):
+        row, segments = reach_edges(wg.adjacency, x, y, reach[start:stop], radius)
+        # Reached nodes count too, so a stop whose snapped node has no edges still gets a catchment
+        node_row, node_xy, node = _reached_coords(x, y, reach[start:stop], radius)
+        n_rows = stop - start
+        if method == 'edges':
+            # Per-segment buffers are unioned per stop, which is much cheaper than buffering a multi-line
+            isolated = np.diff(wg.adjacency.indptr)[node] == 0
+            node_row, node_xy = node_row[isolated], node_xy[isolated]
+            parts = np.concatenate([
+                shapely.buffer(shapely.linestrings(segments), buffer, quad_segs=4),
+                shapely.buffer(shapely.points(node_xy), buffer, quad_segs=4),
+            ])
+            part_row = np.concatenate([row, node_row])
+        else:
+            parts = shapely.points(np.concatenate([segments.reshape(-1, 2), node_xy]))
+            part_row = np.concatenate([np.repeat(row, 2), node_row])
+        order = np.argsort(part_row, kind='stable')
+        groups = shapely.geometrycollections(parts[order], indices=part_row[order], out=np.empty(n_rows, dtype=object))
+        if method == 'edges':
+            out[start:stop] = _union_groups(groups, n_workers)
+        else:
+            out[start:stop] = shapely.concave_hull(groups, ratio=ratio)
+
+    if from_metres is not None:
+        out = shapely.transform(out, lambda xy: np.column_stack(from_metres.transform(xy[:, 0], xy[:, 1])))
+    return out
+
+def reach_edges(adjacency, x, y, reach: sparse.csr_matrix, radius: float):
+    # (row of every segment, segments as an (n, 2, 2) coordinate array) walked within `radius`:
+    # each outgoing edge of a reached node, cut where the remaining distance runs out.
+    # An edge walked in full from both ends is kept once.
+    n_rows = reach.shape[0]
+    row_ids = np.repeat(np.arange(n_rows), np.diff(reach.indptr))
+    within = reach.data <= radius
+    row, node, dist = row_ids[within], reach.indices[within], reach.data[within]
+
+    # Expand every reached node into its CSR adjacency slice
+    degree = np.diff(adjacency.indptr)[node]
+    entry = np.repeat(np.arange(len(node)), degree)
+    pos = np.arange(len(entry)) - np.repeat(np.cumsum(degree) - degree, degree) + adjacency.indptr[node][entry]
+    u, v, length = node[entry], adjacency.indices[pos], adjacency.data[pos]
+    row, dist = row[entry], dist[entry]
+
+    walked = np.minimum(length, radius - dist)
+    full = walked >= length
+    keep = u != v
+    # Full edges reached from both ends (u -> v and v -> u) are the same segment
+    a, b = np.minimum(u, v), np.maximum(u, v)
+    order = np.lexsort((b, a, row, ~full))
+    repeated = np.zeros(len(order), dtype=bool)
+    repeated[1:] = (full[order][1:] & full[order][:-1] & (row[order][1:] == row[order][:-1])
+                    & (a[order][1:] == a[order][:-1]) & (b[order][1:] == b[order][:-1]))
+    keep[order[repeated]] = False
+    u, v, row, walked, length = u[keep], v[keep], row[keep], walked[keep], length[keep]
+
+    t = np.divide(walked, length, out=np.ones(len(length)), where=length > 0)[:, None]
+    start = np.column_stack([x[u], y[u]])
+    end = start + t * (np.column_stack([x[v], y[v]]) - start)
+    return row, np.stack([start, end], axis=1)
+
+def _reached_coords(x, y, reach, radius):
+    # (row, coordinates, node) of every node within `radius`
+    row_ids = np.repeat(np.arange(reach.shape[0]), np.diff(reach.indptr))
+    within = reach.data <= radius
+    cols = reach.indices[within]
+    return row_ids[within], np.column_stack([x[cols], y[cols]]).reshape(-1, 2), cols
+
+def _union_groups(groups, n_workers=1):
+    # Union of every geometry collection; shapely releases the GIL, so threads union separate stops in parallel
+    def _union(chunk):
+        return shapely.union_all(chunk.reshape(-1, 1), axis=1)
+    if n_workers <= 1 or len(groups) < 2:
+        return _union(groups)
+    with ThreadPoolExecutor(max_workers=n_workers) as pool:
+        return np.concatenate(list(pool.map(_union, np.array_split(groups, n_workers * 4))))
+
+def _row_batches(indptr, max_entries):
+    # (start, stop) row ranges holding about max_entries stored entries each (at least one row)
+    n_rows = len(indptr) - 1
+    start = 0
+    while start < n_rows:
+        stop = int(np.searchsorted(indptr, indptr[start] + max_entries, side='right')) - 1
+        stop = min(max(stop, start + 1), n_rows)
+        yield start, stop
+        start = stop
+
+def _metric_transformers(wg: WalkGraph):
+    # (to metres, back) for a geographic graph, via the UTM zone of its centre; (None, None) if already projected
+    if wg.crs is not None and not CRS.from_user_input(wg.crs).is_geographic:
+        return None, None
+    lon, lat = np.nanmean(wg.x) if len(wg.x) else 0.0, np.nanmean(wg.y) if len(wg.y) else 0.0
+    zone = int((lon + 180) // 6) + 1
+    utm = CRS.from_epsg((32600 if lat >= 0 else 32700) + zone)
+    source = CRS.from_user_input(wg.crs or "EPSG:4326")
+    return (Transformer.from_crs(source, utm, always_xy=True),
+            Transformer.from_crs(utm, source, always_xy=True))
@@ -0,0 +1,125 @@
+import os
+import shutil
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+from urllib.parse import quote
+
+from gtfs_pipeline.tiling import street_tiles, DEFAULT_TILE_SIZE
+
+# File extension of every output format; geojson and csv are the legacy formats, kept as opt-in
+OUTPUT_FORMATS = {'parquet': 'parquet', 'fgb': 'fgb', 'geojson': 'geojson', 'csv': 'csv'}
+DEFAULT_FORMATS = ('parquet', 'fgb')
+
+# Rows per Parquet row group; small enough for the bbox covering column to skip most groups of a bbox read
+PARQUET_ROW_GROUP_SIZE = 50_000
+
+
+def write_scores(
+    gdf: gpd.GeoDataFrame,
+    output_dir: str,
+    name: str,
+    formats=DEFAULT_FORMATS,
+    partition_by=None,
+    tag=None,
+    tile_size: float = DEFAULT_TILE_SIZE,
+) -> list:
+    # Writes gdf as <output_dir>/<name>.<ext> in every format and returns the written paths.
+    # partition_by: None, or one or more of 'tag' (the feed tag), 'tile' (square tiles of tile_size metres)
+    # or a column name. Partitions go to <name>.<ext>/<key>=<value>/.../part-0.<ext> (Hive layout).
+    # tag: the feed tag of every row, or one tag for all of them
+    unknown = [fmt for fmt in formats if fmt not in OUTPUT_FORMATS]
+    if unknown:
+        raise ValueError(f"Unknown output formats {unknown} (expected some of {list(OUTPUT_FORMATS)})")
+    keys = [partition_by] if isinstance(partition_by, str) else list(partition_by or [])
+
+    written = []
+    for fmt in formats:
+        path = os.path.join(output_dir, f"{name}.{OUTPUT_FORMATS[fmt]}")
+        if not keys:
+            written.append(write_frame(gdf, path, fmt))
+            continue
+
+        # A tag partition only replaces the folders of this run's feeds, so runs of other feeds share one dataset
+        if os.path.isfile(path):
+            os.remove(path)
+        if keys[0] == 'tag':
+            for value in pd.unique(_row_tags(gdf, tag)):
+                _remove(os.path.join(path, _partition_dir('tag', value)))
+        else:
+            _remove(path)
+        for values, rows in partition_rows(gdf, keys, tag=tag, tile_size=tile_size):
+            part_dir = os.path.join(path, *[_partition_dir(k, v) for k, v in zip(keys, values)])
+            part = gdf.iloc[rows].drop(columns=[k for k in keys if k in gdf.columns])
+            written.append(write_frame(part, os.path.join(part_dir, f"part-0.{OUTPUT_FORMATS[fmt]}"), fmt))
+    return written
+
+def partition_rows(gdf: gpd.GeoDataFrame, keys, tag=None, tile_size: float = DEFAULT_TILE_SIZE):
+    # Yields (partition values, row positions) in sorted partition order
+    values = {}
+    for key in keys:
+        if key == 'tag':
+            values[key] = _row_tags(gdf, tag)
+        elif key == 'tile':
+            values[key] = street_tiles(gdf, tile_size)
+        elif key in gdf.columns:
+            values[key] = gdf[key].to_numpy()
+        else:
+            raise ValueError(f"Cannot partition by {key!r}: not 'tag', 'tile' or a column")
+
+    groups = pd.DataFrame(values).groupby(keys, sort=True, dropna=False).indices
+    for group, rows in groups.items():
+        yield (group if isinstance(group, tuple) else (group,)), rows
+
+def write_frame(gdf: gpd.GeoDataFrame, path: str, fmt: str) -> str:
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+
+    if fmt == 'parquet':
+        # GeoParquet 1.1 with a bbox covering column; Hilbert order keeps each row group spatially compact
+        spatial_sort(gdf).to_parquet(
+            path, index=False, compression='zstd', write_covering_bbox=True,
+            row_group_size=PARQUET_ROW_GROUP_SIZE,
+        )
+    elif fmt == 'fgb':
+        # The packed Hilbert R-tree cannot hold rows without a geometry
+        missing = gdf.geometry.isna() | gdf.geometry.is_empty
+        if missing.any():
+            print(f"⚠️ {int(missing.sum())} rows without geometry left out of {path}")
+        gdf[~missing].to_file(path, driver='FlatGeobuf', engine='pyogrio', SPATIAL_INDEX='YES')
+    elif fmt == 'geojson':
+        gdf.to_file(path, driver="GeoJSON")
+    elif fmt == 'csv':
+        gdf.to_csv(path)
+    else:
+        raise ValueError(f"Unknown output format {fmt!r}")
+    return path
+
+def spatial_sort(gdf: gpd.GeoDataFrame) -> gpd.GeoDataFrame:
+    # Rows along the Hilbert curve of their bounds; rows without a geometry go last
+    valid = ~(gdf.geometry.isna() | gdf.geometry.is_empty).to_numpy()
+    if not valid.any():
+        return gdf
+    distance = np.full(len(gdf), 1 << 32, dtype=np.int64)
+    distance[valid] = gdf.geometry[valid].hilbert_distance().to_numpy()
+    return gdf.iloc[np.argsort(distance, kind='stable')]
+
+def _row_tags(gdf, tag) -> np.ndarray:
+    if tag is None:
+        raise ValueError("Partitioning by 'tag' needs the feed tag")
+    if isinstance(tag, str):
+        return np.full(len(gdf), tag, dtype=object)
+    tags = np.asarray(tag, dtype=object)
+    if len(tags) != len(gdf):
+        raise ValueError(f"Got {len(tags)} feed tags for {len(gdf)} rows")
+    return tags
+
+def _partition_dir(key, value) -> str:
+    return f"{key}={quote(str(value), safe='')}"
+
+def _remove(path):
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    elif os.path.exists(path):
+        os.remove(path)
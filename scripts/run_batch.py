@@ -0,0 +1,226 @@
+import os
+import sys
+import json
+import time
+import signal
+import multiprocessing as mp
+from typing import NamedTuple
+
+import click
+
+from gtfs_pipeline.analysis import TIME_WINDOWS, TimeWindow
+from gtfs_pipeline.checkpoint import finished_stages
+from gtfs_pipeline.metrics import group_rss
+from scripts.run_pipeline import PipelineConfig, STAGES, main as run_pipeline, run_key, check_config
+
+# Settings holding paths; relative ones are resolved against the manifest's folder
+PATH_SETTINGS = (
+    'gtfs_dir', 'points_path', 'roads_path', 'amenity_scores_path', 'amenity_inventory_path', 'output_dir',
+    'cache_dir', 'walk_network_path', 'incremental_state_dir', 'metrics_dir', 'checkpoint_dir',
+)
+REQUIRED = ('name', 'gtfs_dir', 'points_path', 'roads_path', 'output_dir')
+
+# Memory budget (GiB) of a city without memory_gb in the manifest
+DEFAULT_JOB_MEMORY_GB = 8.0
+# Seconds between checks of the running jobs
+POLL_SECONDS = 1.0
+
+
+class Job(NamedTuple):
+    name: str
+    config: PipelineConfig
+    memory_gb: float    # resident memory of the job and its worker processes; a job over budget is stopped
+    log_path: str
+
+
+##--------------------------------------------------------------------------
+## Manifest
+##--------------------------------------------------------------------------
+
+def load_manifest(path: str, job_memory_gb: float = DEFAULT_JOB_MEMORY_GB) -> list:
+    # {"defaults": {...}, "cities": [{"name": ..., "gtfs_dir": ..., ...}, ...]}
+    # Every key besides name and memory_gb is a PipelineConfig setting; city entries override the defaults.
+    # Unset amenity files mean no amenity data; metrics and checkpoints go to <output_dir>/metrics and /checkpoints.
+    with open(path) as f:
+        manifest = json.load(f)
+    root = os.path.dirname(os.path.abspath(path))
+    defaults = manifest.get('defaults', {})
+    cities = manifest.get('cities')
+    if not cities:
+        raise ValueError(f"{path} lists no cities")
+
+    jobs, names = [], set()
+    for entry in cities:
+        entry = {**defaults, **entry}
+        missing = [k for k in REQUIRED if not entry.get(k)]
+        if missing:
+            raise ValueError(f"City {entry.get('name', '?')!r} in {path} is missing {missing}")
+        name = str(entry.pop('name'))
+        if name in names:
+            raise ValueError(f"City {name!r} appears twice in {path}")
+        names.add(name)
+        memory_gb = float(entry.pop('memory_gb', job_memory_gb))
+        if 'checkpoint_dir' in entry and not entry['checkpoint_dir']:
+            # Resuming, retries and --restart all work off the checkpoints
+            raise ValueError(f"City {name!r} in {path} sets no checkpoint_dir (leave it out for <output_dir>/checkpoints)")
+
+        unknown = sorted(set(entry) - set(PipelineConfig._fields))
+        if unknown:
+            raise ValueError(f"Unknown settings {unknown} for city {name!r} (expected PipelineConfig fields)")
+        for key in PATH_SETTINGS:
+            if entry.get(key) is not None:
+                entry[key] = os.path.join(root, os.path.expanduser(entry[key]))
+        for key in ('output_formats', 'profile_stages'):
+            if isinstance(entry.get(key), list):
+                entry[key] = tuple(entry[key])
+        if 'time_windows' in entry:
+            entry['time_windows'] = tuple(_time_window(w) for w in entry['time_windows'])
+
+        output_dir = entry['output_dir']
+        config = PipelineConfig(**{
+            'amenity_scores_path': None,
+            'amenity_inventory_path': None,
+            'metrics_dir': os.path.join(output_dir, "metrics"),
+            'checkpoint_dir': os.path.join(output_dir, "checkpoints"),
+            **entry,
+        })
+        check_config(config)
+        jobs.append(Job(name, config, memory_gb, os.path.join(output_dir, "batch.log")))
+    return jobs
+
+def _time_window(window):
+    # A TIME_WINDOWS name, or [name, [[start, end], ...], [days]] with seconds since the start of the service day
+    if isinstance(window, str):
+        known = {w.name: w for w in TIME_WINDOWS}
+        if window not in known:
+            raise ValueError(f"Unknown time window {window!r} (expected one of {list(known)})")
+        return known[window]
+    name, spans, days = window
+    return TimeWindow(name, [tuple(span) for span in spans], list(days))
+
+
+##--------------------------------------------------------------------------
+## Scheduler
+##--------------------------------------------------------------------------
+
+def run_batch(jobs, workers: int = 1, memory_gb=None, retries: int = 0) -> dict:
+    # Runs the jobs on up to `workers` processes. A job starts once its memory budget fits next to the running
+    # jobs' budgets in memory_gb (None = no limit; a job larger than the limit runs alone). Each job is stopped
+    # when its processes exceed their own budget. Crashed jobs are resumed from their last finished stage up to
+    # `retries` times. Returns {name: status}.
+    status, attempts, running = {}, {}, {}
+    pending = []
+    for job in jobs:
+        done = finished_stages(job.config.checkpoint_dir, run_key(job.config))
+        if STAGES[-1] in done:
+            print(f"✅ {job.name}: already complete")
+            status[job.name] = 'complete'
+        else:
+            if memory_gb is not None and job.memory_gb > memory_gb:
+                print(f"⚠️ {job.name}: budget {job.memory_gb:g} GB exceeds the batch limit, it will run alone")
+            pending.append(job)
+
+    context = mp.get_context("spawn")
+    while pending or running:
+        # First fit in manifest order
+        for job in list(pending):
+            if len(running) >= workers:
+                break
+            used = sum(j.memory_gb for j, _, _ in running.values())
+            if running and memory_gb is not None and used + job.memory_gb > memory_gb:
+                continue
+            pending.remove(job)
+            attempts[job.name] = attempts.get(job.name, 0) + 1
+            done = finished_stages(job.config.checkpoint_dir, run_key(job.config))
+            process = context.Process(target=_run_job, args=(job,), name=f"city-{job.name}")
+            process.start()
+            running[job.name] = (job, process, time.perf_counter())
+            resume = f", resuming after {done[-1]}" if done else ""
+            print(f"▶️ {job.name}: started (budget {job.memory_gb:g} GB{resume}), log in {job.log_path}")
+
+        time.sleep(POLL_SECONDS)
+        for name, (job, process, started) in list(running.items()):
+            if process.is_alive():
+                rss = group_rss(process.pid)
+                if rss is None or rss <= job.memory_gb * 2**30:
+                    continue
+                _stop(process)
+                outcome = f"over memory budget ({rss / 2**30:.1f} GB > {job.memory_gb:g} GB)"
+            else:
+                outcome = 'ok' if process.exitcode == 0 else f"failed (exit code {process.exitcode})"
+            process.join()
+            del running[name]
+            elapsed = time.perf_counter() - started
+
+            if outcome == 'ok':
+                print(f"✅ {name}: finished in {elapsed:.0f}s")
+            elif outcome.startswith('failed') and attempts[name] <= retries:
+                print(f"⚠️ {name}: {outcome} after {elapsed:.0f}s, resuming from its last checkpoint")
+                pending.insert(0, job)
+                continue
+            else:
+                print(f"❌ {name}: {outcome} after {elapsed:.0f}s, see {job.log_path}")
+            status[name] = outcome
+    return status
+
+def _run_job(job: Job):
+    # Child process: its own process group (so its worker pools are measured and stopped with it),
+    # output appended to the job's log
+    if hasattr(os, 'setpgrp'):
+        os.setpgrp()
+    os.makedirs(os.path.dirname(job.log_path), exist_ok=True)
+    log = open(job.log_path, 'a', buffering=1)
+    os.dup2(log.fileno(), sys.stdout.fileno())
+    os.dup2(log.fileno(), sys.stderr.fileno())
+    sys.stdout.reconfigure(line_buffering=True)
+    print(f"===== {job.name}: attempt started {time.strftime('%Y-%m-%d %H:%M:%S')} =====", flush=True)
+    written = run_pipeline(job.config)
+    sys.stdout.flush()
+    sys.exit(0 if written is not None else 1)
+
+def _stop(process):
+    if hasattr(os, 'killpg'):
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+            return
+        except ProcessLookupError:
+            pass
+    process.kill()
+
+
+@click.command()
+@click.argument("manifest", type=click.Path(exists=True, dir_okay=False))
+@click.option("--workers", default=1, show_default=True, help="Cities run at the same time.")
+@click.option("--memory-gb", type=float, default=None, help="Memory shared by the running cities (default: no limit).")
+@click.option("--job-memory-gb", type=float, default=DEFAULT_JOB_MEMORY_GB, show_default=True,
+              help="Budget of a city without memory_gb in the manifest.")
+@click.option("--only", default=None, help="Comma-separated city names to run.")
+@click.option("--retries", default=0, show_default=True, help="Times a crashed city is resumed from its last checkpoint.")
+@click.option("--restart", is_flag=True, help="Discard every checkpoint and run all stages again.")
+def cli(manifest, workers, memory_gb, job_memory_gb, only, retries, restart):
+    """Run the pipeline for every city in MANIFEST, resuming unfinished cities from their checkpoints."""
+    try:
+        jobs = load_manifest(manifest, job_memory_gb=job_memory_gb)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    if only is not None:
+        names = set(only.split(","))
+        unknown = sorted(names - {job.name for job in jobs})
+        if unknown:
+            raise click.BadParameter(f"unknown cities {unknown}", param_hint="--only")
+        jobs = [job for job in jobs if job.name in names]
+    if restart:
+        for job in jobs:
+            path = os.path.join(job.config.checkpoint_dir, "checkpoints.json")
+            if os.path.exists(path):
+                os.remove(path)
+
+    status = run_batch(jobs, workers=workers, memory_gb=memory_gb, retries=retries)
+    failed = sorted(name for name, outcome in status.items() if outcome not in ('ok', 'complete'))
+    print(f"{len(status) - len(failed)}/{len(status)} cities complete" + (f"; failed: {', '.join(failed)}" if failed else ""))
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    cli()
+
+# python -m scripts.run_batch cities.json --workers 4 --memory-gb 48
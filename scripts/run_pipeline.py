@@ -1,103 +1,375 @@
 import os
+import numpy as np
 import geopandas as gpd
+from typing import NamedTuple, Optional
 from pyproj import CRS
 from shapely.geometry import box
 
 from gtfs_pipeline.processor import concat_dataframes
-from gtfs_pipeline.network import download_walknetwork, compute_isochrones
-from gtfs_pipeline.analysis import stop_significance
+from gtfs_pipeline.network import (
+    get_walknetwork, compute_isochrones, compute_isochrones_cached, walknetwork_cached, load_walknetwork_cached
+)
+from gtfs_pipeline.cache import DiskCache, cache_key
+from gtfs_pipeline.checkpoint import Checkpoints
+from gtfs_pipeline.context import StudyContext
+from gtfs_pipeline.analysis import stop_significance, AMENITY_SCORES_PATH, AMENITY_INVENTORY_PATH
 from gtfs_pipeline.results import combine_scores, persist_and_plot
+from gtfs_pipeline.incremental import incremental_scores
+from gtfs_pipeline.metrics import RunMetrics
 
 
-def main():
-    # GTFS directory
-    dl_dir = "data/gtfs"
+class PipelineConfig(NamedTuple):
+    # GTFS directory (every .zip in it is one feed)
+    gtfs_dir: str = "data/gtfs"
 
+    # POINTS_EPSG4326.geojson - GeoJSON of points extracted from the ./../../step1_loader step.
+    # LINE_EPSG4326.geojson - GeoJSON of road segments extracted from the ./../../step1_loader step.
+    points_path: str = "data/POINT_EPSG4326.geojson"
+    roads_path: str = "data/LINE_EPSG4326.geojson"
+
+    # Amenity scores and stop inventory used for the Q factor (None or a missing file = no amenity data)
+    amenity_scores_path: Optional[str] = AMENITY_SCORES_PATH
+    amenity_inventory_path: Optional[str] = AMENITY_INVENTORY_PATH
+
+    # Maps and score files are written here
+    output_dir: str = "data/output"
+
+    # Worker processes used to parse GTFS feeds (1 = one feed at a time)
+    gtfs_workers: int = 1
+
+    # On-disk cache for parsed feeds, walk networks and isochrones (None disables caching)
+    cache_dir: Optional[str] = "data/cache"
+    cache_max_bytes: int = 5 * 2**30
+
+    # Walk network source: None downloads from Overpass, or a local .graphml/.osm/.osm.pbf extract
+    walk_network_path: Optional[str] = None
+
+    # Worker processes for the isochrone traversal (1 = single process)
+    isochrone_workers: int = 1
+
+    # Catchment shape: 'convex' (hull of the reached nodes), 'edges' (reached street edges buffered by 25 m,
+    # most accurate on sparse networks, slowest) or 'concave' (concave hull of the reached edges)
+    catchment: str = "convex"
+
+    # Spacing in metres of the sample points along each street
+    sample_interval: float = 10
+
+    # Street scoring engine: 'vector' (exact point-in-isochrone join), 'raster' (summed significance grid)
+    # or 'network' (stops within 700 m walk of each sample point's nearest node, no isochrone polygons)
+    scoring_engine: str = "vector"
+    raster_resolution: float = 20
+
+    # Distance decay of each stop's significance: None (every stop in the catchment counts fully), 'linear' or
+    # 'gaussian'; score_decay_m is the scale in metres (None = 700 linear / 350 gaussian). Vector and network engines
+    score_decay: Optional[str] = None
+    score_decay_m: Optional[float] = None
+
+    # Score streets in square tiles of this many metres to bound memory on large cities (None = all at once)
+    scoring_tile_size: Optional[float] = None
+
+    # Keep per-stop significance and per-point contributions here and only re-score what changed
+    # since the previous run (exact, vector engine; None = always score everything)
+    incremental_state_dir: Optional[str] = None
+
+    # Extra time-of-day windows scored next to the weekday peak, as *_<window> columns
+    # (e.g. gtfs_pipeline.analysis.TIME_WINDOWS: am_peak, midday, pm_peak, evening, weekend; () = peak only)
+    time_windows: tuple = ()
+
+    # Output files: 'parquet' (GeoParquet) and 'fgb' (FlatGeobuf), both spatially indexed;
+    # add 'geojson' / 'csv' for the legacy formats. Partition by "tag", "tile" or a column (None = one file)
+    output_formats: tuple = ("parquet", "fgb")
+    output_partition_by: Optional[str] = None
+
+    # Map: 'geojson' (one styled layer), 'polyline' (legacy, one line per street) or 'tiles'
+    # (PMTiles + MapLibre viewer, needs tippecanoe; open with gtfs_pipeline.plot.serve_map)
+    plot_mode: str = "geojson"
+    plot_simplify_m: Optional[float] = None
+    plot_precision: int = 5
+
+    # Per-stage wall/CPU time, peak RSS and row counts are written here as run_<id>.json / .csv (None = off).
+    # profile: None, "cprofile" or "tracemalloc" for profile_stages (None = every stage)
+    metrics_dir: Optional[str] = "data/output/metrics"
+    profile: Optional[str] = None
+    profile_stages: Optional[tuple] = None
+
+    # Each finished stage is saved here, and a rerun with the same inputs and settings resumes
+    # after the last one instead of starting over (None = off)
+    checkpoint_dir: Optional[str] = None
+
+
+# Top-level stages in run order; each one is checkpointed as a whole
+STAGES = ("concat_dataframes", "study_area", "compute_isochrones", "stop_significance", "combine_scores", "persist_and_plot")
+
+# Settings that change how a run is carried out, not what it produces
+RUNTIME_SETTINGS = ('gtfs_workers', 'isochrone_workers', 'metrics_dir', 'profile', 'profile_stages', 'checkpoint_dir')
+
+
+def main(config: PipelineConfig = PipelineConfig()):
+    # Runs every stage of one study area; returns the written output files, or None when scoring failed
+    check_config(config)
+    metrics = RunMetrics(config.metrics_dir, profile=config.profile, profile_stages=config.profile_stages)
+    checkpoints = Checkpoints(config.checkpoint_dir, run_key(config)) if config.checkpoint_dir is not None else None
+
+    state = {}
+    for name, run in zip(STAGES, (_gtfs, _study_area, _isochrones, _significance, _scores, _persist)):
+        if checkpoints is not None and checkpoints.done(name):
+            state.update(checkpoints.load(name))
+            print(f"✅ {name} restored from checkpoint")
+        else:
+            try:
+                outputs = run(config, metrics, state)
+            except ValueError as e:
+                if name != "combine_scores":
+                    raise
+                print(f"❌ Scoring failed: {e}")
+                metrics.write()
+                return None
+            state.update(outputs)
+            # Underscored outputs (an uncached walk network, the study context) are only kept in memory
+            if checkpoints is not None:
+                checkpoints.save(name, {k: v for k, v in outputs.items() if not k.startswith('_')})
+        if 'tag' in state:
+            metrics.meta['tag'] = state['tag']
+
+    report = metrics.write()
+    if report:
+        print(f"✅ Run metrics written to {report[0]}")
+    return state['written']
+
+def check_config(config: PipelineConfig):
+    # Incremental runs always score with the exact vector join, untiled and without decay
+    if config.incremental_state_dir is not None:
+        unsupported = [
+            f"{name}={value!r}" for name, value, default in (
+                ('scoring_engine', config.scoring_engine, "vector"),
+                ('scoring_tile_size', config.scoring_tile_size, None),
+                ('score_decay', config.score_decay, None),
+            ) if value != default
+        ]
+        if unsupported:
+            raise ValueError(f"incremental_state_dir does not support {', '.join(unsupported)}")
+
+def run_key(config: PipelineConfig) -> str:
+    # Settings plus the path, size and mtime of every input file: what a run's results depend on
+    def _stat(path):
+        if path is None or not os.path.exists(path):
+            return None
+        if os.path.isdir(path):
+            return sorted(_stat(os.path.join(path, name)) for name in os.listdir(path) if name.endswith(".zip"))
+        stat = os.stat(path)
+        return [os.path.abspath(path), stat.st_size, stat.st_mtime_ns]
+
+    settings = {k: v for k, v in config._asdict().items() if k not in RUNTIME_SETTINGS}
+    inputs = {k: _stat(settings[k]) for k in ('gtfs_dir', 'points_path', 'roads_path', 'amenity_scores_path',
+                                              'amenity_inventory_path', 'walk_network_path')}
+    return cache_key(settings=settings, inputs=inputs)
+
+def amenity_cache_path(config: PipelineConfig) -> Optional[str]:
+    # One parsed amenity store per pair of source files, so cities sharing a cache never read each other's
+    if config.cache_dir is None:
+        return None
+    key = cache_key(**{name: None if path is None else os.path.abspath(path) for name, path in
+                       (('scores', config.amenity_scores_path), ('inventory', config.amenity_inventory_path))})
+    return os.path.join(config.cache_dir, "amenities", f"{key}.parquet")
+
+
+##--------------------------------------------------------------------------
+## Stages: each reads the outputs of the earlier ones from state and returns its own
+##--------------------------------------------------------------------------
+
+def _gtfs(config, metrics, state):
     # GTFS Data Cleaning
-    sched_merged, stops_bymode, tag = concat_dataframes(dl_dir)
+    with metrics.stage("concat_dataframes") as stage:
+        sched_merged, stops_bymode, tag = concat_dataframes(
+            config.gtfs_dir, n_workers=config.gtfs_workers, cache_dir=config.cache_dir, cache_max_bytes=config.cache_max_bytes
+        )
+        stage.count(schedule_rows=len(sched_merged), stops=len(stops_bymode))
     print("Processing Data Complete")
+    return dict(sched_merged=sched_merged, stops_bymode=stops_bymode, tag=tag)
 
-    # Study Area
-    # POINTS_EPSG4326.geojson - GeoJSON of points extracted from the ./../../step1_loader step.
-    # LINE_EPSG4326.geojson - GeoJSON of road segments extracted from the ./../../step1_loader step.
-    points_gdf = gpd.read_file("data/POINT_EPSG4326.geojson")
-    roads_gdf = gpd.read_file("data/LINE_EPSG4326.geojson")
-    roads_gdf = (
-        roads_gdf[roads_gdf['link_id'].isin(points_gdf['link_id'])]
-        .drop_duplicates(subset='link_id')
-        .reset_index(drop=True)
-    )
-
-    print("Study Area Load")
-
-    # Check Existence of Bus or Subway
-    has_bus = 3 in stops_bymode['route_type'].unique()
-    has_rail = stops_bymode['route_type'].isin({0,1,2,5,12}).any()
-    if has_bus and has_rail:
-        print("✅ Both bus and rail stops are available.")
-    elif not has_bus and has_rail:
-        print("⚠️ No bus stops found in this city.")
-    elif has_bus and not has_rail:
-        print("⚠️ No rail stops found in this city.")
-    print(f"{len(stops_bymode)} Stops will be processed")
-
-    # Calculate UTM zone
-    streets = roads_gdf.copy()
-    first_geom = streets.geometry.iloc[0]
-    lon, lat = first_geom.coords[0]
-    zone = int((lon + 180) // 6) + 1
-    epsg = (32600 if lat >= 0 else 32700) + zone
-    target_crs = CRS.from_epsg(epsg)
-    streets = streets.to_crs(target_crs)
-
-    # Compute midpoints of each street segment
-    streets['midpoint'] = streets.geometry.interpolate(streets.geometry.length / 2)
-    points_gdf = gpd.GeoDataFrame(streets.drop(columns='geometry'), 
-                                geometry=streets['midpoint'], 
-                                crs=target_crs)
-    
-    # Compute buffer around midpoints
-    buffer_geom = points_gdf.buffer(750).union_all()
-    streets_buffer = gpd.GeoDataFrame(
-        geometry=[buffer_geom],
-        crs=points_gdf.crs
-    ).to_crs(epsg=4326)
-    print(f"Data is ready")
-    
-    # Filter stops within the buffer
-    stops_within_iso = gpd.sjoin(stops_bymode, streets_buffer, how="inner", predicate='intersects')
-    stops_within_iso = stops_within_iso.drop_duplicates(subset=['stop_id']).reset_index(drop=True)
+def _study_area(config, metrics, state):
+    stops_bymode = state['stops_bymode']
+    with metrics.stage("study_area") as stage:
+        # Study Area
+        points_gdf = gpd.read_file(config.points_path)
+        roads_gdf = gpd.read_file(config.roads_path)
+        roads_gdf = (
+            roads_gdf[roads_gdf['link_id'].isin(points_gdf['link_id'])]
+            .drop_duplicates(subset='link_id')
+            .reset_index(drop=True)
+        )
+
+        print("Study Area Load")
 
+        # Check Existence of Bus or Subway
+        has_bus = 3 in stops_bymode['route_type'].unique()
+        has_rail = stops_bymode['route_type'].isin({0,1,2,5,12}).any()
+        if has_bus and has_rail:
+            print("✅ Both bus and rail stops are available.")
+        elif not has_bus and has_rail:
+            print("⚠️ No bus stops found in this city.")
+        elif has_bus and not has_rail:
+            print("⚠️ No rail stops found in this city.")
+        print(f"{len(stops_bymode)} Stops will be processed")
+
+        # Calculate UTM zone
+        streets = roads_gdf.copy()
+        first_geom = streets.geometry.iloc[0]
+        lon, lat = first_geom.coords[0]
+        zone = int((lon + 180) // 6) + 1
+        epsg = (32600 if lat >= 0 else 32700) + zone
+        target_crs = CRS.from_epsg(epsg)
+        streets = streets.to_crs(target_crs)
+
+        # Compute midpoints of each street segment
+        streets['midpoint'] = streets.geometry.interpolate(streets.geometry.length / 2)
+        points_gdf = gpd.GeoDataFrame(streets.drop(columns='geometry'),
+                                    geometry=streets['midpoint'],
+                                    crs=target_crs)
+
+        # Compute buffer around midpoints; the streets and the buffer are shared with the later stages
+        buffer_geom = points_gdf.buffer(750).union_all()
+        context = StudyContext(target_crs, streets=streets)
+        context.add('study_area', gpd.GeoDataFrame(geometry=[buffer_geom], crs=target_crs))
+        streets_buffer = context.layer('study_area', "EPSG:4326")
+        print(f"Data is ready")
+
+        # Filter stops within the buffer
+        context.add('stops', stops_bymode, crs=stops_bymode.crs)
+        rows, _ = context.intersects('stops', 'study_area', crs=stops_bymode.crs)
+        stops_within_iso = stops_bymode.iloc[np.unique(rows)].drop_duplicates(subset=['stop_id']).reset_index(drop=True)
+        context.add('stops_within', stops_within_iso, crs=stops_within_iso.crs)
+        stage.count(streets=len(streets), stops_within=len(stops_within_iso))
+    return dict(streets=streets, target_crs=target_crs, streets_buffer=streets_buffer, stops_within_iso=stops_within_iso,
+                _context=context)
+
+def study_context(state) -> StudyContext:
+    # The StudyContext of the study_area stage, rebuilt from its outputs when that stage was restored from a checkpoint
+    if '_context' not in state:
+        context = StudyContext(state['target_crs'], streets=state['streets'])
+        context.add('study_area', state['streets_buffer'], crs=state['streets_buffer'].crs)
+        context.add('stops_within', state['stops_within_iso'], crs=state['stops_within_iso'].crs)
+        state['_context'] = context
+    return state['_context']
+
+def _isochrones(config, metrics, state):
     # Download Walkable Network and Compute Isochrones
-    walk_network = download_walknetwork(streets_buffer)
-    isos_700_rail, isos_700_bus, isos_100_rail = compute_isochrones(stops_within_iso, walk_network)
+    stops_within_iso, streets_buffer = state['stops_within_iso'], state['streets_buffer']
+    walk_network = None
+    if config.cache_dir is not None:
+        # The cached path loads the walk network lazily, so both are timed together
+        with metrics.stage("compute_isochrones") as stage:
+            cache = DiskCache(config.cache_dir, max_bytes=config.cache_max_bytes)
+            isos_700_rail, isos_700_bus, isos_100_rail = compute_isochrones_cached(
+                stops_within_iso, streets_buffer, cache, source=config.walk_network_path,
+                n_workers=config.isochrone_workers, catchment=config.catchment,
+            )
+            stage.count(isochrones_700_bus=len(isos_700_bus), isochrones_700_rail=len(isos_700_rail), isochrones_100_rail=len(isos_100_rail))
+    else:
+        with metrics.stage("download_walknetwork") as stage:
+            walk_network = get_walknetwork(streets_buffer, source=config.walk_network_path)
+            stage.count(nodes=walk_network.number_of_nodes(), edges=walk_network.number_of_edges())
+        with metrics.stage("compute_isochrones") as stage:
+            isos_700_rail, isos_700_bus, isos_100_rail = compute_isochrones(stops_within_iso, walk_network, n_workers=config.isochrone_workers, catchment=config.catchment)
+            stage.count(isochrones_700_bus=len(isos_700_bus), isochrones_700_rail=len(isos_700_rail), isochrones_100_rail=len(isos_100_rail))
+    return dict(isos_700_rail=isos_700_rail, isos_700_bus=isos_700_bus, isos_100_rail=isos_100_rail, _walk_network=walk_network)
 
-    # Bus Stops Significance, Rail Stations Significance Calculation
-    bus_iso_scored, rail_iso_scored = stop_significance(stops_within_iso, stops_bymode, isos_100_rail, isos_700_bus, isos_700_rail, sched_merged, target_crs, tag) if has_bus else None
+def _significance(config, metrics, state):
+    # Bus Stops Significance, Rail Stations Significance Calculation (incremental runs do it while scoring)
+    if config.incremental_state_dir is not None:
+        return {}
+    with metrics.stage("stop_significance") as stage:
+        bus_iso_scored, rail_iso_scored = stop_significance(
+            state['stops_within_iso'], state['stops_bymode'], state['isos_100_rail'], state['isos_700_bus'],
+            state['isos_700_rail'], state['sched_merged'], state['target_crs'], state['tag'],
+            amenity_scores_path=config.amenity_scores_path,
+            amenity_inventory_path=config.amenity_inventory_path,
+            amenity_cache_path=amenity_cache_path(config),
+            time_windows=config.time_windows,
+            context=study_context(state),
+        )
+        stage.count(bus_stops=len(bus_iso_scored), rail_stops=len(rail_iso_scored))
     print("Computing Significance is Completed")
-    
-    # 9) Scoring, Plot
-    minx, miny, maxx, maxy = stops_bymode.total_bounds
+    return dict(bus_iso_scored=bus_iso_scored, rail_iso_scored=rail_iso_scored)
+
+def _scores(config, metrics, state):
+    # The network engine walks the graph the isochrones were built on
+    walk_graph = None
+    if config.scoring_engine == "network" and config.incremental_state_dir is None:
+        if config.cache_dir is None:
+            walk_graph = state.get('_walk_network')
+            if walk_graph is None:
+                walk_graph = get_walknetwork(state['streets_buffer'], source=config.walk_network_path)
+        else:
+            cache = DiskCache(config.cache_dir, max_bytes=config.cache_max_bytes)
+            graph_key, _ = walknetwork_cached(state['streets_buffer'], cache, source=config.walk_network_path)
+            walk_graph = load_walknetwork_cached(cache, graph_key)
+
+    with metrics.stage("combine_scores") as stage:
+        if config.incremental_state_dir is not None:
+            # Only the stops and street links touched since the previous run are recomputed
+            _, _, bus_rail_attributes, bus_rail_score = incremental_scores(
+                config.incremental_state_dir, state['stops_within_iso'], state['stops_bymode'], state['isos_100_rail'],
+                state['isos_700_bus'], state['isos_700_rail'], state['sched_merged'], state['target_crs'], state['tag'],
+                state['streets'],
+                sample_interval=config.sample_interval,
+                amenity_scores_path=config.amenity_scores_path,
+                amenity_inventory_path=config.amenity_inventory_path,
+                amenity_cache_path=amenity_cache_path(config),
+                time_windows=config.time_windows,
+            )
+            print("Computing Significance is Completed")
+        else:
+            bus_rail_attributes, bus_rail_score = combine_scores(
+                state['bus_iso_scored'],
+                state['rail_iso_scored'],
+                state['streets'],
+                sample_interval=config.sample_interval,
+                engine=config.scoring_engine,
+                raster_resolution=config.raster_resolution,
+                tile_size=config.scoring_tile_size,
+                walk_graph=walk_graph,
+                stops=state['stops_within_iso'],
+                n_workers=config.isochrone_workers,
+                decay=config.score_decay,
+                decay_scale=config.score_decay_m,
+                context=study_context(state),
+            )
+        stage.count(
+            links=len(bus_rail_attributes),
+            sample_points=bus_rail_attributes.attrs.get('sample_points'),
+            joined_rows=bus_rail_attributes.attrs.get('joined_rows'),
+        )
+    print("Scoring Each Street Complete ('Score' Column) + Geometry is allocated")
+    return dict(bus_rail_attributes=bus_rail_attributes, bus_rail_score=bus_rail_score)
+
+def _persist(config, metrics, state):
+    # Plot and score files over the bounding box of every stop
+    minx, miny, maxx, maxy = state['stops_bymode'].total_bounds
     bbox_geom = box(minx, miny, maxx, maxy)
-    bbox_gdf = gpd.GeoDataFrame(geometry=[bbox_geom], crs=stops_bymode.crs)
-    try:
-        bus_rail_attributes, bus_rail_score = combine_scores(
-            bus_iso_scored,
-            rail_iso_scored,
-            streets
+    bbox_gdf = gpd.GeoDataFrame(geometry=[bbox_geom], crs=state['stops_bymode'].crs)
+    with metrics.stage("persist_and_plot") as stage:
+        written = persist_and_plot(
+            place_geometry=bbox_gdf,
+            bus_rail_attributes=state['bus_rail_attributes'],
+            bus_rail_score=state['bus_rail_score'],
+            output_dir=config.output_dir,
+            formats=config.output_formats,
+            partition_by=config.output_partition_by,
+            tag=state['tag'],
+            plot_mode=config.plot_mode,
+            simplify_tolerance=config.plot_simplify_m,
+            precision=config.plot_precision,
+            stops=state['stops_within_iso'],
+            context=study_context(state),
         )
-        print("Scoring Each Street Complete ('Score' Column) + Geometry is allocated")
-    except ValueError as e:
-        print(f"❌ Scoring failed: {e}")
-        return
-
-    persist_and_plot(
-        place_geometry=bbox_gdf,
-        bus_rail_attributes=bus_rail_attributes,
-        bus_rail_score = bus_rail_score
-    )
+        stage.count(files=len(written))
     print("Maps are prepared, and saved in the output folder.")
+    return dict(written=written)
+
 
-final_score = main()
+if __name__ == "__main__":
+    main()
 
-# python -m scripts.run_pipeline
\ No newline at end of file
+# python -m scripts.run_pipeline
+# Several cities: python -m scripts.run_batch <manifest.json> (see scripts/run_batch.py)
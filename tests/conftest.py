@@ -0,0 +1,42 @@
+import pytest
+
+from benchmarks.synthetic import BASE_SCALE, gtfs_zip, grid_walk_graph, street_layer
+from gtfs_pipeline.processor import process_single_gtfs_zip, stops_bymodes
+from gtfs_pipeline.network import compute_isochrones
+from gtfs_pipeline.analysis import stop_significance, TIME_WINDOWS
+
+TAG = "test"
+
+
+@pytest.fixture(scope="session")
+def feed(tmp_path_factory):
+    # (merged schedule, stops by mode) of the 1x synthetic city
+    path = gtfs_zip(str(tmp_path_factory.mktemp("gtfs") / "gtfs.zip"), BASE_SCALE)
+    merged, stops, *_ = process_single_gtfs_zip(path, TAG)
+    return merged, stops_bymodes(merged, stops)
+
+@pytest.fixture(scope="session")
+def walk_graph():
+    return grid_walk_graph(BASE_SCALE)
+
+@pytest.fixture(scope="session")
+def isochrones(feed, walk_graph):
+    # (700 m rail, 700 m bus, 100 m rail) isochrones of every stop, serial and uncached
+    _, stops = feed
+    return compute_isochrones(stops, walk_graph)
+
+@pytest.fixture(scope="session")
+def streets(walk_graph):
+    # Street links in their UTM zone, as the study_area stage projects them
+    lines = street_layer(walk_graph, BASE_SCALE.n_streets)
+    return lines.to_crs(lines.estimate_utm_crs())
+
+@pytest.fixture(scope="session")
+def scored_isochrones(feed, isochrones, streets):
+    # (bus, rail) isochrones with the significance of their stops in every time window, without amenity data
+    merged, stops = feed
+    isos_700_rail, isos_700_bus, isos_100_rail = isochrones
+    return stop_significance(
+        stops, stops, isos_100_rail, isos_700_bus, isos_700_rail, merged, streets.crs, TAG,
+        amenity_scores_path=None, amenity_inventory_path=None, time_windows=TIME_WINDOWS,
+    )
@@ -0,0 +1,50 @@
+import os
+import multiprocessing as mp
+
+from gtfs_pipeline.cache import DiskCache
+
+
+def _hold(root, ready, done):
+    # Another job: reads an entry, then keeps running until told to stop
+    assert DiskCache(root).get('graphs', 'held', 'graphml') is not None
+    ready.set()
+    done.wait(30)
+
+def _entry(cache, key, size=1000):
+    with cache.writing('graphs', key, 'graphml') as tmp:
+        with open(tmp, 'wb') as f:
+            f.write(b'x' * size)
+    return cache.path('graphs', key, 'graphml')
+
+def test_evict_keeps_entries_another_process_uses(tmp_path):
+    cache = DiskCache(str(tmp_path), max_bytes=0)
+    held, other = _entry(cache, 'held'), _entry(cache, 'other')
+
+    context = mp.get_context("spawn")
+    ready, done = context.Event(), context.Event()
+    job = context.Process(target=_hold, args=(str(tmp_path), ready, done))
+    job.start()
+    try:
+        assert ready.wait(30)
+        cache.evict()
+        cache.remove('graphs', 'held', 'graphml')
+        assert os.path.exists(held) and not os.path.exists(other)
+    finally:
+        done.set()
+        job.join()
+
+    # Released once that job has exited
+    cache.evict()
+    assert not os.path.exists(held)
+
+def test_write_leaves_no_partial_entry(tmp_path):
+    cache = DiskCache(str(tmp_path))
+    try:
+        with cache.writing('nodes', 'key', 'parquet') as tmp:
+            with open(tmp, 'wb') as f:
+                f.write(b'partial')
+            raise RuntimeError("crashed mid-write")
+    except RuntimeError:
+        pass
+    assert cache.get('nodes', 'key', 'parquet') is None
+    assert os.listdir(tmp_path / 'nodes') == []
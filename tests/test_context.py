@@ -0,0 +1,94 @@
+import geopandas as gpd
+import pandas as pd
+import pytest
+import shapely
+
+from benchmarks.synthetic import BASE_SCALE, street_layer
+from gtfs_pipeline.analysis import (
+    stop_significance, bus_compute_factor_s, rail_compute_factor_s, factor_s_context, TIME_WINDOWS,
+)
+from gtfs_pipeline.metrics import RunMetrics
+from gtfs_pipeline.results import combine_scores, link_sources
+from scripts.run_pipeline import PipelineConfig, _study_area, study_context
+
+from tests.conftest import TAG
+
+RAIL_TYPES = [0, 1, 2, 5, 12]
+
+
+@pytest.fixture(scope="module")
+def study_area(feed, walk_graph, tmp_path_factory):
+    # The study_area stage run on the synthetic streets (its outputs, including the shared context)
+    _, stops = feed
+    roads = street_layer(walk_graph, BASE_SCALE.n_streets)
+    folder = tmp_path_factory.mktemp("study_area")
+    roads.to_file(folder / "LINE.geojson")
+    # Only the link ids of the point layer are read
+    roads.assign(geometry=shapely.line_interpolate_point(roads.geometry.values, 0.5, normalized=True)).to_file(folder / "POINT.geojson")
+    config = PipelineConfig(points_path=str(folder / "POINT.geojson"), roads_path=str(folder / "LINE.geojson"))
+    return _study_area(config, RunMetrics(verbose=False), {'stops_bymode': stops})
+
+def test_study_area_stops_match_sjoin(feed, study_area):
+    _, stops = feed
+    expected = (
+        gpd.sjoin(stops, study_area['streets_buffer'], how="inner", predicate='intersects')
+        .drop(columns='index_right')
+        .drop_duplicates(subset=['stop_id'])
+        .reset_index(drop=True)
+    )
+    assert 0 < len(expected) <= len(stops)
+    pd.testing.assert_frame_equal(study_area['stops_within_iso'], expected)
+
+def test_restored_context_matches_the_stage(study_area):
+    # Resuming after a checkpointed study_area rebuilds the same layers
+    restored = study_context({k: v for k, v in study_area.items() if k != '_context'})
+    for name in ('streets', 'study_area', 'stops_within'):
+        a, b = restored.layer(name, "EPSG:4326"), study_area['_context'].layer(name, "EPSG:4326")
+        pd.testing.assert_frame_equal(pd.DataFrame(a), pd.DataFrame(b))
+
+def test_factor_s_shared_context_matches_separate_runs(feed, isochrones):
+    # Both factors answering from one factor_s_context, as stop_significance runs them
+    _, stops = feed
+    bus, rail, isos_100_rail = stops[stops['route_type'] == 3], stops[stops['route_type'].isin(RAIL_TYPES)], isochrones[2]
+    crs = bus.estimate_utm_crs()
+    context = factor_s_context(bus, bus, rail, isos_100_rail, crs)
+    pd.testing.assert_frame_equal(bus_compute_factor_s(bus, bus, rail, isos_100_rail, crs, context=context),
+                                  bus_compute_factor_s(bus, bus, rail, isos_100_rail, crs))
+    pd.testing.assert_frame_equal(rail_compute_factor_s(stops, isos_100_rail, context=context),
+                                  rail_compute_factor_s(stops, isos_100_rail))
+
+def _significance(feed, isochrones, study_area, context=None):
+    merged, stops = feed
+    isos_700_rail, isos_700_bus, isos_100_rail = isochrones
+    return stop_significance(
+        study_area['stops_within_iso'], stops, isos_100_rail, isos_700_bus, isos_700_rail, merged,
+        study_area['target_crs'], TAG, amenity_scores_path=None, amenity_inventory_path=None,
+        time_windows=TIME_WINDOWS, context=context,
+    )
+
+def test_significance_with_run_context(feed, isochrones, study_area):
+    expected = _significance(feed, isochrones, study_area)
+    for a, b in zip(_significance(feed, isochrones, study_area, context=study_area['_context']), expected):
+        pd.testing.assert_frame_equal(a, b)
+
+@pytest.mark.parametrize("settings", [
+    dict(engine='vector'), dict(engine='vector', tile_size=1000.0), dict(engine='vector', decay='linear'),
+    dict(engine='raster'),
+])
+def test_scores_with_run_context(feed, isochrones, study_area, settings):
+    bus, rail = _significance(feed, isochrones, study_area)
+    streets, stops = study_area['streets'], study_area['stops_within_iso']
+    expected = combine_scores(bus, rail, streets, stops=stops, **settings)
+    actual = combine_scores(bus, rail, streets, stops=stops, context=study_area['_context'], **settings)
+    for a, b in zip(actual, expected):
+        pd.testing.assert_frame_equal(a, b)
+
+def test_link_sources_with_run_context(feed, isochrones, study_area):
+    bus, rail = _significance(feed, isochrones, study_area)
+    _, score = combine_scores(bus, rail, study_area['streets'])
+    # Stops from ten feeds, so neighbouring links fall under different tags
+    stops = study_area['stops_within_iso'].assign(source=lambda df: df['stop_id'].str[-1])
+    context = study_context({**{k: v for k, v in study_area.items() if k != '_context'}, 'stops_within_iso': stops})
+    expected = link_sources(score, stops, default="none")
+    assert len(set(expected)) > 1
+    assert (link_sources(score, stops, default="none", context=context) == expected).all()
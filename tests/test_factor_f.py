@@ -0,0 +1,84 @@
+from functools import reduce
+
+import pandas as pd
+import pytest
+
+from gtfs_pipeline.analysis import compute_factor_f, calendar_varies, calendar_idle, score_f
+
+RAIL_TYPES = [0, 1, 2, 5, 12]
+
+
+def legacy_schedule(sched):
+    # The schedule as the original parser left it: HH:MM:SS strings and plain object ids
+    sched = sched.copy()
+    for col in ('arrival_time', 'departure_time'):
+        seconds = sched[col].astype('Int64')
+        sched[col] = [None if pd.isna(t) else f"{t // 3600:02d}:{t // 60 % 60:02d}:{t % 60:02d}" for t in seconds]
+    return sched.astype({col: str for col in ('stop_id', 'route_id', 'service_id')})
+
+def reference_factor_f(sched, all_stop_ids=None):
+    # The per-weekday implementation the single-pass compute_factor_f replaced, on a legacy_schedule
+    weekdays = ['monday', 'tuesday', 'wednesday', 'thursday', 'friday']
+    daily_rates = []
+    sched = sched.copy()
+    sched['arr_td'] = pd.to_timedelta(sched['arrival_time'])
+    sched['dep_td'] = pd.to_timedelta(sched['departure_time'])
+    for day in weekdays:
+        col = sched.get(day)
+        df_day = sched.copy() if col is None or col.dropna().nunique() <= 1 else sched[col == 1].copy()
+        df_day = df_day.drop_duplicates(subset=['stop_id', 'route_id', 'arr_td', 'dep_td']).dropna(subset=['arr_td'])
+        secs = df_day['arr_td'].dt.total_seconds().astype(int)
+        is_peak = secs.between(6 * 3600, 9 * 3600, inclusive='left') | secs.between(16 * 3600, 19 * 3600, inclusive='left')
+        df_peak = df_day[is_peak]
+        group_cols = ['stop_id', 'route_id', 'service_id']
+        if 'direction_id' in df_peak.columns:
+            group_cols.insert(2, 'direction_id')
+        span = df_peak.groupby(group_cols).size().reset_index(name='count_peak')
+        span['rate_h'] = span['count_peak'] / 6.0
+        daily_rates.append(span.groupby(['stop_id', 'route_id'])['rate_h'].mean().reset_index(name=f'rate_{day}'))
+
+    rates = reduce(lambda L, R: L.merge(R, on=['stop_id', 'route_id'], how='outer'), daily_rates)
+    rates['avg_weekday_rate'] = rates[[f'rate_{d}' for d in weekdays]].mean(axis=1).fillna(0)
+    factor_f = rates.groupby('stop_id')['avg_weekday_rate'].mean().reset_index(name='stop_rate_h')
+    if all_stop_ids is None:
+        all_stop_ids = pd.Index(sched['stop_id'].unique())
+    factor_f = pd.DataFrame({'stop_id': all_stop_ids}).merge(factor_f, on='stop_id', how='left')
+    factor_f['stop_rate_h'] = factor_f['stop_rate_h'].fillna(0.0)
+    factor_f['factor_f'] = factor_f['stop_rate_h'].apply(score_f)
+    return factor_f
+
+def _modes(merged):
+    return {'bus': merged[merged['route_type'] == 3], 'rail': merged[merged['route_type'].isin(RAIL_TYPES)]}
+
+def assert_same_peak(sched, all_stop_ids=None):
+    expected = reference_factor_f(legacy_schedule(sched), None if all_stop_ids is None else all_stop_ids.astype(str))
+    actual = compute_factor_f(sched, all_stop_ids=all_stop_ids, varying_days=calendar_varies(sched), idle_days=calendar_idle(sched))
+    actual = actual.astype({'stop_id': str})
+    assert len(expected) and (expected['stop_rate_h'] > 0).any()
+    pd.testing.assert_frame_equal(
+        actual[['stop_id', 'stop_rate_h', 'factor_f']].reset_index(drop=True),
+        expected[['stop_id', 'stop_rate_h', 'factor_f']].reset_index(drop=True),
+    )
+
+@pytest.mark.parametrize("mode", ['bus', 'rail'])
+def test_peak_matches_reference(feed, mode):
+    merged, stops = feed
+    sched = _modes(merged)[mode]
+    assert_same_peak(sched)
+    # Stops without peak service score 0 trips
+    assert_same_peak(sched, all_stop_ids=pd.Index(stops['stop_id'].unique()))
+
+def test_times_past_midnight_match_reference(feed):
+    # Trips running past 24:00 on the previous service day
+    merged, _ = feed
+    sched = _modes(merged)['bus'].copy()
+    late = sched.index[::7]
+    for col in ('arrival_time', 'departure_time'):
+        sched.loc[late, col] += 18 * 3600
+    assert_same_peak(sched)
+
+def test_constant_calendar_matches_reference(feed):
+    # Calendar columns with a single value count every trip on that day
+    merged, _ = feed
+    sched = _modes(merged)['bus'].assign(**{day: 1 for day in ('monday', 'tuesday', 'wednesday', 'thursday', 'friday')})
+    assert_same_peak(sched)
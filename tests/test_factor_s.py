@@ -0,0 +1,72 @@
+import geopandas as gpd
+import pandas as pd
+
+from gtfs_pipeline.analysis import bus_compute_factor_s, rail_compute_factor_s
+
+RAIL_TYPES = [0, 1, 2, 5, 12]
+
+
+def _norm_set(x):
+    if isinstance(x, (list, set, tuple)):
+        return set(x)
+    return set() if pd.isna(x) else {x}
+
+def reference_bus_factor_s(busstops, busstops_all, railstops, isos_100_rail, target_crs):
+    # The buffer + sjoin + row-wise set implementation the STRtree / sparse version replaced
+    B, B_all = busstops.to_crs(target_crs), busstops_all.to_crs(target_crs)
+    R, ISO = railstops.to_crs(target_crs), isos_100_rail.to_crs(target_crs)
+    Bbuf = B[['stop_id', 'geometry']].copy()
+    Bbuf['geometry'] = Bbuf.geometry.buffer(3000)
+    rail_in_3km = gpd.sjoin(R[['stop_id', 'geometry']], Bbuf, how='inner', predicate='within', lsuffix='rail', rsuffix='bus')
+    bus_to_rails = rail_in_3km.groupby('stop_id_bus')['stop_id_rail'].apply(list).to_dict()
+    near_bus = gpd.sjoin(B_all[['stop_id', 'routes', 'geometry']], ISO[['stop_id', 'geometry']],
+                         how='inner', predicate='within', lsuffix='bus', rsuffix='rail')
+    rail_routes_map = (near_bus.groupby('stop_id_rail')['routes']
+                       .apply(lambda s: set().union(*[_norm_set(v) for v in s])).to_dict())
+
+    def score_row(row):
+        rails = bus_to_rails.get(row['stop_id'], [])
+        if not rails:
+            return 1.0
+        union_routes = set().union(*[rail_routes_map.get(r, set()) for r in rails])
+        return 1.0 + 0.5 * min(len(_norm_set(row['routes']) & union_routes), 2)
+
+    out = B[['stop_id', 'routes']].copy()
+    out['factor_s'] = out.apply(score_row, axis=1)
+    return out[['stop_id', 'factor_s']]
+
+def reference_rail_factor_s(stops_gdf, rail_100_iso):
+    bus = stops_gdf[stops_gdf['route_type'] == 3]
+    joined = gpd.sjoin(bus[['stop_id', 'geometry']], rail_100_iso[['stop_id', 'geometry']],
+                       how='inner', predicate='within', lsuffix='bus', rsuffix='rail')
+    counts = joined.groupby('stop_id_rail').size().rename('S_r').reset_index()
+    counts['factor_s'] = 1 + 0.5 * counts['S_r'].clip(upper=2)
+    counts = counts.rename(columns={'stop_id_rail': 'stop_id'})
+    return rail_100_iso[['stop_id']].merge(counts[['stop_id', 'factor_s']], on='stop_id', how='left').fillna({'factor_s': 1})
+
+def _frames(feed, isochrones):
+    _, stops = feed
+    bus = stops[stops['route_type'] == 3]
+    rail = stops[stops['route_type'].isin(RAIL_TYPES)]
+    return stops, bus, rail, isochrones[2], bus.estimate_utm_crs()
+
+def assert_same_factor_s(actual, expected):
+    pd.testing.assert_frame_equal(actual.reset_index(drop=True), expected.reset_index(drop=True), check_dtype=False)
+
+def test_bus_factor_s_matches_reference(feed, isochrones):
+    stops, bus, rail, isos_100_rail, crs = _frames(feed, isochrones)
+    expected = reference_bus_factor_s(bus, bus, rail, isos_100_rail, crs)
+    assert (expected['factor_s'] > 1).any()
+    assert_same_factor_s(bus_compute_factor_s(bus, bus, rail, isos_100_rail, crs), expected)
+
+    # Stops scored against a wider set of bus stops, as for a study area inside the feed
+    assert_same_factor_s(
+        bus_compute_factor_s(bus.iloc[::2], bus, rail, isos_100_rail, crs),
+        reference_bus_factor_s(bus.iloc[::2], bus, rail, isos_100_rail, crs),
+    )
+
+def test_rail_factor_s_matches_reference(feed, isochrones):
+    stops, bus, rail, isos_100_rail, crs = _frames(feed, isochrones)
+    expected = reference_rail_factor_s(stops, isos_100_rail)
+    assert (expected['factor_s'] > 1).any()
+    assert_same_factor_s(rail_compute_factor_s(stops, isos_100_rail), expected)
@@ -0,0 +1,57 @@
+import pandas as pd
+
+from gtfs_pipeline.analysis import stop_significance, TIME_WINDOWS
+from gtfs_pipeline.incremental import incremental_scores
+from gtfs_pipeline.results import combine_scores
+
+from tests.conftest import TAG
+
+
+def _inputs(feed, isochrones):
+    merged, stops = feed
+    isos_700_rail, isos_700_bus, isos_100_rail = isochrones
+    return dict(stops_within_iso=stops, stops_bymode=stops, isos_100_rail=isos_100_rail,
+                iso_700_bus=isos_700_bus, iso_700_rail=isos_700_rail, sched_merged=merged)
+
+def _changed(inputs):
+    # A weekly update: one route loses its late trips, and a bus stop and a rail station close
+    sched, stops = inputs['sched_merged'], inputs['stops_bymode']
+    route = sched['route_id'].iloc[0]
+    sched = sched[~((sched['route_id'] == route) & (sched['arrival_time'] > 15 * 3600))]
+    closed = [stops.loc[stops['route_type'] == 3, 'stop_id'].iloc[5], stops.loc[stops['route_type'] != 3, 'stop_id'].iloc[3]]
+    sched = sched[~sched['stop_id'].isin(closed)]
+    keep = {name: frame[~frame['stop_id'].isin(closed)] for name, frame in inputs.items() if name != 'sched_merged'}
+    return {**keep, 'sched_merged': sched}
+
+def _full(inputs, streets):
+    # What a run without incremental state produces
+    bus, rail = stop_significance(**inputs, target_crs=streets.crs, tag=TAG, amenity_scores_path=None,
+                                  amenity_inventory_path=None, time_windows=TIME_WINDOWS)
+    return combine_scores(bus, rail, streets)
+
+def _incremental(state_dir, inputs, streets):
+    *_, attributes, score = incremental_scores(
+        str(state_dir), **inputs, target_crs=streets.crs, tag=TAG, streets=streets,
+        amenity_scores_path=None, amenity_inventory_path=None, time_windows=TIME_WINDOWS,
+    )
+    return attributes, score
+
+def assert_same_scores(left, right):
+    for a, b in zip(left, right):
+        a = a.sort_values('link_id', kind='stable').reset_index(drop=True)
+        b = b.sort_values('link_id', kind='stable').reset_index(drop=True)
+        pd.testing.assert_frame_equal(a, b[a.columns], check_dtype=False)
+
+def test_incremental_matches_full_run(feed, isochrones, streets, tmp_path):
+    inputs = _inputs(feed, isochrones)
+    assert_same_scores(_incremental(tmp_path, inputs, streets), _full(inputs, streets))
+
+    # Only the changed stops and their neighbours are re-scored, with the same result as scoring everything
+    changed = _changed(inputs)
+    patched = _incremental(tmp_path, changed, streets)
+    full = _full(changed, streets)
+    assert not patched[0]['Transit_attribute'].equals(_full(inputs, streets)[0]['Transit_attribute'])
+    assert_same_scores(patched, full)
+
+    # Nothing changed since
+    assert_same_scores(_incremental(tmp_path, changed, streets), full)
@@ -0,0 +1,25 @@
+import numpy as np
+import shapely
+
+from gtfs_pipeline.interpolation import sample_lines
+
+
+def reference_samples(line, interval):
+    # The per-line loop sample_lines replaced: every interval from the start, then the end point
+    points = [line.interpolate(d) for d in np.arange(0, line.length, interval)]
+    return points + [shapely.Point(line.coords[-1])]
+
+def test_sample_lines_matches_reference(streets):
+    lines = streets.geometry.to_numpy()
+    line_idx, points = sample_lines(lines, 10)
+    for i, line in enumerate(lines):
+        expected = reference_samples(line, 10)
+        assert shapely.equals_exact(points[line_idx == i], expected, tolerance=1e-9).all()
+
+def test_multipart_lines_get_every_point():
+    lines = shapely.from_wkt(['LINESTRING (0 0, 0 25)', 'MULTILINESTRING ((0 0, 10 0), (20 0, 20 15))', 'LINESTRING EMPTY'])
+    line_idx, points = sample_lines(lines, 10)
+    assert not shapely.is_missing(points).any()
+    assert line_idx.tolist() == [0, 0, 0, 0, 1, 1, 1, 1]
+    # Distances run along the parts in order; the last point is the end of the last part
+    assert shapely.equals(points[line_idx == 1], shapely.points([(0, 0), (10, 0), (20, 10), (20, 15)])).all()
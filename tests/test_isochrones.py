@@ -0,0 +1,50 @@
+import networkx as nx
+import osmnx as ox
+import geopandas as gpd
+import pandas as pd
+from shapely.geometry import Point, box
+
+from gtfs_pipeline.cache import DiskCache
+from gtfs_pipeline.network import compute_isochrones, compute_isochrones_cached, RAIL_TYPES
+
+
+def assert_same_isochrones(left, right):
+    for a, b in zip(left, right):
+        a, b = a.reset_index(drop=True), b.reset_index(drop=True)
+        pd.testing.assert_frame_equal(a.drop(columns='geometry'), b.drop(columns='geometry'), check_dtype=False)
+        assert a.geometry.geom_equals_exact(b.geometry, tolerance=0).all()
+
+def test_parallel_matches_serial(feed, walk_graph, isochrones):
+    _, stops = feed
+    assert_same_isochrones(compute_isochrones(stops, walk_graph, n_workers=2), isochrones)
+
+def test_cached_matches_uncached(feed, walk_graph, isochrones, tmp_path):
+    _, stops = feed
+    source = str(tmp_path / "walk.graphml")
+    ox.save_graphml(walk_graph, source)
+    # The whole graph lies inside the study area, so clipping keeps every node
+    nodes = ox.convert.graph_to_gdfs(walk_graph, edges=False)
+    buffer = gpd.GeoDataFrame(geometry=[box(*nodes.total_bounds).buffer(0.01)], crs=nodes.crs)
+    cache = DiskCache(str(tmp_path / "cache"))
+
+    cold = compute_isochrones_cached(stops, buffer, cache, source=source)
+    warm = compute_isochrones_cached(stops, buffer, cache, source=source, n_workers=2)
+    assert_same_isochrones(cold, isochrones)
+    assert_same_isochrones(warm, isochrones)
+
+def test_matches_ego_graph_hulls(feed, walk_graph, isochrones):
+    # The per-stop ego_graph hulls the batched traversal replaced, on a sample of stops
+    _, stops = feed
+    rail_700, bus_700, rail_100 = (iso.set_index('stop_id').geometry for iso in isochrones)
+
+    sample = pd.concat([stops[stops['route_type'] == 3].head(10), stops[stops['route_type'].isin(RAIL_TYPES)].head(10)])
+    for sid, geom, rtype in zip(sample['stop_id'].astype(str), sample.geometry, sample['route_type']):
+        center = ox.distance.nearest_nodes(walk_graph, X=geom.x, Y=geom.y)
+        catchments = [(700, rail_700), (100, rail_100)] if rtype in RAIL_TYPES else [(700, bus_700)]
+        for radius, hulls in catchments:
+            sub = nx.ego_graph(walk_graph, center, radius=radius, distance='length')
+            hull = gpd.GeoSeries([Point(d['x'], d['y']) for _, d in sub.nodes(data=True)]).union_all().convex_hull
+            if hull.geom_type != "Polygon":
+                assert sid not in hulls.index
+                continue
+            assert hulls[sid].equals(hull), (sid, radius)
@@ -0,0 +1,29 @@
+import pandas as pd
+import pytest
+
+from gtfs_pipeline.results import combine_scores
+
+
+def assert_same_scores(left, right):
+    for a, b in zip(left, right):
+        pd.testing.assert_frame_equal(a, b)
+        assert a.crs == b.crs
+
+@pytest.mark.parametrize("engine, decay", [('vector', None), ('vector', 'gaussian'), ('raster', None)])
+@pytest.mark.parametrize("tile_size", [400.0, 1000.0])
+def test_tiled_matches_untiled(feed, scored_isochrones, streets, engine, decay, tile_size):
+    _, stops = feed
+    bus, rail = scored_isochrones
+    settings = dict(engine=engine, decay=decay, stops=stops)
+    untiled = combine_scores(bus, rail, streets, **settings)
+    assert (untiled[0]['Transit_attribute'] > 0).any()
+    assert_same_scores(combine_scores(bus, rail, streets, tile_size=tile_size, **settings), untiled)
+
+def test_tiled_without_streets_matches_untiled(scored_isochrones, streets):
+    bus, rail = scored_isochrones
+    empty = streets.iloc[:0]
+    tiled = combine_scores(bus, rail, empty, tile_size=500.0)
+    untiled = combine_scores(bus, rail, empty)
+    assert len(tiled[0]) == 0
+    for a, b in zip(tiled, untiled):
+        assert list(a.columns) == list(b.columns) and a.crs == b.crs
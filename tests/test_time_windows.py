@@ -0,0 +1,36 @@
+import pandas as pd
+
+from gtfs_pipeline.analysis import compute_factor_f, calendar_idle, TIME_WINDOWS, SERVICE_DAYS
+
+
+def _weekday_only(merged):
+    return merged[merged['service_id'].astype(str).str.endswith('WK')]
+
+def test_weekday_only_feed_has_no_weekend_service(feed):
+    merged, _ = feed
+    weekday = _weekday_only(merged)
+    assert calendar_idle(weekday) == ['saturday', 'sunday']
+
+    f = compute_factor_f(weekday, windows=TIME_WINDOWS)
+    assert (f['stop_rate_h_weekend'] == 0).all()
+    assert (f['factor_f_weekend'] == 0).all()
+    assert (f['stop_rate_h_midday'] > 0).any()
+
+def test_weekday_windows_match_the_full_feed(feed):
+    # The weekday trips of the full feed are exactly the weekday-only feed
+    merged, _ = feed
+    weekday = _weekday_only(merged)
+    full = compute_factor_f(merged, all_stop_ids=pd.Index(weekday['stop_id'].unique()), windows=TIME_WINDOWS)
+    only = compute_factor_f(weekday, windows=TIME_WINDOWS)
+    columns = ['stop_id', 'stop_rate_h', 'factor_f'] + [
+        f'{c}_{w.name}' for w in TIME_WINDOWS if w.name != 'weekend' for c in ('stop_rate_h', 'factor_f')
+    ]
+    pd.testing.assert_frame_equal(full[columns], only[columns])
+
+def test_calendar_without_days_counts_every_trip(feed):
+    # calendar_dates.txt feeds leave every calendar day at 0; all trips still count
+    merged, _ = feed
+    undated = merged.assign(**{day: 0 for day in SERVICE_DAYS})
+    assert calendar_idle(undated) == []
+    f = compute_factor_f(undated, windows=TIME_WINDOWS)
+    assert (f['stop_rate_h_weekend'] > 0).any()